@@ -0,0 +1,286 @@
+"""
+Precomputed aggregates of classified transactions.
+
+A MonthlyCube holds the classified amounts by (base P&L line, month) for one
+dataset + mappings version. Date-range queries are answered by slicing the
+cube: months entirely inside the range are taken as-is, and only the rows of
+partially covered edge months are re-filtered by date.
+
+A DailyCube holds the same amounts by (base line, competence day). Coarser
+periods (week, month, quarter, year) are rolled up from it level by level,
+never recomputed from transactions.
+
+Amounts are int64 centavos and all aggregation is exact integer summation.
+
+Both cubes accept the frozen aggregates of closed months (see
+period_close.py); the columns of those months come from the frozen values
+instead of the rows.
+
+period_comparisons derives MoM/YoY/YTD/TTM columns from a complete monthly
+P&L matrix with calendar shifts and cumulative sums.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pnl_formulas import NUM_LINES, RATIO_LINES, evaluate_formulas
+
+# Period hierarchy: granularity -> (parent granularity, pandas period freq)
+ROLLUPS = {
+    "day": (None, "D"),
+    "week": ("day", "W-SUN"),
+    "month": ("day", "M"),
+    "quarter": ("month", "Q"),
+    "year": ("quarter", "Y"),
+}
+GRANULARITIES = list(ROLLUPS)
+
+# Period comparison columns: MoM/YoY are changes vs the month 1/12 months
+# earlier, YTD/TTM are running totals (margins recomputed over the totals)
+COMPARISONS = ["mom", "yoy", "ytd", "ttm"]
+
+
+def sum_by_key(keys: np.ndarray, amounts: np.ndarray, size: int) -> np.ndarray:
+    """Exact int64 sums of amounts grouped by integer key in [0, size)."""
+    result = np.zeros(size, dtype=np.int64)
+    if len(keys):
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_keys)) + 1]
+        result[sorted_keys[starts]] = np.add.reduceat(amounts[order], starts)
+    return result
+
+
+class MonthlyCube:
+    """
+    Lines x months int64 matrix of classified amounts plus a per-month row index.
+
+    Built from per-row arrays: month ordinal (-1 when missing), competence
+    date, P&L line (0 when unmapped) and amount in centavos. Row arrays are kept sorted
+    by month so that the rows of one month are a contiguous slice.
+
+    `frozen` maps closed months to (days, lines x days values, month column):
+    their rows are ignored and date filters use the frozen day columns.
+    """
+
+    def __init__(self, months: List[str], month_pos: np.ndarray, dates: np.ndarray, lines: np.ndarray, amounts: np.ndarray,
+                 frozen: Optional[Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]] = None):
+        frozen = frozen or {}
+        self.months = sorted(set(months) | set(frozen))
+        n_months = len(self.months)
+        if frozen:
+            index = {m: idx for idx, m in enumerate(self.months)}
+            remap = np.array([index[m] for m in months] + [-1], dtype=np.int64)
+            month_pos = remap[month_pos]
+        self._frozen = {self.months.index(m): value for m, value in frozen.items()}
+
+        has_month = (month_pos >= 0) & ~np.isin(month_pos, list(self._frozen))
+        amounts = np.where(lines > 0, amounts, 0).astype(np.int64)
+
+        order = np.argsort(month_pos[has_month], kind='stable')
+        self._month_pos = month_pos[has_month][order]
+        self._dates = dates[has_month][order]
+        self._lines = lines[has_month][order]
+        self._amounts = amounts[has_month][order]
+        self._offsets = np.searchsorted(self._month_pos, np.arange(n_months + 1))
+
+        self.values = sum_by_key(
+            self._lines * n_months + self._month_pos, self._amounts, NUM_LINES * n_months
+        ).reshape(NUM_LINES, n_months)
+
+        # Date bounds per month (over dated rows) and count of undated rows
+        dated = ~np.isnat(self._dates)
+        self._undated = np.bincount(self._month_pos[~dated], minlength=n_months)
+        self._min_date = np.full(n_months, np.datetime64('NaT'), dtype='datetime64[ns]')
+        self._max_date = np.full(n_months, np.datetime64('NaT'), dtype='datetime64[ns]')
+        if dated.any():
+            pos = self._month_pos[dated]
+            dts = self._dates[dated]
+            starts = np.r_[0, np.flatnonzero(np.diff(pos)) + 1]
+            self._min_date[pos[starts]] = np.minimum.reduceat(dts, starts)
+            self._max_date[pos[starts]] = np.maximum.reduceat(dts, starts)
+
+        for month_idx, (days, day_values, column) in self._frozen.items():
+            self.values[:, month_idx] = column
+            if len(days):
+                self._min_date[month_idx] = days.min()
+                self._max_date[month_idx] = days.max()
+            # Frozen undated amounts keep the month from being taken whole by a date filter
+            self._undated[month_idx] = int((day_values.sum(axis=1) != column).any())
+
+    def _rows(self, month_idx: int) -> slice:
+        return slice(self._offsets[month_idx], self._offsets[month_idx + 1])
+
+    def slice(self, start_date: str = None, end_date: str = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Months and a fresh lines x months matrix for an inclusive date range,
+        matching a row-level filter on 'Data de competência'.
+        """
+        if not start_date and not end_date:
+            return list(self.months), self.values.copy()
+
+        start = np.datetime64(pd.to_datetime(start_date), 'ns') if start_date else None
+        end = np.datetime64(pd.to_datetime(end_date), 'ns') if end_date else None
+
+        # NaT comparisons are False, so months without dated rows are never "full"
+        full = self._undated == 0
+        if start is not None:
+            full &= self._min_date >= start
+        if end is not None:
+            full &= self._max_date <= end
+
+        outside = np.zeros(len(self.months), dtype=bool)
+        if start is not None:
+            outside |= self._max_date < start
+        if end is not None:
+            outside |= self._min_date > end
+
+        present = full.copy()
+        result = np.zeros_like(self.values)
+        result[:, full] = self.values[:, full]
+
+        # Partially covered months: re-filter only their rows (or frozen days) by date
+        for month_idx in np.flatnonzero(~full & ~outside):
+            if month_idx in self._frozen:
+                days, day_values, _ = self._frozen[month_idx]
+                keep = np.ones(len(days), dtype=bool)
+                if start is not None:
+                    keep &= days >= start
+                if end is not None:
+                    keep &= days <= end
+                if keep.any():
+                    present[month_idx] = True
+                    result[:, month_idx] = day_values[:, keep].sum(axis=1)
+                continue
+            rows = self._rows(month_idx)
+            dates = self._dates[rows]
+            keep = ~np.isnat(dates)
+            if start is not None:
+                keep &= dates >= start
+            if end is not None:
+                keep &= dates <= end
+            if keep.any():
+                present[month_idx] = True
+                result[:, month_idx] = sum_by_key(
+                    self._lines[rows][keep], self._amounts[rows][keep], NUM_LINES
+                )
+
+        return [m for m, p in zip(self.months, present) if p], result[:, present]
+
+
+class DailyCube:
+    """
+    Lines x days matrix of classified amounts, over the days that have
+    dated rows (rows without a competence date are not placed on any day).
+    `extra` is a (days, lines x days values) pair added in, e.g. the frozen
+    days of closed months.
+    """
+
+    def __init__(self, dates: np.ndarray, lines: np.ndarray, amounts: np.ndarray,
+                 extra: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        dated = ~np.isnat(dates)
+        amounts = np.where(lines > 0, amounts, 0).astype(np.int64)
+        row_days = dates[dated].astype('datetime64[D]')
+        extra_days = extra[0].astype('datetime64[D]') if extra is not None else row_days[:0]
+
+        self.days, day_pos = np.unique(np.concatenate([row_days, extra_days]), return_inverse=True)
+        n_days = len(self.days)
+        self.values = sum_by_key(
+            lines[dated] * n_days + day_pos[:len(row_days)], amounts[dated], NUM_LINES * n_days
+        ).reshape(NUM_LINES, n_days)
+        if extra is not None:
+            np.add.at(self.values.T, day_pos[len(row_days):], extra[1].T)
+
+    def rollup(self, granularity: str = "day", start_date: str = None, end_date: str = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Period labels and a fresh lines x periods matrix for an inclusive
+        date range, aggregated to the given granularity.
+        """
+        if granularity not in ROLLUPS:
+            raise ValueError(f"Unknown granularity '{granularity}' (expected one of {', '.join(GRANULARITIES)})")
+
+        lo, hi = 0, len(self.days)
+        if start_date:
+            lo = np.searchsorted(self.days, np.datetime64(pd.to_datetime(start_date), 'D'), side='left')
+        if end_date:
+            hi = np.searchsorted(self.days, np.datetime64(pd.to_datetime(end_date), 'D'), side='right')
+        hi = max(lo, hi)
+
+        periods, values = self._rollup(granularity, self.days[lo:hi], self.values[:, lo:hi])
+        if granularity == "week":
+            labels = [str(p.start_time.date()) for p in periods]
+        else:
+            labels = [str(p) for p in periods]
+        return labels, values
+
+    def _rollup(self, granularity: str, days: np.ndarray, values: np.ndarray) -> Tuple[pd.PeriodIndex, np.ndarray]:
+        parent, freq = ROLLUPS[granularity]
+        if parent is None:
+            return pd.PeriodIndex(days, freq=freq), values.copy()
+
+        # Periods are sorted, so each one is a contiguous run of parent columns
+        parent_periods, parent_values = self._rollup(parent, days, values)
+        periods = parent_periods.asfreq(freq)
+        if len(periods) == 0:
+            return periods, parent_values
+        starts = np.r_[0, np.flatnonzero(periods[1:] != periods[:-1]) + 1]
+        return periods[starts], np.add.reduceat(parent_values, starts, axis=1)
+
+
+def _shift(matrix: np.ndarray, months: int) -> np.ndarray:
+    """Columns shifted right by `months` (zeros shifted in)."""
+    shifted = np.zeros_like(matrix)
+    if months < matrix.shape[1]:
+        shifted[:, months:] = matrix[:, :matrix.shape[1] - months]
+    return shifted
+
+
+def period_comparisons(months: List[str], values: np.ndarray, kinds: List[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Comparison matrices for a complete lines x months P&L matrix (derived
+    lines and margins evaluated), aligned with `months`.
+
+    Months are laid on a dense calendar first, so shifts are by calendar
+    month and months without transactions count as zero. Returns
+    {kind: (matrix, available)} where `available` flags months whose
+    comparison window lies inside the data (e.g. no YoY for the first year).
+    """
+    unknown = set(kinds) - set(COMPARISONS)
+    if unknown:
+        raise ValueError(f"Unknown comparison(s) {', '.join(sorted(unknown))} (expected {', '.join(COMPARISONS)})")
+    if not months:
+        return {kind: (values.copy(), np.zeros(0, dtype=bool)) for kind in kinds}
+
+    periods = pd.PeriodIndex(months, freq='M')
+    first = periods.min()
+    pos = np.asarray((periods.year - first.year) * 12 + (periods.month - first.month))
+    n_calendar = int(pos.max()) + 1
+    calendar = np.zeros((values.shape[0], n_calendar), dtype=values.dtype)
+    calendar[:, pos] = values
+
+    index = np.arange(n_calendar)
+    result = {}
+
+    for kind in kinds:
+        if kind in ("mom", "yoy"):
+            lag = 1 if kind == "mom" else 12
+            matrix = calendar - _shift(calendar, lag)
+            available = index >= lag
+        else:
+            totals = np.cumsum(calendar, axis=1)
+            if kind == "ytd":
+                # Subtract the running total at the end of the previous year
+                year_start = index - (first.month - 1 + index) % 12
+                before = np.where(year_start > 0, totals[:, np.maximum(year_start - 1, 0)], 0)
+                matrix = totals - before
+                available = year_start >= 0
+            else:
+                matrix = totals - _shift(totals, 12)
+                available = index >= 11
+            # Margins of a running total are ratios of its totals, not sums of margins
+            evaluate_formulas(matrix, lines=RATIO_LINES)
+        result[kind] = (matrix[:, pos], available[pos])
+
+    return result
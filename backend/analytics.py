@@ -0,0 +1,136 @@
+"""
+Ad-hoc pivots over the persisted dataset with DuckDB.
+
+A pivot groups the transactions by any of the whitelisted dimensions x
+competence month and evaluates the requested measures. DuckDB reads the
+month partitions' Parquet files directly (only the partitions inside the
+requested month range, and only the referenced columns) and runs the
+aggregation vectorized over all cores. Amounts are summed as integer
+centavos and converted to reais in the response.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict
+
+import duckdb
+
+from models import PivotRequest, PivotResponse, PivotRow
+from storage import PARTITION_COLUMN, UNDATED, dataset_months, is_month, partition_files
+
+# API dimension -> dataset column
+DIMENSIONS = {
+    "categoria": "Categoria 1",
+    "conta": "Conta bancária",
+    "forma_pagamento": "Forma de pgto/recbto",
+    "situacao": "Situação",
+    "centro_custo": "Centro de Custo 1",
+    "fornecedor": "Nome do fornecedor/cliente",
+    "tipo": "Tipo da operação",
+}
+
+# API measure -> SQL aggregate over the `valor` centavos column, and whether it is money
+MEASURES = {
+    "total": ("SUM(valor)", True),
+    "entradas": ("SUM(valor) FILTER (WHERE valor > 0)", True),
+    "saidas": ("SUM(valor) FILTER (WHERE valor < 0)", True),
+    "media": ("AVG(valor)", True),
+    "count": ("COUNT(*)", False),
+}
+
+# DuckDB worker threads (defaults to all cores)
+ANALYTICS_THREADS = int(os.getenv("ANALYTICS_THREADS", "0"))
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def validate_pivot(request: PivotRequest):
+    """Raise ValueError for unknown dimensions or measures, or a malformed month range."""
+    unknown = [d for d in list(request.dimensions) + list(request.filters) if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s) {', '.join(unknown)} (expected {', '.join(DIMENSIONS)})")
+    unknown = [m for m in request.measures if m not in MEASURES]
+    if unknown:
+        raise ValueError(f"Unknown measure(s) {', '.join(unknown)} (expected {', '.join(MEASURES)})")
+    if not request.measures:
+        raise ValueError("At least one measure is required")
+    for name in ("start_month", "end_month"):
+        value = getattr(request, name)
+        if value and not is_month(value):
+            raise ValueError(f"Invalid {name} '{value}' (expected YYYY-MM)")
+
+
+def run_pivot(dataset_dir: Path, request: PivotRequest) -> PivotResponse:
+    """Evaluate a pivot over the month partitions in the request's range."""
+    validate_pivot(request)
+    months = [
+        m for m in dataset_months(dataset_dir)
+        if m != UNDATED
+        and (not request.start_month or m >= request.start_month)
+        and (not request.end_month or m <= request.end_month)
+    ]
+    if not months:
+        return PivotResponse(headers=[], rows=[])
+
+    files = [str(path) for path in partition_files(dataset_dir, months)]
+    con = duckdb.connect()
+    try:
+        if ANALYTICS_THREADS > 0:
+            con.execute(f"SET threads = {ANALYTICS_THREADS}")
+        con.read_parquet(files, union_by_name=True).create_view("dataset")
+        columns = {name for (name,) in con.execute("SELECT column_name FROM (DESCRIBE dataset)").fetchall()}
+
+        missing = [d for d in list(request.dimensions) + list(request.filters) if DIMENSIONS[d] not in columns]
+        if missing:
+            raise ValueError(f"Dimension(s) not in the dataset: {', '.join(missing)}")
+        # Older datasets only have Valor_Num (reais)
+        valor = "Valor_Centavos" if "Valor_Centavos" in columns else "CAST(round(Valor_Num * 100) AS BIGINT)"
+
+        dims = [f"COALESCE(CAST({_quote(DIMENSIONS[d])} AS VARCHAR), '') AS d{i}" for i, d in enumerate(request.dimensions)]
+        measures = [f"{MEASURES[m][0]} AS m{i}" for i, m in enumerate(request.measures)]
+        where, params = [], []
+        for dimension, values in request.filters.items():
+            where.append(f"COALESCE(CAST({_quote(DIMENSIONS[dimension])} AS VARCHAR), '') IN ({', '.join('?' * len(values))})" if values else "FALSE")
+            params.extend(values)
+
+        group = [f"d{i}" for i in range(len(request.dimensions))] + ["month"]
+        sql = (
+            f"SELECT {', '.join(dims + [f'{_quote(PARTITION_COLUMN)} AS month'] + measures)} "
+            f"FROM (SELECT *, {valor} AS valor FROM dataset) "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+            f"GROUP BY {', '.join(group)} ORDER BY {', '.join(group)}"
+        )
+        result = con.execute(sql, params).fetchall()
+        totals = con.execute(
+            f"SELECT {', '.join(dims + measures)} FROM (SELECT *, {valor} AS valor FROM dataset) "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+            f"{'GROUP BY ' + ', '.join(group[:-1]) if request.dimensions else ''}",
+            params,
+        ).fetchall()
+    finally:
+        con.close()
+
+    n_dims = len(request.dimensions)
+    rows: Dict[tuple, PivotRow] = {}
+    for record in totals:
+        key = tuple(record[:n_dims])
+        rows[key] = PivotRow(
+            dimensions=dict(zip(request.dimensions, key)),
+            values={m: {} for m in request.measures},
+            totals={m: _measure_value(m, v) for m, v in zip(request.measures, record[n_dims:])},
+        )
+    for record in result:
+        row = rows[tuple(record[:n_dims])]
+        for m, v in zip(request.measures, record[n_dims + 1:]):
+            row.values[m][record[n_dims]] = _measure_value(m, v)
+
+    headers = sorted({record[n_dims] for record in result})
+    return PivotResponse(headers=headers, rows=[rows[key] for key in sorted(rows)])
+
+
+def _measure_value(measure: str, value) -> float:
+    if value is None:
+        return 0.0
+    return round(float(value) / 100, 2) if MEASURES[measure][1] else float(value)
@@ -0,0 +1,137 @@
+"""
+Budget (business plan) import and budget vs actual variance.
+
+The business plan P&L export ("00_Business_Plan_Umatch.xlsx-P&L.csv") has
+one row per plan item and one column per month (MM/YYYY) with BRL amounts
+("R$296.789,07"). Plan items are matched by label to the P&L lines they
+budget and loaded into the same lines x months int64 centavo matrix as the
+actuals; derived lines and margins come from the formula graph, so budget
+and actual are compared line by line in one vectorized computation.
+"""
+
+import csv
+import hashlib
+import io
+from typing import List
+
+import numpy as np
+
+from models import VarianceItem, VarianceResponse
+from money import CENTS, div_round, parse_brl, to_reais
+from pnl_formulas import NUM_LINES, PNL_LAYOUT, describe_row, evaluate_formulas
+
+# Plan row label (trimmed, lowercase) -> (P&L line, sign), on the line its
+# P&L row displays. Costs are negative. The plan splits operating expenses
+# into R&D and SG&A; R&D is what the P&L shows as other expenses.
+PLAN_LINES = {
+    "google": (112, 1),
+    "apple": (113, 1),
+    "invest income (rendimento de aplicação & cashback)": (38, 1),
+    "payment processing expenses (despesas de processamento de pagamento)": (102, -1),
+    "cogs (cmv)": (103, -1),
+    "marketing": (107, -1),
+    "wages": (108, -1),
+    "tech support & services": (109, -1),
+    "r&d": (110, -1),
+}
+
+
+class Budget:
+    """Budgeted lines x months matrix (int64 centavos, derived lines evaluated)."""
+
+    def __init__(self, months: List[str], values: np.ndarray, fingerprint: str):
+        self.months = list(months)
+        self.values = values
+        self.fingerprint = fingerprint
+
+    def slice(self, start_date: str = None, end_date: str = None):
+        """Months and a fresh matrix restricted to the months of a date range."""
+        keep = [
+            idx for idx, m in enumerate(self.months)
+            if (not start_date or m >= start_date[:7]) and (not end_date or m <= end_date[:7])
+        ]
+        return [self.months[idx] for idx in keep], self.values[:, keep].copy()
+
+
+def _plan_month(header: str) -> str:
+    """'05/2024' -> '2024-05' (None if the header is not a month)."""
+    parts = header.strip().split('/')
+    if len(parts) != 2 or not all(p.isdigit() for p in parts):
+        return None
+    return f"{int(parts[1]):04d}-{int(parts[0]):02d}"
+
+
+def load_budget(content: bytes) -> Budget:
+    """Parse a business plan P&L CSV into a Budget."""
+    text = content.decode('utf-8-sig', errors='replace')
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        raise ValueError("Empty budget file")
+
+    month_cols = [(col, _plan_month(h)) for col, h in enumerate(rows[0])]
+    month_cols = [(col, m) for col, m in month_cols if m]
+    if not month_cols:
+        raise ValueError("Budget file has no MM/YYYY month columns")
+
+    # Month columns may be out of order in hand-edited plans
+    month_cols.sort(key=lambda c: c[1])
+    months = [m for _, m in month_cols]
+    values = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+
+    found = set()
+    for row in rows[1:]:
+        if not row:
+            continue
+        label = row[0].strip().lower()
+        if label not in PLAN_LINES or label in found:
+            continue  # Only the first row with a label is the line total
+        found.add(label)
+        line, sign = PLAN_LINES[label]
+        amounts = [parse_brl(row[col]) if col < len(row) else 0 for col, _ in month_cols]
+        values[line] = sign * np.abs(np.array(amounts, dtype=np.int64))
+
+    if not found:
+        raise ValueError("No budget lines recognized in file")
+
+    # Plan lines are given; everything above them is derived
+    evaluate_formulas(values, skip=[line for line, _ in PLAN_LINES.values()])
+
+    return Budget(months, values, hashlib.sha1(content).hexdigest())
+
+
+def calculate_variance(actual_months: List[str], actual: np.ndarray, budget_months: List[str], budget: np.ndarray) -> VarianceResponse:
+    """
+    Actual, budget, absolute and percentage variance for every P&L row and
+    month (union of actual and budget months). Inputs are complete lines x
+    months centavo matrices; percentages are relative to |budget| and null
+    where the budget is 0. For margin rows the variance is in percentage points.
+    """
+    months = sorted(set(actual_months) | set(budget_months))
+    index = {m: idx for idx, m in enumerate(months)}
+
+    actual_all = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+    budget_all = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+    actual_all[:, [index[m] for m in actual_months]] = actual
+    budget_all[:, [index[m] for m in budget_months]] = budget
+
+    variance = actual_all - budget_all
+    # Percent in hundredths (same fixed-point scale as centavos)
+    variance_pct = div_round(variance * (100 * CENTS), np.abs(budget_all))
+    has_budget = budget_all != 0
+
+    rows = []
+    for item in PNL_LAYOUT:
+        line = item["line"]
+        pct = to_reais(variance_pct[line]).tolist()
+        rows.append(VarianceItem(
+            line_number=item["row"],
+            description=describe_row(item),
+            actual=dict(zip(months, to_reais(actual_all[line]).tolist())),
+            budget=dict(zip(months, to_reais(budget_all[line]).tolist())),
+            variance=dict(zip(months, to_reais(variance[line]).tolist())),
+            variance_pct={m: (p if ok else None) for m, p, ok in zip(months, pct, has_budget[line])},
+            is_header=item.get("is_header", False),
+            is_total=item.get("is_total", False)
+        ))
+
+    return VarianceResponse(headers=months, rows=rows)
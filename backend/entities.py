@@ -0,0 +1,150 @@
+"""
+Multi-entity P&L.
+
+Transactions are partitioned by bank account / legal entity ('Conta
+bancária'). Each partition is classified and aggregated into its own
+MonthlyCube in a process pool, so adding an entity adds parallel work
+rather than serial latency. The consolidated P&L is the sum of the
+entities' line x month matrices, optionally eliminating intercompany
+transfers (rows whose category is a transfer between own accounts).
+
+Closed months are not reclassified: rows carry the lines they had at the
+close (see period_close.reported_lines). A closed month whose rows changed
+since the close has no per-entity detail; its frozen aggregates are added
+to the consolidated P&L only, and cannot have intercompany eliminated.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregates import MonthlyCube
+from logic import TransactionStore, classify_transactions, normalize_text_helper
+from models import MappingItem
+from period_close import frozen_months
+from pnl_formulas import NUM_LINES
+
+ENTITY_COLUMN = 'Conta bancária'
+NO_ENTITY = 'Sem conta bancária'
+
+# Normalized 'Categoria 1' prefixes of intercompany transfers
+INTERCOMPANY_CATEGORIES = ('transferencia',)
+
+# Worker processes for per-entity aggregation (1 = run serially in-process)
+ENTITY_WORKERS = int(os.getenv("ENTITY_WORKERS", str(os.cpu_count() or 1)))
+
+# Below this many rows, process start-up and pickling outweigh the parallel work
+ENTITY_PARALLEL_MIN_ROWS = int(os.getenv("ENTITY_PARALLEL_MIN_ROWS", "50000"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool shared across requests (spawned once, on first use)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def entity_rows(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Row positions of each entity (rows without an account go to NO_ENTITY)."""
+    if ENTITY_COLUMN not in df.columns:
+        return {NO_ENTITY: np.arange(len(df))}
+    entity = df[ENTITY_COLUMN].fillna(NO_ENTITY).astype(str).str.strip().replace('', NO_ENTITY)
+    return dict(sorted(df.groupby(entity.to_numpy()).indices.items()))
+
+
+def build_entity_cubes(df: pd.DataFrame, mappings: List[MappingItem], lines: np.ndarray = None) -> Tuple[MonthlyCube, MonthlyCube]:
+    """
+    Classify one entity's transactions (unless their `lines` are given) and
+    aggregate them into a cube of all rows and a cube of its intercompany rows only.
+    """
+    store = TransactionStore(df)
+    if lines is None:
+        lines = classify_transactions(store, mappings)
+
+    intercompany = np.zeros(len(df), dtype=bool)
+    if 'Categoria 1' in df.columns:
+        category = df['Categoria 1'].map(normalize_text_helper)
+        intercompany = category.str.startswith(INTERCOMPANY_CATEGORIES).to_numpy(dtype=bool)
+
+    cube = MonthlyCube(store.months, store.month_pos, store.dates, lines, store.amounts)
+    eliminated = MonthlyCube(store.months, store.month_pos, store.dates, np.where(intercompany, lines, 0), store.amounts)
+    return cube, eliminated
+
+
+def build_all_entity_cubes(
+    df: pd.DataFrame, mappings: List[MappingItem], max_workers: int = None, lines: np.ndarray = None
+) -> Dict[str, Tuple[MonthlyCube, MonthlyCube]]:
+    """
+    Per-entity cubes, computed in parallel worker processes for large datasets.
+    `lines` (one per row of df) replaces the classification, e.g. with the
+    close-time lines of closed months.
+    """
+    partitions = {
+        name: (df.iloc[rows], None if lines is None else lines[rows]) for name, rows in entity_rows(df).items()
+    }
+    max_workers = ENTITY_WORKERS if max_workers is None else max_workers
+
+    if max_workers <= 1 or len(partitions) <= 1 or len(df) < ENTITY_PARALLEL_MIN_ROWS:
+        return {name: build_entity_cubes(part, mappings, part_lines) for name, (part, part_lines) in partitions.items()}
+
+    pool = _get_pool(max_workers)
+    futures = {
+        name: pool.submit(build_entity_cubes, part, mappings, part_lines) for name, (part, part_lines) in partitions.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _align(sliced: List[Tuple[List[str], np.ndarray]]) -> Tuple[List[str], List[np.ndarray]]:
+    """Place (months, matrix) pairs on the union of their months."""
+    months = sorted({m for ms, _ in sliced for m in ms})
+    index = {m: idx for idx, m in enumerate(months)}
+    aligned = []
+    for ms, values in sliced:
+        full = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+        full[:, [index[m] for m in ms]] = values
+        aligned.append(full)
+    return months, aligned
+
+
+def consolidate(
+    entity_cubes: Dict[str, Tuple[MonthlyCube, MonthlyCube]],
+    start_date: str = None,
+    end_date: str = None,
+    eliminate_intercompany: bool = False,
+    frozen: Dict[str, dict] = None,
+) -> Tuple[List[str], Dict[str, np.ndarray], np.ndarray]:
+    """
+    Base line x month matrices per entity and consolidated, on a common set
+    of months. The consolidated matrix is the sum of the entities plus the
+    `frozen` aggregates (closed months without per-entity rows, as stored by
+    period_close), minus the intercompany rows when `eliminate_intercompany` is set.
+    """
+    names = list(entity_cubes)
+    sliced = [entity_cubes[name][0].slice(start_date, end_date) for name in names]
+    if frozen:
+        empty = np.zeros(0, dtype=np.int64)
+        cube = MonthlyCube([], empty, np.zeros(0, dtype='datetime64[ns]'), empty, empty, frozen_months(frozen))
+        sliced.append(cube.slice(start_date, end_date))
+    added = len(sliced)
+    if eliminate_intercompany:
+        sliced += [entity_cubes[name][1].slice(start_date, end_date) for name in names]
+
+    months, aligned = _align(sliced)
+    per_entity = dict(zip(names, aligned[:len(names)]))
+    consolidated = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+    for values in aligned[:added]:
+        consolidated += values
+    for values in aligned[added:]:
+        consolidated -= values
+
+    return months, per_entity, consolidated
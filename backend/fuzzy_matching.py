@@ -0,0 +1,90 @@
+"""
+Fuzzy supplier matching for the P&L classifier.
+
+Supplier names drift between exports ("GOOGLE BRASIL PAGAMENTOS LTDA" vs
+"Google Brasil Pagtos"), so exact substring rules miss. This module builds
+a trigram blocking index per cost center over the specific mapping
+suppliers so that each distinct supplier string is only scored against a
+handful of candidates of its own cost center, and memoizes the outcome per
+(cost center, supplier) pair.
+"""
+
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Tuple
+
+# Minimum similarity (0-1) for a fuzzy match to be accepted
+DEFAULT_THRESHOLD = 0.8
+
+# Number of candidates (by shared trigrams) scored per supplier
+MAX_CANDIDATES = 5
+
+# Legal-form suffixes that carry no identity information
+STOPWORDS = {"ltda", "sa", "s/a", "me", "epp", "eireli", "inc", "llc", "ltd", "co"}
+
+
+def _clean(text: str) -> str:
+    """Drop punctuation and legal-form suffixes from a normalized name."""
+    tokens = re.split(r"[^a-z0-9]+", text)
+    return " ".join(t for t in tokens if t and t not in STOPWORDS)
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SupplierIndex:
+    """
+    Trigram blocking index over specific mapping suppliers, one per cost center.
+
+    Entries are (cost_center, supplier, mapping) triples, where cost center
+    and supplier are already normalized with normalize_text_helper. Blocking
+    happens inside the cost center, so similar suppliers of other cost
+    centers never crowd the right one out of the top candidates.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, object]], threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._entries = []
+        self._postings: Dict[str, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+        self._memo: Dict[Tuple[str, str], object] = {}
+
+        for cc, supplier, mapping in entries:
+            cleaned = _clean(supplier)
+            if not cleaned:
+                continue
+            entry_id = len(self._entries)
+            self._entries.append((cleaned, mapping))
+            for gram in _trigrams(cleaned):
+                self._postings[cc][gram].append(entry_id)
+
+    def _best(self, supplier: str, cc: str):
+        """Best mapping above threshold for a supplier among the cost center's entries."""
+        cleaned = _clean(supplier)
+        postings = self._postings.get(cc)
+        if not cleaned or not postings:
+            return None
+
+        # Blocking: only entries of this cost center sharing trigrams are scored
+        shared = defaultdict(int)
+        for gram in _trigrams(cleaned):
+            for entry_id in postings.get(gram, ()):
+                shared[entry_id] += 1
+        blocked = sorted(shared, key=lambda entry_id: (-shared[entry_id], entry_id))[:MAX_CANDIDATES]
+
+        best_score, best = 0.0, None
+        for entry_id in blocked:
+            entry_supplier, mapping = self._entries[entry_id]
+            score = SequenceMatcher(None, cleaned, entry_supplier).ratio()
+            if score > best_score:
+                best_score, best = score, mapping
+        return best if best_score >= self.threshold else None
+
+    def match(self, supplier: str, cc: str):
+        """Return the best fuzzy mapping for a supplier within a cost center, or None."""
+        key = (cc, supplier)
+        if key not in self._memo:
+            self._memo[key] = self._best(supplier, cc)
+        return self._memo[key]
@@ -1,18 +1,26 @@
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
 from datetime import datetime
 import io
+import os
 import logging
 from typing import List, Dict, Any
 from collections import defaultdict
 import unicodedata
 from models import MappingItem, PnLItem, PnLResponse, DashboardData
+from fuzzy_matching import SupplierIndex
+from pnl_formulas import NUM_LINES, PNL_LAYOUT, dependents, evaluate_formulas, describe_row, override_line
+from aggregates import MonthlyCube, DailyCube, period_comparisons
+from money import CENTS, parse_brl, to_centavos, to_reais
+from period_close import frozen_day_columns, frozen_months
 
 # Configure logging for financial calculations
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+# Optional fuzzy supplier tier in the classifier (see fuzzy_matching.py)
+FUZZY_SUPPLIER_MATCHING = os.getenv("FUZZY_SUPPLIER_MATCHING", "false").lower() in ("1", "true", "yes")
+
 def process_upload(file_content: bytes) -> pd.DataFrame:
     """
     Process the uploaded CSV file from Conta Azul.
@@ -123,42 +131,8 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
         s = unicodedata.normalize("NFKD", s)
         return "".join(ch for ch in s if not unicodedata.combining(ch))
     
-    def converter_valor_br(valor_str: Any) -> float:
-        if pd.isna(valor_str) or str(valor_str).strip() == "":
-            return 0.0
-
-        s = str(valor_str).replace('R$', '').strip()
-
-        negative = False
-        # (1.234,56) accounting negative
-        if s.startswith('(') and s.endswith(')'):
-            negative = True
-            s = s[1:-1].strip()
-
-        # 1.234,56- trailing minus
-        if s.endswith('-'):
-            negative = True
-            s = s[:-1].strip()
-
-        # Remove spaces
-        s = s.replace(' ', '')
-
-        # Brazilian vs US separators
-        if ',' in s and '.' in s:
-            if s.rfind(',') > s.rfind('.'):
-                s = s.replace('.', '').replace(',', '.')
-            else:
-                s = s.replace(',', '')
-        elif ',' in s:
-            s = s.replace(',', '.')
-
-        try:
-            v = float(s)
-            return -v if negative else v
-        except ValueError:
-            return 0.0
-
-    df['Valor_Num'] = df['Valor (R$)'].apply(converter_valor_br)
+    # Amounts are exact int64 centavos; Valor_Num (reais) is kept for display
+    df['Valor_Centavos'] = df['Valor (R$)'].apply(parse_brl).astype(np.int64)
 
     if 'Tipo' in df.columns:
         tipo = df['Tipo'].apply(normalize_text)
@@ -170,19 +144,20 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
             tipo.str.contains('pagamento')
         )
         # Entrada/Credito/Receita -> positive
-        sign = np.where(is_saida, -1.0, 1.0)
+        sign = np.where(is_saida, -1, 1)
 
         # IMPORTANT: ignore any embedded minus in the numeric string,
         # because Tipo is the source of truth.
-        df['Valor_Num'] = df['Valor_Num'].abs() * sign
+        df['Valor_Centavos'] = df['Valor_Centavos'].abs() * sign
         
         # Validation Log
         logger.info("Tipo normalization applied.")
         logger.info(f"Tipo counts: {tipo.value_counts().to_dict()}")
-        logger.info(f"Sum Valor_Num (signed): {df['Valor_Num'].sum():.2f}")
-        logger.info(f"Sum abs Valor_Num: {df['Valor_Num'].abs().sum():.2f}")
+        logger.info(f"Sum Valor (signed): {df['Valor_Centavos'].sum() / CENTS:.2f}")
+        logger.info(f"Sum abs Valor: {df['Valor_Centavos'].abs().sum() / CENTS:.2f}")
     else:
         logger.warning("CSV has no Tipo/Entrada-Saída column; using sign embedded in Valor (R$).")
+    df['Valor_Num'] = df['Valor_Centavos'] / CENTS
     df['Mes_Competencia'] = df['Data de competência'].dt.to_period('M')
     
     # Normalize text columns for mapping
@@ -335,256 +310,324 @@ def prepare_mappings(mappings: List[MappingItem]):
 
     return specific_by_cc, generic_by_cc
 
-def calculate_pnl(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, start_date: str = None, end_date: str = None) -> PnLResponse:
+def _normalize_column(series: pd.Series) -> pd.Series:
+    """Apply normalize_text_helper once per distinct value of a column."""
+    values = series.fillna('')
+    lookup = {v: normalize_text_helper(v) for v in pd.unique(values)}
+    return values.map(lookup)
+
+def _mapping_line(mapping) -> int:
+    """P&L line of a mapping, or 0 when missing/invalid."""
+    if mapping is None:
+        return 0
+    try:
+        line_num = int(mapping.linha_pl)
+    except (TypeError, ValueError):
+        return 0
+    return line_num if 1 <= line_num <= 120 else 0
+
+class TransactionStore:
     """
-    Calculate P&L based on dataframe and mappings.
-    Optionally filter by date range.
+    Read-only transaction table plus the derived columns the engine needs,
+    computed once per dataset instead of once per request:
+    normalized match keys, month ordinals, a per-month row index, competence
+    dates and amounts (int64 centavos, from Valor_Centavos or converted once
+    from Valor_Num). The wrapped DataFrame is never copied or modified.
     """
-    if df is None or df.empty:
-        return PnLResponse(headers=[], rows=[])
-    
-    # Apply date filter if provided
-    filtered_df = df.copy()
-    if start_date or end_date:
-        if start_date:
-            start = pd.to_datetime(start_date)
-            filtered_df = filtered_df[filtered_df['Data de competência'] >= start]
-        if end_date:
-            end = pd.to_datetime(end_date)
-            filtered_df = filtered_df[filtered_df['Data de competência'] <= end]
-
-    # Calculate months from filtered data
-    months = sorted(filtered_df['Mes_Competencia'].dropna().unique())
-    month_strs = [str(m) for m in months]
-
-    # Initialize data structure for calculations
-    # line_values[line_num][month_str] = value
-    line_values = {i: {m: 0.0 for m in month_strs} for i in range(1, 121)}
-
-    # Optimize Mapping Lookups
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+        # Month ordinal per row (-1 when missing)
+        month_codes, month_uniques = pd.factorize(df['Mes_Competencia'])
+        order = sorted(range(len(month_uniques)), key=lambda i: month_uniques[i])
+        self.months = [str(month_uniques[i]) for i in order]
+        ordinal = np.empty(len(order) + 1, dtype=np.int64)
+        ordinal[order] = np.arange(len(order))
+        ordinal[-1] = -1  # factorize codes missing months as -1
+        self.month_pos = ordinal[month_codes]
+
+        # Rows of each month (in row order), so month filters read only that month
+        self._month_order = np.argsort(self.month_pos, kind='stable')
+        self._month_offsets = np.searchsorted(self.month_pos[self._month_order], np.arange(len(order) + 1))
+
+        if 'Data de competência' in df.columns:
+            self.dates = pd.to_datetime(df['Data de competência'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+        else:
+            self.dates = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+        if 'Valor_Centavos' in df.columns:
+            self.amounts = df['Valor_Centavos'].fillna(0).to_numpy(dtype=np.int64)
+        else:
+            self.amounts = to_centavos(df['Valor_Num'])
+
+        # Normalized match keys: (cost center, supplier + description, supplier, category)
+        empty = pd.Series('', index=df.index)
+        cc_norm = _normalize_column(df['Centro de Custo 1'])
+        supp_norm = _normalize_column(df['Nome do fornecedor/cliente'])
+        desc_norm = _normalize_column(df['Descrição']) if 'Descrição' in df.columns else empty
+        self.has_category = 'Categoria 1' in df.columns
+        cat_norm = _normalize_column(df['Categoria 1']) if self.has_category else empty
+
+        # Combined text for looser matching (Supplier + Description)
+        match_text = (supp_norm + " " + desc_norm).str.strip()
+
+        keys = pd.MultiIndex.from_arrays([cc_norm, match_text, supp_norm, cat_norm])
+        self.key_codes, unique_keys = keys.factorize()
+        self.match_keys = list(unique_keys)
+
+    def __len__(self):
+        return len(self.df)
+
+    def month_rows(self, month: str) -> np.ndarray:
+        """Row positions of a 'YYYY-MM' month (empty if the month has no rows)."""
+        if month not in self.months:
+            return np.zeros(0, dtype=np.int64)
+        idx = self.months.index(month)
+        return self._month_order[self._month_offsets[idx]:self._month_offsets[idx + 1]]
+
+def classify_transactions(df, mappings: List[MappingItem], fuzzy_match: bool = None, rows: np.ndarray = None) -> np.ndarray:
+    """
+    Return the P&L line matched by each row of df (0 when unmapped).
+    df may be a DataFrame or a prebuilt TransactionStore. With `rows`, only
+    the keys of those row positions are classified and other rows get 0.
+
+    Matching order per row:
+    1. Specific mapping of the row's cost center (supplier contained in supplier + description)
+    2. Optional fuzzy supplier match within the same cost center
+    3. Generic ("Diversos") mapping of the cost center
+    4. Same steps using 'Categoria 1' as cost center, when the column exists
+
+    Rows are factorized by their distinct keys so each key is classified once.
+    """
+    if df is None or len(df) == 0:
+        return np.zeros(0, dtype=np.int64)
+    store = df if isinstance(df, TransactionStore) else TransactionStore(df)
+    return _classify(store, mappings, fuzzy_match, rows)[0]
+
+def _classify(store: TransactionStore, mappings: List[MappingItem], fuzzy_match: bool = None, rows: np.ndarray = None):
+    """classify_transactions on a store; also returns the matched mapping of each classified key code."""
+    if fuzzy_match is None:
+        fuzzy_match = FUZZY_SUPPLIER_MATCHING
     specific_mappings, generic_mappings = prepare_mappings(mappings)
+    specific_norm = {
+        cc: [(normalize_text_helper(m.fornecedor_cliente), m) for m in m_list]
+        for cc, m_list in specific_mappings.items()
+    }
+    fuzzy_index = None
+    if fuzzy_match:
+        fuzzy_index = SupplierIndex([
+            (cc, supp, m) for cc, items in specific_norm.items() for supp, m in items
+        ])
 
-    # DataFrame Enhancement for Matching
-    # Ensure necessary columns exist for detailed matching
-    if 'Descrição' not in filtered_df.columns:
-        filtered_df['Descrição'] = ''
-    
-    # Create normalized columns for robust matching (without modifying original too much)
-    # We use vectorization for performance
-    filtered_df['cc_norm'] = filtered_df['Centro de Custo 1'].fillna('').apply(normalize_text_helper)
-    filtered_df['supp_norm'] = filtered_df['Nome do fornecedor/cliente'].fillna('').apply(normalize_text_helper)
-    filtered_df['desc_norm'] = filtered_df['Descrição'].fillna('').apply(normalize_text_helper)
-    
-    # Combined text for looser matching (Supplier + Description)
-    filtered_df['match_text'] = (filtered_df['supp_norm'] + " " + filtered_df['desc_norm']).str.strip()
+    def match_specific(cc, text, supplier):
+        for m_supp_norm, m in specific_norm.get(cc, []):
+            # Check if the mapping supplier token exists in the row's supplier OR description
+            if m_supp_norm in text:
+                return m
+        if fuzzy_index is not None and supplier:
+            return fuzzy_index.match(supplier, cc)
+        return None
+
+    def match(cc, text, supplier, cat_cc):
+        mapping = match_specific(cc, text, supplier) or generic_mappings.get(cc)
+        # Fallback: try 'Categoria 1' as Cost Center (if available)
+        if mapping is None and store.has_category:
+            mapping = match_specific(cat_cc, text, supplier) or generic_mappings.get(cat_cc)
+        return mapping
+
+    codes = range(len(store.match_keys)) if rows is None else np.unique(store.key_codes[rows])
+    key_mappings = {code: match(*store.match_keys[code]) for code in codes}
+    unique_lines = np.zeros(len(store.match_keys), dtype=np.int64)
+    for code, mapping in key_mappings.items():
+        unique_lines[code] = _mapping_line(mapping)
+
+    if rows is None:
+        return unique_lines[store.key_codes], key_mappings
+    lines = np.zeros(len(store), dtype=np.int64)
+    lines[rows] = unique_lines[store.key_codes[rows]]
+    return lines, key_mappings
+
+def _open_rows(store: TransactionStore, closed: Dict[str, dict]) -> np.ndarray:
+    """Row positions outside the closed months."""
+    closed_pos = [store.months.index(m) for m in closed if m in store.months]
+    return np.flatnonzero(~np.isin(store.month_pos, closed_pos))
+
+def build_monthly_cube(df, mappings: List[MappingItem], fuzzy_match: bool = None, closed: Dict[str, dict] = None) -> MonthlyCube:
+    """
+    Classify df (a DataFrame or TransactionStore) once and aggregate it into
+    a MonthlyCube of amounts by (base line, month), reusable for any date range.
+    Closed months (frozen aggregates, see period_close.py) are not reclassified.
+    """
+    store = df if isinstance(df, TransactionStore) else TransactionStore(df)
+    rows = _open_rows(store, closed) if closed else None
+    lines, key_mappings = _classify(store, mappings, fuzzy_match, rows)
+    amounts = store.amounts
+    mapped = (lines > 0) & (store.month_pos >= 0)
+
+    # DEBUG: Log large matches and significant unmapped items
+    for row in np.flatnonzero(mapped & (np.abs(amounts) > 20000 * CENTS)):
+        code = store.key_codes[row]
+        mapping = key_mappings[code]
+        logger.info(
+            f"MATCH: Line {lines[row]} ({mapping.observacoes}) | Val: {amounts[row] / CENTS:.2f} "
+            f"| Basis: '{store.match_keys[code][1]}' matched '{mapping.fornecedor_cliente}'"
+        )
+    unmapped_large = (lines == 0) & (np.abs(amounts) > 10000 * CENTS)
+    if unmapped_large.any():
+        logger.debug(f"UNMAPPED: {int(unmapped_large.sum())} significant transactions without a mapping")
+
+    return MonthlyCube(store.months, store.month_pos, store.dates, lines, amounts, frozen_months(closed or {}))
 
-    # Iterate through DataFrame
-    for _, row in filtered_df.iterrows():
-        month = str(row['Mes_Competencia'])
-        if month not in month_strs:
+def build_daily_cube(df, mappings: List[MappingItem], fuzzy_match: bool = None, closed: Dict[str, dict] = None) -> DailyCube:
+    """
+    Classify df (a DataFrame or TransactionStore) once and aggregate it into
+    a DailyCube of amounts by (base line, competence day), from which day,
+    week, month, quarter and year views are rolled up. Closed months come
+    from their frozen day aggregates.
+    """
+    store = df if isinstance(df, TransactionStore) else TransactionStore(df)
+    if not closed:
+        lines = classify_transactions(store, mappings, fuzzy_match)
+        return DailyCube(store.dates, lines, store.amounts)
+    rows = _open_rows(store, closed)
+    lines = classify_transactions(store, mappings, fuzzy_match, rows)
+    return DailyCube(store.dates[rows], lines[rows], store.amounts[rows], frozen_day_columns(closed))
+
+def override_inputs(overrides: Dict[str, Dict[str, float]], month_strs: List[str], shape) -> tuple:
+    """(mask, values) centavo matrices of the override cells that fall in month_strs."""
+    mask = np.zeros(shape, dtype=bool)
+    pinned = np.zeros(shape, dtype=np.int64)
+    month_index = {m: idx for idx, m in enumerate(month_strs)}
+    for line_key, months_data in (overrides or {}).items():
+        line_num = override_line(line_key)
+        if line_num is None or not isinstance(months_data, dict):
             continue
-            
-        val = row['Valor_Num']
-        cc = row['cc_norm']
-        match_text = row['match_text']
-        
-        matched_mapping = None
-        
-        # 1. Try Specific Mappings within the matching Cost Center
-        # Get candidate mappings for this Cost Center
-        candidates = specific_mappings.get(cc, [])
-        for m in candidates:
-            m_supp_norm = normalize_text_helper(m.fornecedor_cliente)
-            # Check if filtered supplier token exists in the row's supplier OR description
-            if m_supp_norm in match_text:
-                matched_mapping = m
-                break
-        
-        # 2. If no specific match, try Generic Mapping for this Cost Center
-        if not matched_mapping:
-            matched_mapping = generic_mappings.get(cc)
-        
-        # 3. Fallback: If still no match, try 'Categoria 1' as Cost Center (if available)
-        if not matched_mapping and 'Categoria 1' in row:
-            cat_cc = normalize_text_helper(row['Categoria 1'])
-            # Try specific
-            candidates_cat = specific_mappings.get(cat_cc, [])
-            for m in candidates_cat:
-                m_supp_norm = normalize_text_helper(m.fornecedor_cliente)
-                if m_supp_norm in match_text:
-                    matched_mapping = m
-                    break
-            # Try generic
-            if not matched_mapping:
-                matched_mapping = generic_mappings.get(cat_cc)
+        for m, val in months_data.items():
+            if m in month_index:
+                mask[line_num, month_index[m]] = True
+                pinned[line_num, month_index[m]] = to_centavos([val])[0]
+    return mask, pinned
 
-        # 4. If match found, accumulate
-        if matched_mapping:
-            try:
-                line_num = int(matched_mapping.linha_pl)
-                line_values[line_num][month] += val
-                
-                # DEBUG: Log large matches
-                if abs(val) > 20000:
-                    description = matched_mapping.observacoes
-                    logger.info(f"MATCH: Line {line_num} ({description}) | Val: {val:.2f} | Basis: '{match_text}' matched '{matched_mapping.fornecedor_cliente}'")
-            except:
-                continue
-        else:
-            # Optionally log unmapped significant items
-            if abs(val) > 10000:
-                logger.debug(f"UNMAPPED: {val:.2f} | CC: {cc} | Text: {match_text}")
+def evaluate_pnl_matrix(values: np.ndarray, month_strs: List[str], overrides: Dict[str, Dict[str, float]] = None, params: Dict[str, float] = None) -> np.ndarray:
+    """
+    Complete a base lines x months centavo matrix in place: derived lines
+    and margins, with overrides (keyed by P&L row or line, then month) as
+    inputs of the formula graph, so edited cells flow into everything
+    computed from them.
+    """
+    mask, pinned = override_inputs(overrides, month_strs, values.shape)
+    values[mask] = pinned[mask]  # Overridden base lines
+    evaluate_formulas(values, params, pinned=(mask, pinned))
 
-    # ========================================================================
-    # CALCULATE DERIVED VALUES FOR EACH MONTH
-    # ========================================================================
-    
-    for m in month_strs:
-        
-        # ============================================
-        # FINANCIAL CALCULATIONS
-        # ============================================
-        
-        # 1. TOTAL REVENUE (Enforced positive)
-        google_rev = abs(line_values[25].get(m, 0.0))
-        apple_rev = abs(line_values[33].get(m, 0.0))
-        # Line 38 (Rendimentos) + Line 49 (Possible misc revenue)
-        invest_income = abs(line_values[38].get(m, 0.0)) + abs(line_values[49].get(m, 0.0))
-        
-        total_revenue = google_rev + apple_rev + invest_income
-        revenue_no_tax = google_rev + apple_rev
-        
-        # 2. PAYMENT PROCESSING (17.65%)
-        # Note: If user wants specific line items for negative adjustments (refunds),
-        # they should be mapped to an Expense line or kept in Revenue to reduce it.
-        # Current logic ABSOLUTES the revenue, so refunds (-100) become (+100).
-        # To fix this without breaking the "No Negative Revenue" rule for the Total:
-        # We should logically SUM the raw values first.
-        # But 'process_upload' already applies sign based on Tipo.
-        # If 'Devoluções' (Refunds) has Tipo='Saída', value is Negative.
-        # If we map 'Devoluções' to Line 25 (Google Revenue), it would REDUCE the sum.
-        # BUT, we are taking abs() below: `google_rev = abs(...)`.
-        # This INVALIDATES refunds if they are mapped to Revenue lines.
-        #
-        # FIX: We mapped 'Devoluções e Estornos' to Line 90 (Other Expenses) in get_initial_mappings.
-        # So Refunds are treated as Expenses. This preserves Revenue as purely Gross Sales
-        # and Refunds as an Expense line. This is safer and aligned with "No Negative Revenue".
-        
-        payment_processing_rate = 0.1765
-        payment_processing_cost = revenue_no_tax * payment_processing_rate
-        
-        # 3. COGS
-        cogs_sum = sum(abs(line_values[i].get(m, 0.0)) for i in range(43, 49))
-        
-        # 4. GROSS PROFIT
-        gross_profit = total_revenue - payment_processing_cost - cogs_sum
-        
-        # 5. OPEX
-        marketing_abs = abs(line_values[56].get(m, 0.0))
-        wages_abs = abs(line_values[62].get(m, 0.0))
-        # Tech Support: 68 + 65
-        tech_support_abs = abs(line_values[68].get(m, 0.0)) + abs(line_values[65].get(m, 0.0))
-        other_expenses_abs = abs(line_values[90].get(m, 0.0))
-        
-        sga_total = marketing_abs + wages_abs + tech_support_abs
-        total_opex = sga_total + other_expenses_abs
-        
-        # 6. EBITDA
-        ebitda = gross_profit - total_opex
-        
-        # 7. NET RESULT
-        net_result = ebitda
-        
-        # Store for Display (Revenues +, Expenses -)
-        line_values[100][m] = total_revenue
-        line_values[101][m] = revenue_no_tax
-        line_values[112][m] = google_rev
-        line_values[113][m] = apple_rev
-        line_values[102][m] = -payment_processing_cost
-        line_values[103][m] = -cogs_sum
-        line_values[104][m] = gross_profit
-        line_values[105][m] = -sga_total
-        line_values[106][m] = ebitda
-        line_values[107][m] = -marketing_abs
-        line_values[108][m] = -wages_abs
-        line_values[109][m] = -tech_support_abs
-        line_values[110][m] = -other_expenses_abs
-        line_values[111][m] = net_result
-        
-        logger.info(f"Month {m}: Rev={total_revenue:.2f}, EBITDA={ebitda:.2f}")
+    for idx, m in enumerate(month_strs):
+        logger.info(f"Month {m}: Rev={values[100, idx] / CENTS:.2f}, EBITDA={values[106, idx] / CENTS:.2f}")
+    return values
 
-    # APPLY OVERRIDES (Restricted to Final Lines)
-    FINAL_LINES = {100, 106, 111} # Revenue, EBITDA, Net Result
-    if overrides:
-        for line_str, months_data in overrides.items():
-            try:
-                line_num = int(line_str)
-                if line_num not in FINAL_LINES:
-                    continue
-                for m, val in months_data.items():
-                    if m in month_strs:
-                        line_values[line_num][m] = val
-            except:
-                continue
+def patch_pnl_matrix(values: np.ndarray, month_strs: List[str], overrides: Dict[str, Dict[str, float]], line_key: str, month: str, params: Dict[str, float] = None) -> np.ndarray:
+    """
+    Apply one override cell (already recorded in `overrides`) to a complete
+    matrix in place, recomputing only that month's dependent lines.
+    """
+    line_num = override_line(line_key)
+    if line_num is None or month not in month_strs:
+        return values
+    idx = month_strs.index(month)
+    column = values[:, idx:idx + 1]
+    mask, pinned = override_inputs(overrides, [month], column.shape)
+    column[mask] = pinned[mask]
+    evaluate_formulas(column, params, lines=dependents(line_num), pinned=(mask, pinned))
+    return values
+
+def diff_pnl_matrices(before: MonthlyCube, after: MonthlyCube, params: Dict[str, float] = None) -> tuple:
+    """
+    (months, after - before) over the union of both cubes' months, each
+    evaluated (derived lines and margins) without overrides. Months missing
+    from one side count as zero there.
+    """
+    months = sorted(set(before.months) | set(after.months))
+    position = {m: idx for idx, m in enumerate(months)}
+    evaluated = []
+    for cube in (before, after):
+        values = np.zeros((NUM_LINES, len(months)), dtype=np.int64)
+        values[:, [position[m] for m in cube.months]] = cube.values
+        evaluated.append(evaluate_pnl_matrix(values, months, params=params))
+    return months, evaluated[1] - evaluated[0]
+
+def pnl_response(month_strs: List[str], values: np.ndarray, params: Dict[str, float] = None, compared: Dict[str, Any] = None) -> PnLResponse:
+    """PnLResponse rows from a complete lines x months centavo matrix."""
+    def row_comparisons(line):
+        if not compared:
+            return None
+        return {
+            kind: {m: (v if ok else None) for m, v, ok in zip(month_strs, to_reais(matrix[line]).tolist(), available)}
+            for kind, (matrix, available) in compared.items()
+        }
+
+    # Build P&L Rows (centavos are converted back to reais only here)
+    rows = [
+        PnLItem(
+            line_number=item["row"],
+            description=describe_row(item, params),
+            values=dict(zip(month_strs, to_reais(values[item["line"]]).tolist())),
+            is_header=item.get("is_header", False),
+            is_total=item.get("is_total", False),
+            comparisons=row_comparisons(item["line"])
+        )
+        for item in PNL_LAYOUT
+    ]
+
+    return PnLResponse(headers=month_strs, rows=rows)
+
+def calculate_pnl(df, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, start_date: str = None, end_date: str = None, fuzzy_match: bool = None, params: Dict[str, float] = None, cube=None, granularity: str = "month", comparisons: List[str] = None) -> PnLResponse:
+    """
+    Calculate P&L based on dataframe (or TransactionStore) and mappings.
+    Optionally filter by date range.
+    `params` overrides formula parameters (see pnl_formulas.DEFAULT_PARAMS).
+    `granularity` is "month" (by Mes_Competencia, the default) or one of
+    day/week/quarter/year (by competence date, rolled up from a DailyCube).
+    Overrides are keyed by month and only apply to monthly columns.
+    `cube` is a precomputed build_monthly_cube(df, mappings) (or
+    build_daily_cube for other granularities) to use instead of
+    reclassifying df. df itself is only read, never copied.
+    `comparisons` adds MoM/YoY/YTD/TTM columns to every row (monthly only),
+    using the months before start_date from the same cube as history.
+    """
+    if comparisons and granularity != "month":
+        raise ValueError("Period comparisons are only available for monthly granularity")
 
-    # Build P&L Rows
-    rows = []
+    if cube is None and (df is None or len(df) == 0):
+        return PnLResponse(headers=[], rows=[])
     
-    def add_row(line_num, desc, val_dict, is_header=False, is_total=False):
-        # Check for override on this specific line (even if not in FINAL_LINES, to display user intent if blocked?)
-        # For safety as requested, we strictly rely on the calc above, 
-        # but if we want to show the overridden value we must read from line_values which we updated above.
-        
-        rows.append(PnLItem(
-            line_number=line_num,
-            description=desc,
-            values=val_dict,
-            is_header=is_header,
-            is_total=is_total
-        ))
-
-    add_row(1, "RECEITA OPERACIONAL BRUTA", line_values[100], is_header=True)
-    add_row(2, "Receita de Vendas (Google + Apple)", line_values[101])
-    add_row(21, "Google Play Revenue", line_values[112])
-    add_row(22, "App Store Revenue", line_values[113])
-    add_row(3, "Rendimentos de Aplicações", line_values[38])
-    
-    add_row(4, "(-) CUSTOS DIRETOS", {m: line_values[102][m] + line_values[103][m] for m in month_strs}, is_header=True)
-    add_row(5, "Payment Processing (17.65%)", line_values[102])
-    add_row(6, "COGS (Web Services)", line_values[103])
-    
-    add_row(7, "(=) LUCRO BRUTO", line_values[104], is_total=True)
-    
-    add_row(8, "(-) DESPESAS OPERACIONAIS", {m: line_values[105][m] + line_values[110][m] for m in month_strs}, is_header=True)
-    add_row(9, "Marketing", line_values[107])
-    add_row(10, "Salários (Wages)", line_values[108])
-    add_row(11, "Tech Support & Services", line_values[109])
-    add_row(12, "Outras Despesas", line_values[110])
-    
-    add_row(13, "(=) EBITDA", line_values[106], is_total=True)
-    add_row(16, "(=) RESULTADO LÍQUIDO", line_values[111], is_total=True)
-    
-    # Margins
-    ebitda_margins = {}
-    gross_margins = {}
-    for m in month_strs:
-        rev = line_values[100][m]
-        if rev and rev != 0:
-            ebitda_margins[m] = (line_values[106][m] / rev) * 100
-            gross_margins[m] = (line_values[104][m] / rev) * 100
-        else:
-            ebitda_margins[m] = 0.0
-            gross_margins[m] = 0.0
-            
-    add_row(14, "Margem EBITDA %", ebitda_margins)
-    add_row(15, "Margem Bruta %", gross_margins)
+    if granularity == "month":
+        if cube is None:
+            cube = build_monthly_cube(df, mappings, fuzzy_match)
+        # Date filter: only partially covered edge months touch raw rows
+        month_strs, values = cube.slice(start_date, end_date)
+    else:
+        if cube is None:
+            cube = build_daily_cube(df, mappings, fuzzy_match)
+        month_strs, values = cube.rollup(granularity, start_date, end_date)
 
-    return PnLResponse(headers=month_strs, rows=rows)
-def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None) -> DashboardData:
+    evaluate_pnl_matrix(values, month_strs, overrides, params)
+
+    compared = {}
+    if comparisons:
+        # History = earlier months of the cube + the range itself, in one matrix
+        earlier = [m for m in cube.months if month_strs and m < month_strs[0]]
+        history = np.concatenate([cube.values[:, :len(earlier)], values], axis=1)
+        evaluate_pnl_matrix(history[:, :len(earlier)], earlier, overrides, params)
+        for kind, (matrix, available) in period_comparisons(earlier + month_strs, history, comparisons).items():
+            compared[kind] = (matrix[:, len(earlier):], available[len(earlier):])
+
+    return pnl_response(month_strs, values, params, compared)
+
+def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, pnl: PnLResponse = None) -> DashboardData:
+    """Dashboard KPIs and charts. Pass `pnl` to reuse an already computed P&L."""
     if df is None:
         return DashboardData(kpis={}, monthly_data=[], cost_structure={})
         
-    pnl = calculate_pnl(df, mappings, overrides)
+    if pnl is None:
+        pnl = calculate_pnl(df, mappings, overrides)
     
     # Extract latest month data
     if not pnl.headers:
@@ -686,15 +729,17 @@ def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides:
     
     return DashboardData(kpis=kpis, monthly_data=monthly_data, cost_structure=cost_structure)
 
-def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, months_ahead: int = 3) -> Dict[str, Any]:
+def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, months_ahead: int = 3, pnl: PnLResponse = None) -> Dict[str, Any]:
     """
     Predict future financial metrics (Revenue, EBITDA) using Linear Regression.
+    Pass `pnl` to reuse an already computed P&L.
     """
     if df is None:
         return {"forecast": []}
 
     # Get historical data
-    pnl = calculate_pnl(df, mappings, overrides)
+    if pnl is None:
+        pnl = calculate_pnl(df, mappings, overrides)
     
     if not pnl.headers:
         return {"forecast": []}
@@ -724,6 +769,8 @@ def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides:
     if len(months_str) < 3:
         return {"forecast": [], "warning": "Not enough data for reliable forecast (need 3+ months)"}
 
+    from sklearn.linear_model import LinearRegression
+    
     X = np.arange(len(months_str)).reshape(-1, 1)
     
     # Train Models
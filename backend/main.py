@@ -1,11 +1,18 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Depends, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Depends, Query, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import ValidationError
 from typing import List
 import pandas as pd
-from models import MappingItem, MappingUpdate, DashboardData, PnLResponse
-from logic import process_upload, get_initial_mappings, calculate_pnl, get_dashboard_data, calculate_forecast
-from ai_service import generate_insights
+from models import MappingItem, MappingUpdate, MappingSuggestion, DashboardData, PnLResponse, OverrideBatch, OverrideCell, ScenarioRequest, ScenarioResponse, VarianceResponse, EntityPnLResponse, PivotRequest, PivotResponse
+from logic import classify_transactions, process_upload, get_initial_mappings, calculate_pnl, get_dashboard_data, calculate_forecast, build_monthly_cube, build_daily_cube, evaluate_pnl_matrix, patch_pnl_matrix, pnl_response, TransactionStore
+from pnl_cache import LRUCache, fingerprint
+from pnl_formulas import PNL_LAYOUT, RATIO_LINES, line_value, override_line, source_lines
+from money import CENTS
+from transaction_index import SQLITE_TRANSACTION_INDEX, TransactionIndex
+from storage import DATASET_COLUMNS, adopt_unversioned, atomic_write, bump_versions, dataset_months, file_lock, is_date, is_month, load_manifest, read_versions, snapshots, in_partition_order, partition_keys, read_dataset, write_dataset
+from aggregates import GRANULARITIES
 from auth import Token, create_access_token, get_current_user, USERS_DB, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -13,8 +20,11 @@ from dotenv import load_dotenv
 import os
 import json
 import pickle
+import shutil
+import threading
 from pathlib import Path
 from datetime import datetime
+from contextlib import contextmanager
 
 # Load environment variables
 load_dotenv()
@@ -67,60 +77,241 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 # Data persistence configuration
 DATA_DIR = Path("./data")
 DATA_DIR.mkdir(exist_ok=True)
-CSV_PATH = DATA_DIR / "current_data.pkl"
+DATASET_DIR = DATA_DIR / "dataset"  # Parquet, one partition per month
+LEGACY_DATASET_PATHS = [DATA_DIR / "current_data.parquet", DATA_DIR / "current_data.pkl"]
 MAPPINGS_PATH = DATA_DIR / "mappings.json"
 OVERRIDES_PATH = DATA_DIR / "overrides.json"
 METADATA_PATH = DATA_DIR / "metadata.json"
+CLOSED_PERIODS_PATH = DATA_DIR / "closed_periods.json"
+# Shared by all workers: a version per part of the state, and the lock for changing it
+STATE_PATH = DATA_DIR / "state.json"
+STATE_LOCK_PATH = DATA_DIR / "state.lock"
+# Last dashboard per granularity, served at cold start without loading the dataset
+DASHBOARD_PATH = DATA_DIR / "dashboard.json"
+SUGGESTION_MODEL_PATH = DATA_DIR / "suggestion_model.pkl"
+BUDGET_PATH = DATA_DIR / "budget.csv"
+# Business plan shipped with the repo, used until a budget is uploaded
+DEFAULT_BUDGET_PATH = Path(__file__).resolve().parent.parent / "00_Business_Plan_Umatch.xlsx-P&L.csv"
 
 # State (with persistence)
 current_df = None
 current_mappings = get_initial_mappings()
 current_overrides = {} # Format: {"line_num": {"month": value}}
+dataset_version = 0 # Incremented on every upload
+current_budget = None # Parsed business plan (see budget.py), loaded on first use
+current_closed = {} # Closed months -> frozen aggregates (see period_close.py)
+dataset_lock = threading.RLock() # Serializes loading and replacing the dataset
+dataset_missing = False # Negative cache: no dataset on disk (reset on upload)
+seen_versions = {} # Versions of the shared state this worker has loaded (see sync_state)
+stored_dashboards = {} # Format: {"granularity": {"key": state fingerprint, "data": DashboardData}}
+
+# P&L results keyed by (dataset version, mappings hash, closed periods hash, overrides hash, start, end)
+pnl_cache = LRUCache(maxsize=int(os.getenv("PNL_CACHE_SIZE", "32")))
+# Derived transaction columns keyed by dataset version
+store_cache = LRUCache(maxsize=1)
+# Complete P&L matrices keyed by (dataset version, mappings hash, closed periods hash, range, granularity)
+matrix_cache = LRUCache(maxsize=int(os.getenv("PNL_CACHE_SIZE", "32")))
+# Monthly, daily and per-entity aggregate cubes and row lines keyed by (kind, dataset version, mappings hash[, closed periods hash])
+cube_cache = LRUCache(maxsize=8)
+# Optional SQLite index for drilldowns (TRANSACTION_INDEX=sqlite)
+transaction_index = TransactionIndex(DATA_DIR / "transactions.sqlite")
 
 # Persistence helper functions
-def save_data():
-    """Save current dataframe and mappings to disk"""
+def save_dataset(df: pd.DataFrame = None, months: List[str] = None):
+    """
+    Persist the transactions dataset as a new snapshot, and its metadata
+    (only on upload). With `months`, only those month partitions are taken
+    from `df`; the others carry over from the previous snapshot.
+    """
     try:
-        if current_df is not None:
-            with open(CSV_PATH, 'wb') as f:
-                pickle.dump(current_df, f)
-            
-        # Save mappings
-        mappings_dict = [m.model_dump() for m in current_mappings]
-        with open(MAPPINGS_PATH, 'w') as f:
-            json.dump(mappings_dict, f)
-            
-        # Save overrides
-        with open(OVERRIDES_PATH, 'w') as f:
-            json.dump(current_overrides, f)
+        df = current_df if df is None else df
+        if df is not None:
+            write_dataset(df, DATASET_DIR, dataset_version, months)
         
-        # Save metadata
         metadata = {
             "last_upload": datetime.now().isoformat(),
-            "rows": len(current_df) if current_df is not None else 0
+            "rows": len(current_df) if current_df is not None else 0,
+            "dataset_version": dataset_version
         }
-        with open(METADATA_PATH, 'w') as f:
+        with atomic_write(METADATA_PATH) as f:
             json.dump(metadata, f)
-            
+        publish_change("dataset")
+        
+        # Results of the previous dataset can no longer be hit
+        pnl_cache.clear()
+        return True
+    except Exception as e:
+        print(f"Error saving dataset: {e}")
+        return False
+
+def save_mappings():
+    """Persist only the mappings file"""
+    try:
+        with atomic_write(MAPPINGS_PATH) as f:
+            json.dump([m.model_dump() for m in current_mappings], f)
+        publish_change("mappings")
+        pnl_cache.clear()
+        return True
+    except Exception as e:
+        print(f"Error saving mappings: {e}")
+        return False
+
+def save_overrides():
+    """Persist only the overrides file"""
+    try:
+        with atomic_write(OVERRIDES_PATH) as f:
+            json.dump(current_overrides, f)
+        publish_change("overrides")
+        return True
+    except Exception as e:
+        print(f"Error saving overrides: {e}")
+        return False
+
+def save_closed_periods():
+    """Persist only the closed periods file"""
+    try:
+        with atomic_write(CLOSED_PERIODS_PATH) as f:
+            json.dump(current_closed, f)
+        publish_change("closed")
         return True
     except Exception as e:
-        print(f"Error saving data: {e}")
+        print(f"Error saving closed periods: {e}")
         return False
 
+def publish_change(*parts: str):
+    """Tell the other workers that these parts of the state changed (under the state lock)"""
+    global seen_versions
+    seen_versions = bump_versions(STATE_PATH, *parts)
+
+def sync_state():
+    """
+    Pick up what other workers changed since this one last looked: when a
+    version in the state file moved, the small state files are re-read and,
+    if the dataset changed, it is dropped and re-read from its Parquet
+    snapshot on next use. Caches keyed by the old versions simply stop being hit.
+    """
+    global seen_versions, current_df, dataset_missing, current_budget
+    if read_versions(STATE_PATH) == seen_versions:
+        return
+    with dataset_lock:
+        versions = read_versions(STATE_PATH)
+        changed = sorted(p for p in set(versions) | set(seen_versions) if versions.get(p) != seen_versions.get(p))
+        if not changed:
+            return
+        load_state()
+        if "dataset" in changed:
+            current_df = None
+            dataset_missing = False
+        if "budget" in changed:
+            current_budget = None
+        pnl_cache.clear()
+        seen_versions = versions
+        print(f"🔄 Reloaded state changed by another worker: {', '.join(changed)}")
+
+@contextmanager
+def shared_state_update():
+    """
+    Change the shared state: hold the inter-process state lock, starting from
+    the latest state of all workers, so concurrent changes never interleave.
+    """
+    with file_lock(STATE_LOCK_PATH):
+        sync_state()
+        yield
+
+_mappings_fp = (None, None)
+
+def mappings_fingerprint() -> str:
+    """
+    Content hash of the current mappings. The mappings list is replaced,
+    never mutated, so it is computed once per change rather than per request.
+    """
+    global _mappings_fp
+    if _mappings_fp[0] is not current_mappings:
+        _mappings_fp = (current_mappings, fingerprint([m.model_dump() for m in current_mappings]))
+    return _mappings_fp[1]
+
+_closed_fp = (None, None)
+
+def closed_fingerprint() -> str:
+    """
+    Content hash of the closed periods, frozen values included (a month
+    closed again after a mapping edit freezes different numbers). Closed
+    periods are replaced, never mutated, so it is computed once per change.
+    """
+    global _closed_fp
+    if _closed_fp[0] is not current_closed:
+        _closed_fp = (current_closed, fingerprint(current_closed))
+    return _closed_fp[1]
+
+def dashboard_key(granularity: str) -> str:
+    """Fingerprint of everything a dashboard depends on (known without loading the dataset)"""
+    return fingerprint([dataset_version, mappings_fingerprint(), current_overrides,
+                        closed_fingerprint(), granularity])
+
+def save_dashboard(granularity: str, data: DashboardData):
+    """Persist the dashboard of the current state, if it changed"""
+    global stored_dashboards
+    key = dashboard_key(granularity)
+    if stored_dashboards.get(granularity, {}).get("key") == key:
+        return
+    stored_dashboards = {**stored_dashboards, granularity: {"key": key, "data": data.model_dump()}}
+    try:
+        with atomic_write(DASHBOARD_PATH) as f:
+            json.dump(stored_dashboards, f)
+    except Exception as e:
+        print(f"Error saving dashboard: {e}")
+
+def check_date_range(start_date: str = None, end_date: str = None):
+    """400 unless the given bounds of a date range are 'YYYY-MM-DD' dates"""
+    invalid = [d for d in (start_date, end_date) if d and not is_date(d)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid date(s) {', '.join(invalid)} (expected YYYY-MM-DD)")
+
 def load_data():
-    """Load dataframe and mappings from disk on startup"""
-    global current_df, current_mappings, current_overrides
+    """Load the persisted state and the dataset"""
+    global dataset_missing
+    with dataset_lock:
+        load_state()
+        dataset_missing = False
+        ensure_dataset()
+
+def load_state():
+    """
+    Load everything but the transactions on startup: metadata, mappings,
+    overrides and closed periods (the dataset is loaded on first demand)
+    """
+    global current_df, current_mappings, current_overrides, current_closed, stored_dashboards, dataset_version
     
     try:
-        # Load dataframe
-        if CSV_PATH.exists():
-            with open(CSV_PATH, 'rb') as f:
-                current_df = pickle.load(f)
-            
-            # Clean columns of loaded data to match new logic
-            if current_df is not None:
-                current_df.columns = [c.strip() for c in current_df.columns]
-                print(f"✅ Loaded data: {len(current_df)} rows (Columns cleaned)")
+        # Load metadata
+        if METADATA_PATH.exists():
+            with open(METADATA_PATH, 'r') as f:
+                metadata = json.load(f)
+            dataset_version = metadata.get("dataset_version", 0)
+            print(f"✅ Last upload: {metadata.get('last_upload', 'Unknown')}")
+        
+        # Record unversioned month partitions of older versions as a snapshot
+        if adopt_unversioned(DATASET_DIR, dataset_version):
+            print(f"✅ Recorded existing partitions as snapshot {dataset_version}")
+        
+        # Migrate a single-file dataset (Parquet or pickle) of older versions
+        legacy = [p for p in LEGACY_DATASET_PATHS if p.exists()]
+        if legacy and not dataset_months(DATASET_DIR):
+            if legacy[0].suffix == '.pkl':
+                with open(legacy[0], 'rb') as f:
+                    legacy_df = pickle.load(f)
+                legacy_df.columns = [c.strip() for c in legacy_df.columns]
+            else:
+                legacy_df = read_dataset(legacy[0], columns=None)
+            write_dataset(legacy_df, DATASET_DIR, dataset_version)
+            print(f"✅ Migrated {legacy[0].name} to {DATASET_DIR.name}/")
+        for path in legacy:
+            os.remove(path)
+        
+        # New uploads never reuse the version of a stored snapshot
+        versions = snapshots(DATASET_DIR)
+        if versions:
+            dataset_version = max(dataset_version, versions[-1])
         
         # Load mappings
         if MAPPINGS_PATH.exists():
@@ -135,11 +326,18 @@ def load_data():
                 current_overrides = json.load(f)
             print(f"✅ Loaded overrides for {len(current_overrides)} lines")
         
-        # Load metadata
-        if METADATA_PATH.exists():
-            with open(METADATA_PATH, 'r') as f:
-                metadata = json.load(f)
-            print(f"✅ Last upload: {metadata.get('last_upload', 'Unknown')}")
+        # Load closed periods
+        current_closed = {}
+        if CLOSED_PERIODS_PATH.exists():
+            with open(CLOSED_PERIODS_PATH, 'r') as f:
+                current_closed = json.load(f)
+            print(f"✅ Closed periods: {', '.join(sorted(current_closed)) or 'none'}")
+        
+        # Load the last dashboards (stale ones are recomputed on request)
+        stored_dashboards = {}
+        if DASHBOARD_PATH.exists():
+            with open(DASHBOARD_PATH, 'r') as f:
+                stored_dashboards = json.load(f)
                 
     except Exception as e:
         print(f"⚠️ Error loading data: {e}")
@@ -147,39 +345,310 @@ def load_data():
         current_mappings = get_initial_mappings()
         current_overrides = {}
 
+def load_dataset():
+    """Load the transactions of the current snapshot (only the columns the app reads)"""
+    global current_df
+    
+    try:
+        months = dataset_months(DATASET_DIR)
+        if months:
+            current_df = read_dataset(DATASET_DIR)
+            print(f"✅ Loaded data: {len(current_df)} rows, {len(current_df.columns)} columns, {len(months)} partitions")
+        
+        if SQLITE_TRANSACTION_INDEX and current_df is not None:
+            get_transaction_index()
+    except Exception as e:
+        print(f"⚠️ Error loading dataset: {e}")
+        current_df = None
+    return current_df
+
+def ensure_dataset():
+    """
+    The current dataset, loaded from disk on first demand (None if there is
+    none). Concurrent callers wait for the one in-flight load, and once the
+    disk is known to hold no dataset it is not looked up again until an upload.
+    A failed read is not remembered: the next request tries again.
+    """
+    global dataset_missing
+    df = current_df
+    if df is not None or dataset_missing:
+        return df
+    with dataset_lock:
+        if current_df is None and not dataset_missing and load_dataset() is None:
+            try:
+                dataset_missing = not dataset_months(DATASET_DIR)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not list dataset partitions: {e}")
+        return current_df
+
+def get_store() -> TransactionStore:
+    """Derived columns of the current dataset (built once per dataset version)"""
+    return store_cache.get_or_compute(dataset_version, lambda: TransactionStore(ensure_dataset()))
+
+def get_cube(granularity: str = "month"):
+    """
+    Aggregate cube of the current dataset and mappings (built once per version):
+    the monthly cube for monthly views, the daily cube for all other granularities.
+    """
+    kind = "month" if granularity == "month" else "day"
+    build = build_monthly_cube if kind == "month" else build_daily_cube
+    key = (kind, dataset_version, mappings_fingerprint(), closed_fingerprint())
+    return cube_cache.get_or_compute(key, lambda: build(get_store(), current_mappings, closed=current_closed))
+
+def get_snapshot_cube(version: int):
+    """
+    Monthly cube of a stored snapshot under the current mappings (built once
+    per snapshot), from its rows only: closed months are not frozen here.
+    """
+    key = ("month", version, mappings_fingerprint(), ())
+    if version == dataset_version:
+        return cube_cache.get_or_compute(key, lambda: build_monthly_cube(get_store(), current_mappings))
+    return cube_cache.get_or_compute(
+        key, lambda: build_monthly_cube(read_dataset(DATASET_DIR, version=version), current_mappings)
+    )
+
+def get_lines():
+    """Classified P&L line of every row (once per dataset + mappings version)"""
+    key = ("lines", dataset_version, mappings_fingerprint())
+    return cube_cache.get_or_compute(key, lambda: classify_transactions(get_store(), current_mappings))
+
+def get_reported_lines():
+    """
+    (line of every row as the P&L reports it, closed months without rows):
+    closed months keep the lines of their close (see period_close.reported_lines)
+    """
+    def compute():
+        from period_close import reported_lines
+        manifest = load_manifest(DATASET_DIR, dataset_version)
+        partitions = {m: entry["file"] for m, entry in manifest["partitions"].items()} if manifest else {}
+        return reported_lines(get_store(), get_lines(), current_closed, partitions)
+    
+    key = ("reported", dataset_version, mappings_fingerprint(), closed_fingerprint())
+    return cube_cache.get_or_compute(key, compute)
+
+def get_transaction_index():
+    """SQLite transaction index, brought up to date with the dataset, mappings and closed periods"""
+    state_fp = fingerprint([mappings_fingerprint(), closed_fingerprint()])
+    transaction_index.sync(get_store(), get_reported_lines()[0], dataset_version, state_fp)
+    return transaction_index
+
+def get_pnl_matrix(start_date: str = None, end_date: str = None, granularity: str = "month"):
+    """
+    (periods, complete lines x periods matrix) for the current state. Cached
+    entries record the overrides they reflect; override edits patch them
+    (see patch_cached_matrices) instead of rebuilding.
+    """
+    key = (dataset_version, mappings_fingerprint(), closed_fingerprint(),
+           start_date, end_date, granularity)
+    overrides_fp = fingerprint(current_overrides)
+    
+    def build():
+        if granularity == "month":
+            periods, values = get_cube().slice(start_date, end_date)
+        else:
+            periods, values = get_cube(granularity).rollup(granularity, start_date, end_date)
+        evaluate_pnl_matrix(values, periods, current_overrides)
+        return overrides_fp, periods, values
+    
+    entry = matrix_cache.get_or_compute(key, build)
+    if entry[0] != overrides_fp:
+        entry = build()
+        matrix_cache.put(key, entry)
+    return entry[1], entry[2]
+
+def patch_cached_matrices(previous_overrides_fp: str, cells: List[tuple]):
+    """
+    After override edits of (line_key, month) cells, patch the cached
+    matrices that reflected the previous overrides: only the edited months'
+    dependent cells are recomputed. Entries are replaced, never modified,
+    so concurrent readers are safe.
+    """
+    overrides_fp = fingerprint(current_overrides)
+    for key, (entry_fp, periods, values) in matrix_cache.items():
+        if entry_fp == previous_overrides_fp:
+            patched = values.copy()
+            for line_key, month in cells:
+                patch_pnl_matrix(patched, periods, current_overrides, line_key, month)
+            matrix_cache.put(key, (overrides_fp, periods, patched))
+
+def get_cached_pnl(start_date: str = None, end_date: str = None, granularity: str = "month", comparisons: List[str] = None) -> PnLResponse:
+    """calculate_pnl on the current state, memoized in pnl_cache"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid granularity '{granularity}'. Use one of: {', '.join(GRANULARITIES)}"
+        )
+    if not comparisons:
+        key = (dataset_version, mappings_fingerprint(), closed_fingerprint(),
+               fingerprint(current_overrides), start_date, end_date, granularity, ())
+        return pnl_cache.get_or_compute(key, lambda: pnl_response(*get_pnl_matrix(start_date, end_date, granularity)))
+    
+    key = (
+        dataset_version,
+        mappings_fingerprint(),
+        closed_fingerprint(),
+        fingerprint(current_overrides),
+        start_date,
+        end_date,
+        granularity,
+        tuple(comparisons or ()),
+    )
+    try:
+        return pnl_cache.get_or_compute(
+            key,
+            lambda: calculate_pnl(
+                current_df, current_mappings, current_overrides, start_date, end_date,
+                cube=get_cube(granularity), granularity=granularity, comparisons=comparisons
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def get_budget():
+    """Current budget: the uploaded plan, else the repo's business plan (None if neither exists)"""
+    global current_budget
+    from budget import load_budget
+    
+    if current_budget is None:
+        for path in (BUDGET_PATH, DEFAULT_BUDGET_PATH):
+            if path.exists():
+                try:
+                    current_budget = load_budget(path.read_bytes())
+                    print(f"✅ Loaded budget from {path.name}: {len(current_budget.months)} months")
+                    break
+                except ValueError as e:
+                    print(f"⚠️ Ignoring unreadable budget {path.name}: {e}")
+    return current_budget
+
 @app.on_event("startup")
 async def startup_event():
-    """Load persisted data on startup"""
-    load_data()
+    """
+    Load the persisted state on startup. The dataset is loaded on first
+    demand, so the server answers health checks right away.
+    """
+    global seen_versions
+    with file_lock(STATE_LOCK_PATH):
+        seen_versions = read_versions(STATE_PATH)
+        load_state()
+
+@app.middleware("http")
+async def sync_with_other_workers(request, call_next):
+    """Every request sees the changes other workers made before it"""
+    # File reads and a possible reload (waiting on dataset_lock) stay off the event loop
+    await run_in_threadpool(sync_state)
+    return await call_next(request)
 
 
 
 @app.post("/pnl/override")
 def update_pnl_override(data: dict):
-    """Update a specific cell in the P&L"""
+    """Update a specific cell in the P&L (a batch of one, see /pnl/overrides)"""
+    if data.get("line_number") is None or not data.get("month"):
+        raise HTTPException(status_code=400, detail="Missing line_number or month")
+    try:
+        cell = OverrideCell(line_number=data["line_number"], month=data["month"], value=data.get("value"))
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid override: {e.errors()[0]['msg']}")
+    apply_overrides([cell])
+    return {"message": "Override saved"}
+
+@app.post("/pnl/overrides")
+def update_pnl_overrides(batch: OverrideBatch, current_user: dict = Depends(get_current_user)):
+    """
+    Set many P&L cells at once (e.g. a row pasted from a spreadsheet).
+    All cells are validated before any is applied, and only the overrides
+    file is written, once.
+    """
+    if not batch.cells:
+        raise HTTPException(status_code=400, detail="No cells provided")
+    apply_overrides(batch.cells)
+    return {"message": "Overrides saved", "cells": len(batch.cells)}
+
+def apply_overrides(cells: List[OverrideCell]):
+    """
+    Validate override cells and apply them all: the overrides dict is copied
+    and replaced, never modified, so concurrent readers keep a consistent one.
+    """
     global current_overrides
     
-    line_num = str(data.get("line_number"))
-    month = data.get("month")
-    value = data.get("value")
+    invalid = [
+        f"{cell.line_number}/{cell.month}" for cell in cells
+        if override_line(cell.line_number) is None or not is_month(cell.month)
+    ]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid cells (line/month): {', '.join(invalid)}")
+    with shared_state_update():
+        closed = sorted({cell.month for cell in cells if cell.month in current_closed})
+        if closed:
+            raise HTTPException(status_code=409, detail=f"Closed period(s): {', '.join(closed)}")
     
-    if not line_num or not month:
-        raise HTTPException(status_code=400, detail="Missing line_number or month")
-        
-    if line_num not in current_overrides:
-        current_overrides[line_num] = {}
-        
-    current_overrides[line_num][month] = float(value)
-    save_data()
-    return {"message": "Override saved"}
+        previous_fp = fingerprint(current_overrides)
+        updated = {line: dict(months) for line, months in current_overrides.items()}
+        for cell in cells:
+            updated.setdefault(str(cell.line_number), {})[cell.month] = cell.value
+    
+        current_overrides = updated
+        patch_cached_matrices(previous_fp, [(str(cell.line_number), cell.month) for cell in cells])
+        save_overrides()
 
 @app.delete("/api/pnl/overrides")
 def clear_pnl_overrides(current_user: dict = Depends(get_current_user)):
-    """Clear all P&L overrides"""
+    """Clear all P&L overrides (those of closed months are locked and kept)"""
     global current_overrides
-    current_overrides = {}
-    save_data()
-    return {"message": "All overrides cleared"}
+    with shared_state_update():
+        locked = {
+            line: {m: v for m, v in months.items() if m in current_closed}
+            for line, months in current_overrides.items()
+        }
+        current_overrides = {line: months for line, months in locked.items() if months}
+        save_overrides()
+        return {"message": "All overrides cleared"}
+
+@app.get("/periods")
+def list_periods(current_user: dict = Depends(get_current_user)):
+    """Months of the dataset and closed months with their close time"""
+    months = get_store().months if ensure_dataset() is not None else []
+    return {
+        "open": [m for m in months if m not in current_closed],
+        "closed": [{"month": m, "closed_at": current_closed[m]["closed_at"]} for m in sorted(current_closed)],
+    }
+
+@app.post("/periods/{month}/close")
+def close_period(month: str, current_user: dict = Depends(get_current_user)):
+    """
+    Close a month: freeze its classified aggregates as they are now. Its P&L
+    no longer changes with uploads or mapping edits, and its overrides are locked.
+    """
+    global current_closed
+    
+    with shared_state_update():
+        if ensure_dataset() is None:
+            raise HTTPException(status_code=404, detail="No data loaded")
+        if month in current_closed:
+            raise HTTPException(status_code=409, detail=f"Period {month} is already closed")
+        store = get_store()
+        if month not in store.months:
+            raise HTTPException(status_code=404, detail=f"No transactions in {month}")
+    
+        from period_close import freeze_month
+        frozen = freeze_month(store, get_lines(), month)
+        manifest = load_manifest(DATASET_DIR, dataset_version)
+        frozen["partition"] = manifest["partitions"].get(month, {}).get("file") if manifest else None
+        current_closed = {**current_closed, month: frozen}
+        save_closed_periods()
+        return {"message": f"Period {month} closed"}
+
+@app.post("/periods/{month}/reopen")
+def reopen_period(month: str, current_user: dict = Depends(get_current_user)):
+    """Reopen a closed month: it is computed from its transactions again"""
+    global current_closed
+    
+    with shared_state_update():
+        if month not in current_closed:
+            raise HTTPException(status_code=404, detail=f"Period {month} is not closed")
+        current_closed = {m: frozen for m, frozen in current_closed.items() if m != month}
+        save_closed_periods()
+        return {"message": f"Period {month} reopened"}
 
 @app.get("/status")
 def get_status():
@@ -197,32 +666,74 @@ def get_status():
     return {
         "status": "healthy",
         "data_loaded": has_data,
-        "rows": len(current_df) if has_data else 0,
+        "data_available": has_data or bool(metadata.get("rows")),
+        "rows": len(current_df) if has_data else metadata.get("rows", 0),
         "last_upload": metadata.get("last_upload"),
-        "mappings_count": len(current_mappings)
+        "mappings_count": len(current_mappings),
+        "pnl_cache": pnl_cache.stats(),
+        "matrix_cache": matrix_cache.stats(),
+        "cube_cache": cube_cache.stats()
     }
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    global current_df
-    content = await file.read()
+def upload_file(file: UploadFile = File(...), append: bool = False, current_user: dict = Depends(get_current_user)):
+    """
+    Upload a Conta Azul export. With append=true the export's months replace
+    those months of the current dataset (other months are kept) and only
+    their partitions are written.
+    """
+    global current_df, dataset_version, dataset_missing
+    content = file.file.read()
     try:
-        current_df = process_upload(content)
-        save_data()  # Persist to disk
-        return {"message": "File processed successfully", "rows": len(current_df)}
+        uploaded = process_upload(content)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    
+    # Keep in memory only the columns a reload would read
+    projected = uploaded[[c for c in DATASET_COLUMNS if c in uploaded.columns]]
+    with shared_state_update(), dataset_lock:
+        dataset_missing = False
+        if append and ensure_dataset() is not None:
+            months = sorted(set(partition_keys(uploaded)))
+            kept = current_df[~partition_keys(current_df).isin(months).to_numpy()]
+            current_df = in_partition_order(pd.concat([kept, projected], ignore_index=True))
+            dataset_version += 1
+            save_dataset(uploaded, months)  # Persist to disk
+            if SQLITE_TRANSACTION_INDEX:
+                get_transaction_index()
+            return {"message": "File appended successfully", "rows": len(current_df), "months": months}
+        
+        current_df = uploaded
+        dataset_version += 1
+        save_dataset()  # Persist to disk
+        current_df = in_partition_order(projected)
+        if SQLITE_TRANSACTION_INDEX:
+            get_transaction_index()
+    return {"message": "File processed successfully", "rows": len(current_df)}
 
 @app.delete("/api/data")
 def clear_data(current_user: dict = Depends(get_current_user)):
     """Clear all uploaded data"""
-    global current_df
-    current_df = None
-    # Also clear metadata
-    if CSV_PATH.exists():
-        os.remove(CSV_PATH)
-    if METADATA_PATH.exists():
-        os.remove(METADATA_PATH)
+    global current_df, current_closed, stored_dashboards, dataset_missing
+    with shared_state_update(), dataset_lock:
+        current_df = None
+        dataset_missing = True
+        current_closed = {}
+        stored_dashboards = {}
+        pnl_cache.clear()
+        matrix_cache.clear()
+        store_cache.clear()
+        cube_cache.clear()
+        # Also clear metadata
+        if DATASET_DIR.exists():
+            shutil.rmtree(DATASET_DIR)
+        for path in LEGACY_DATASET_PATHS:
+            if path.exists():
+                os.remove(path)
+        for path in (METADATA_PATH, CLOSED_PERIODS_PATH, DASHBOARD_PATH, transaction_index.path):
+            if path.exists():
+                os.remove(path)
+        publish_change("dataset", "closed")
     return {"message": "Data cleared successfully"}
 
 @app.get("/mappings", response_model=List[MappingItem])
@@ -232,136 +743,308 @@ def get_mappings(current_user: dict = Depends(get_current_user)):
 @app.post("/mappings")
 def update_mappings(update: MappingUpdate, current_user: dict = Depends(get_current_user)):
     global current_mappings
-    current_mappings = update.mappings
-    save_data()  # Persist to disk
-    return {"message": "Mappings updated"}
+    with shared_state_update():
+        current_mappings = update.mappings
+        save_mappings()  # Persist to disk
+        return {"message": "Mappings updated"}
+
+@app.get("/mappings/suggestions", response_model=List[MappingSuggestion])
+def get_mapping_suggestions(min_confidence: float = 0.0, current_user: dict = Depends(get_current_user)):
+    """Suggest P&L lines for unmapped transactions (for the mapping editor)"""
+    from suggestions import suggest_mappings
+
+    df = ensure_dataset()
+
+    if df is None or df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded")
+
+    return suggest_mappings(df, current_mappings, SUGGESTION_MODEL_PATH, dataset_version, min_confidence)
 
 @app.delete("/api/mappings")
 def reset_mappings(current_user: dict = Depends(get_current_user)):
     """Reset mappings to default"""
     global current_mappings
-    current_mappings = get_initial_mappings()
-    save_data()
-    return {"message": "Mappings reset to default"}
+    with shared_state_update():
+        current_mappings = get_initial_mappings()
+        save_mappings()
+        return {"message": "Mappings reset to default"}
 
 @app.get("/pnl", response_model=PnLResponse)
 def get_pnl(
     start_date: str = None, 
     end_date: str = None,
+    granularity: str = "month",
+    comparisons: str = None,
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    P&L by period. `comparisons` is a comma-separated subset of
+    mom,yoy,ytd,ttm to add comparison columns to every row (monthly only).
+    """
     global current_df, current_overrides
     
-    # Lazy load if data is missing but might exist on disk
-    if current_df is None:
-        print("⚠️ Data missing in memory, attempting lazy load...")
-        load_data()
+    # Load the dataset on first use
+    df = ensure_dataset()
         
-    if current_df is None or current_df.empty:
+    if df is None or df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    
+    kinds = [k.strip().lower() for k in comparisons.split(",") if k.strip()] if comparisons else None
+    return get_cached_pnl(start_date, end_date, granularity, kinds)
+
+@app.post("/pnl/scenarios", response_model=ScenarioResponse)
+def run_pnl_scenarios(request: ScenarioRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Evaluate a batch of what-if scenarios (parameters, growth per line,
+    one-off adjustments) over the actual P&L in one vectorized pass.
+    """
+    from scenarios import run_scenarios
+    
+    check_date_range(request.start_date, request.end_date)
+    df = ensure_dataset()
+    
+    if df is None or df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    
+    if not request.scenarios:
+        raise HTTPException(status_code=400, detail="No scenarios provided")
+    
+    months, base = get_cube().slice(request.start_date, request.end_date)
+    try:
+        return run_scenarios(base, months, request.scenarios)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/budget/upload")
+def upload_budget(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    """Import a business plan P&L CSV as the budget"""
+    global current_budget
+    from budget import load_budget
+    
+    content = file.file.read()
+    try:
+        budget = load_budget(content)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    with shared_state_update():
+        with atomic_write(BUDGET_PATH, 'wb') as f:
+            f.write(content)
+        current_budget = budget
+        publish_change("budget")
+    return {"message": "Budget imported", "months": current_budget.months}
+
+@app.get("/pnl/variance", response_model=VarianceResponse)
+def get_pnl_variance(
+    start_date: str = None,
+    end_date: str = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Budget vs actual for every P&L line and month"""
+    from budget import calculate_variance
+    
+    check_date_range(start_date, end_date)
+    df = ensure_dataset()
+    
+    if df is None or df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    
+    budget = get_budget()
+    if budget is None:
+        raise HTTPException(status_code=404, detail="No budget loaded. Please upload the business plan P&L.")
+    
+    def compute():
+        actual_months, actual = get_pnl_matrix(start_date, end_date)
+        budget_months, budget_values = budget.slice(start_date, end_date)
+        return calculate_variance(actual_months, actual, budget_months, budget_values)
+    
+    key = (
+        "variance",
+        dataset_version,
+        mappings_fingerprint(),
+        closed_fingerprint(),
+        fingerprint(current_overrides),
+        budget.fingerprint,
+        start_date,
+        end_date,
+    )
+    return pnl_cache.get_or_compute(key, compute)
+
+@app.post("/analytics/pivot", response_model=PivotResponse)
+def get_pivot(request: PivotRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Ad-hoc pivot of the persisted transactions: dimensions x month with
+    filters and measures, evaluated by DuckDB over the Parquet partitions.
+    """
+    from analytics import run_pivot, validate_pivot
+    
+    if not dataset_months(DATASET_DIR):
         raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    try:
+        validate_pivot(request)
+        key = ("pivot", dataset_version, fingerprint(request.model_dump()))
+        return pnl_cache.get_or_compute(key, lambda: run_pivot(DATASET_DIR, request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/snapshots")
+def list_snapshots(current_user: dict = Depends(get_current_user)):
+    """Stored dataset snapshots (one per upload), oldest first"""
+    result = []
+    for version in snapshots(DATASET_DIR):
+        manifest = load_manifest(DATASET_DIR, version)
+        result.append({
+            "version": version,
+            "created": manifest["created"],
+            "rows": manifest["rows"],
+            "months": list(manifest["partitions"]),
+            "current": version == dataset_version,
+        })
+    return result
+
+@app.get("/pnl/diff", response_model=PnLResponse)
+def get_pnl_diff(
+    from_version: int = Query(..., alias="from"),
+    to_version: int = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Line x month change of the P&L between two snapshots (to - from, the
+    current dataset by default), computed from their monthly cubes under
+    the current mappings. Overrides are not part of snapshots and are ignored.
+    """
+    from logic import diff_pnl_matrices
+    
+    if to_version is None:
+        to_version = dataset_version
+    for version in (from_version, to_version):
+        if load_manifest(DATASET_DIR, version) is None:
+            raise HTTPException(status_code=404, detail=f"Snapshot {version} not found")
     
-    return calculate_pnl(current_df, current_mappings, current_overrides, start_date, end_date)
+    key = ("diff", from_version, to_version, mappings_fingerprint())
+    return pnl_cache.get_or_compute(
+        key,
+        lambda: pnl_response(*diff_pnl_matrices(get_snapshot_cube(from_version), get_snapshot_cube(to_version)))
+    )
 
+@app.get("/pnl/entities", response_model=EntityPnLResponse)
+def get_entity_pnl(
+    start_date: str = None,
+    end_date: str = None,
+    eliminate_intercompany: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    P&L per entity (Conta bancária) plus the consolidated P&L. Overrides
+    apply to the consolidated view only. Closed months report their frozen
+    numbers; a closed month whose rows changed since the close is in the
+    consolidated view only.
+    """
+    from entities import build_all_entity_cubes, consolidate
+    
+    df = ensure_dataset()
+    
+    if df is None or df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    
+    mappings_fp = mappings_fingerprint()
+    closed_fp = closed_fingerprint()
+    
+    def compute():
+        lines, without_rows = get_reported_lines()
+        entity_cubes = cube_cache.get_or_compute(
+            ("entities", dataset_version, mappings_fp, closed_fp),
+            lambda: build_all_entity_cubes(df, current_mappings, lines=lines)
+        )
+        frozen = {m: current_closed[m] for m in without_rows}
+        months, per_entity, consolidated = consolidate(entity_cubes, start_date, end_date, eliminate_intercompany, frozen)
+        entities = {}
+        for name, values in per_entity.items():
+            evaluate_pnl_matrix(values, months)
+            entities[name] = pnl_response(months, values)
+        evaluate_pnl_matrix(consolidated, months, current_overrides)
+        return EntityPnLResponse(entities=entities, consolidated=pnl_response(months, consolidated))
+    
+    key = ("entities", dataset_version, mappings_fp, closed_fp, fingerprint(current_overrides), start_date, end_date, eliminate_intercompany)
+    return pnl_cache.get_or_compute(key, compute)
+
+# Columns returned by the transactions drilldown
 @app.get("/pnl/transactions/{line_number}")
 def get_pnl_line_transactions(
     line_number: int,
     month: str = None,
+    cost_center: str = None,
+    supplier: str = None,
+    search: str = None,
+    sort: str = None,
+    limit: int = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
     current_user: dict = Depends(get_current_user)
 ):
     """
-    Get all transactions that contribute to a specific P&L line.
+    Get the transactions that contribute to a P&L line.
     
     Args:
-        line_number: The P&L line number (e.g., 9 for Marketing, 56 from mapping)
-        month: Optional month filter in format '2024-10' or integer
+        line_number: P&L row as shown in the table (e.g. 9 for Marketing) or
+            a base line from the mappings (e.g. 56)
+        month: Optional month filter in format 'YYYY-MM'
+        cost_center / supplier: Optional exact (case-insensitive) filters
+        search: Optional text contained in the supplier or description
+        sort: 'date', 'valor', 'fornecedor' or 'centro_custo' ('-' prefix for descending)
+        limit / offset: Optional page of the matching transactions
     
     Returns:
-        JSON with line details and list of transactions
+        JSON with line details and list of transactions. count covers all
+        matches; total is the line's formula evaluated over the matching
+        transactions (the P&L cell for a month without filters or overrides).
+        Rows of closed months are listed with the lines they had at the close.
+        A closed month whose rows changed since the close has no rows to list
+        (closed_without_rows); for that month, total is its frozen P&L cell.
     """
-    global current_df, current_mappings
+    from transaction_index import SORT_COLUMNS, query_store
     
-    if current_df is None:
-        load_data()
+    df = ensure_dataset()
     
-    if current_df is None or current_df.empty:
+    if df is None or df.empty:
         raise HTTPException(status_code=404, detail="No data loaded")
     
-    # Find mapping for this line number  
-    line_mapping = None
-    for mapping in current_mappings:
-        try:
-            if int(mapping.linha_pl) == line_number:
-                line_mapping = mapping
-                break
-        except:
-            continue
+    line = override_line(line_number)
+    if line is None:
+        raise HTTPException(status_code=404, detail=f"Unknown P&L line {line_number}")
+    if line in RATIO_LINES:
+        raise HTTPException(status_code=400, detail=f"P&L line {line_number} is a margin and has no transactions")
+    if sort and sort.lstrip('-') not in SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort '{sort}'. Use one of: {', '.join(SORT_COLUMNS)}")
     
-    if not line_mapping:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No mapping found for line {line_number}"
-        )
+    sources = source_lines(line)
+    filters = dict(month=month, cost_center=cost_center, supplier=supplier, search=search, sort=sort, limit=limit, offset=offset)
+    lines, without_rows = get_reported_lines()
+    if SQLITE_TRANSACTION_INDEX:
+        page, count, totals = get_transaction_index().query(sources, **filters)
+    else:
+        page, count, totals = query_store(get_store(), lines, sources, **filters)
+    if month in without_rows:
+        from period_close import frozen_months
+        column = frozen_months({month: current_closed[month]})[month][2]
+        totals = {source: int(column[source]) for source in sources}
     
-    # Filter dataframe
-    filtered_df = current_df.copy()
+    description = next((item["description"] for item in PNL_LAYOUT if item["row"] == line_number), None)
+    if description is None:
+        description = next((m.observacoes for m in current_mappings if m.linha_pl == str(line)), f"Linha {line}")
     
-    # Apply month filter if provided
-    if month:
-        try:
-            if '-' in str(month):  # Format: 'YYYY-MM'
-                filtered_df = filtered_df[filtered_df['Mes_Competencia'].astype(str) == month]
-            else:  # Could be Period object comparison
-                filtered_df = filtered_df[filtered_df['Mes_Competencia'] == month]
-        except Exception as e:
-            print(f"Month filter error: {e}")
-    
-    # Apply Centro de Custo filter
-    if line_mapping.centro_custo:
-        filtered_df = filtered_df[
-            filtered_df['Centro de Custo 1'].astype(str).str.contains(
-                line_mapping.centro_custo, case=False, na=False, regex=False
-            )
-        ]
-    
-    # Apply Fornecedor/Cliente filter
-    if line_mapping.fornecedor_cliente and line_mapping.fornecedor_cliente != "Diversos":
-        filtered_df = filtered_df[
-            filtered_df['Nome do fornecedor/cliente'].astype(str).str.contains(
-                line_mapping.fornecedor_cliente, case=False, na=False, regex=False
-            )
-        ]
-    
-    # Build transaction list
-    transactions = []
-    total = 0.0
-    
-    for _, row in filtered_df.iterrows():
-        try:
-            date_val = row.get('Data de competência')
-            date_str = date_val.strftime('%Y-%m-%d') if pd.notna(date_val) else ''
-        except:
-            date_str = ''
-            
-        transaction = {
-            "date": date_str,
-            "month": str(row.get('Mes_Competencia', '')),
-            "centro_custo": str(row.get('Centro de Custo 1', '')),
-            "fornecedor": str(row.get('Nome do fornecedor/cliente', '')),
-            "descricao": str(row.get('Descrição', '')),
-            "valor": float(row.get('Valor_Num', 0)),
-            "categoria": str(row.get('Plano de contas', ''))
-        }
-        transactions.append(transaction)
-        total += transaction['valor']
+    page["valor"] = page.pop("valor_centavos") / CENTS
+    transactions = page.to_dict(orient="records")
     
     return {
         "line_number": line_number,
-        "description": line_mapping.descricao,
-        "centro_custo_filter": line_mapping.centro_custo,
-        "fornecedor_filter": line_mapping.fornecedor_cliente,
+        "description": description,
+        "lines": sources,
+        "centro_custo_filter": cost_center,
+        "fornecedor_filter": supplier,
         "month": month if month else "all",
-        "total": round(total, 2),
-        "count": len(transactions),
+        "total": line_value(line, totals) / CENTS,
+        "count": count,
+        "closed": month in current_closed,
+        "closed_without_rows": [m for m in without_rows if not month or m == month],
         "transactions": transactions
     }
 
@@ -375,14 +1058,13 @@ def validate_data(current_user: dict = Depends(get_current_user)):
     
     global current_df, current_mappings, current_overrides
     
-    if current_df is None:
-        load_data()
+    df = ensure_dataset()
     
-    if current_df is None or current_df.empty:
+    if df is None or df.empty:
         raise HTTPException(status_code=404, detail="No data loaded")
     
     # Calculate P&L and Dashboard
-    pnl_data = calculate_pnl(current_df, current_mappings, current_overrides)
+    pnl_data = get_cached_pnl()
     dashboard_data = get_dashboard()
     
     # Run validations
@@ -422,6 +1104,7 @@ def get_ai_insights(request: dict, current_user: dict = Depends(get_current_user
         if not data:
             raise HTTPException(status_code=400, detail="No data provided")
         
+        from ai_service import generate_insights
         insights = generate_insights(data, api_key)
         return {"insights": insights}
     except Exception as e:
@@ -429,21 +1112,24 @@ def get_ai_insights(request: dict, current_user: dict = Depends(get_current_user
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/dashboard", response_model=DashboardData)
-def get_dashboard(current_user: dict = Depends(get_current_user)):
+def get_dashboard(granularity: str = "month", current_user: dict = Depends(get_current_user)):
     global current_df, current_mappings, current_overrides
     
-    # Lazy load if data is missing but might exist on disk
-    if current_df is None:
-        print("⚠️ Data missing in memory, attempting lazy load...")
-        load_data()
+    # Before the dataset is loaded, serve the stored dashboard if nothing changed since
+    df = current_df
+    if df is None:
+        stored = stored_dashboards.get(granularity)
+        if stored and stored["key"] == dashboard_key(granularity):
+            return DashboardData(**stored["data"])
+        df = ensure_dataset()
         
-    if current_df is None:
+    if df is None:
         # Return empty structure
         return DashboardData(kpis={}, monthly_data=[], cost_structure={})
     
-    # Note: get_dashboard_data needs to be updated to accept overrides too if we want charts to reflect edits
-    # For now, let's update logic.py signature for get_dashboard_data as well
-    return get_dashboard_data(current_df, current_mappings, current_overrides)
+    data = get_dashboard_data(df, current_mappings, current_overrides, pnl=get_cached_pnl(granularity=granularity))
+    save_dashboard(granularity, data)
+    return data
 
 @app.get("/api/forecast")
 def get_forecast(months: int = 3, current_user: dict = Depends(get_current_user)):
@@ -452,10 +1138,10 @@ def get_forecast(months: int = 3, current_user: dict = Depends(get_current_user)
     """
     global current_df, current_mappings, current_overrides
     
-    if current_df is None:
-        load_data()
-        
-    return calculate_forecast(current_df, current_mappings, current_overrides, months_ahead=months)
+    df = ensure_dataset()
+
+    pnl = get_cached_pnl() if df is not None else None
+    return calculate_forecast(df, current_mappings, current_overrides, months_ahead=months, pnl=pnl)
 
 # Serve the built frontend (Vite) from the dist folder
 from fastapi.responses import FileResponse, HTMLResponse
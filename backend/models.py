@@ -13,18 +13,84 @@ class MappingItem(BaseModel):
 class MappingUpdate(BaseModel):
     mappings: List[MappingItem]
 
+class MappingSuggestion(BaseModel):
+    mapping: MappingItem
+    confidence: float  # model probability for the suggested line (0-1)
+    transactions: int  # unmapped transactions covered by this suggestion
+    total: float
+
 class DashboardData(BaseModel):
     kpis: Dict[str, Any]
     monthly_data: List[Dict[str, Any]]
     cost_structure: Dict[str, Any]
 
+class OverrideCell(BaseModel):
+    line_number: int  # P&L row (or internal line)
+    month: str  # 'YYYY-MM'
+    value: float
+
+class OverrideBatch(BaseModel):
+    cells: List[OverrideCell]
+
 class PnLItem(BaseModel):
     line_number: int
     description: str
     values: Dict[str, float]  # month -> value
     is_header: bool = False
     is_total: bool = False
+    comparisons: Optional[Dict[str, Dict[str, Optional[float]]]] = None  # mom/yoy/ytd/ttm -> month -> value
 
 class PnLResponse(BaseModel):
     headers: List[str]
     rows: List[PnLItem]
+
+class Scenario(BaseModel):
+    name: str
+    params: Dict[str, float] = {}  # formula parameter -> value (e.g. payment_processing_rate)
+    growth: Dict[str, float] = {}  # base P&L line -> multiplier (1.1 = +10%)
+    adjustments: Dict[str, Dict[str, float]] = {}  # base P&L line -> month -> one-off amount
+
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario]
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+class ScenarioResponse(BaseModel):
+    headers: List[str]  # months
+    scenarios: List[str]  # scenario names
+    rows: List[Dict[str, Any]]  # P&L rows: line_number, description, descriptions (one per scenario)
+    values: List[List[List[float]]]  # scenarios x rows x months
+
+class VarianceItem(BaseModel):
+    line_number: int
+    description: str
+    actual: Dict[str, float]  # month -> value
+    budget: Dict[str, float]
+    variance: Dict[str, float]  # actual - budget
+    variance_pct: Dict[str, Optional[float]]  # variance / |budget| * 100 (None without budget)
+    is_header: bool = False
+    is_total: bool = False
+
+class VarianceResponse(BaseModel):
+    headers: List[str]
+    rows: List[VarianceItem]
+
+class EntityPnLResponse(BaseModel):
+    entities: Dict[str, PnLResponse]  # entity (Conta bancária) -> P&L
+    consolidated: PnLResponse
+
+class PivotRequest(BaseModel):
+    dimensions: List[str] = []  # e.g. ["categoria", "conta"]
+    measures: List[str] = ["total"]  # total, entradas, saidas, media, count
+    filters: Dict[str, List[str]] = {}  # dimension -> accepted values
+    start_month: Optional[str] = None  # 'YYYY-MM'
+    end_month: Optional[str] = None
+
+class PivotRow(BaseModel):
+    dimensions: Dict[str, str]
+    values: Dict[str, Dict[str, float]]  # measure -> month -> value
+    totals: Dict[str, float]  # measure -> value over all months
+
+class PivotResponse(BaseModel):
+    headers: List[str]  # months
+    rows: List[PivotRow]
@@ -0,0 +1,103 @@
+"""
+Exact money arithmetic in integer centavos.
+
+Amounts are parsed into int64 centavos at upload and every sum, derived line
+and margin of the P&L engine is computed on integers. Fractional factors
+(rates, percentages) are applied as exact fractions with half-away-from-zero
+rounding to the nearest centavo. Values are converted back to reais only
+when a response is serialized.
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from fractions import Fraction
+from typing import Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Centavos per real
+CENTS = 100
+
+
+def parse_centavos(text: str) -> int:
+    """Exact centavos of a plain decimal string ("1234.56"), 0 if unparseable."""
+    try:
+        amount = Decimal(text).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        return 0
+    if not amount.is_finite():
+        return 0
+    return int(amount * CENTS)
+
+
+def parse_brl(valor_str: Any) -> int:
+    """Exact centavos of a BR/US formatted amount ("R$ 1.234,56", "(1.234,56)", "1,234.56")."""
+    if pd.isna(valor_str) or str(valor_str).strip() == "":
+        return 0
+
+    s = str(valor_str).replace('R$', '').strip()
+
+    negative = False
+    # (1.234,56) accounting negative
+    if s.startswith('(') and s.endswith(')'):
+        negative = True
+        s = s[1:-1].strip()
+
+    # 1.234,56- trailing minus
+    if s.endswith('-'):
+        negative = True
+        s = s[:-1].strip()
+
+    # Remove spaces
+    s = s.replace(' ', '')
+
+    # Brazilian vs US separators
+    if ',' in s and '.' in s:
+        if s.rfind(',') > s.rfind('.'):
+            s = s.replace('.', '').replace(',', '.')
+        else:
+            s = s.replace(',', '')
+    elif ',' in s:
+        s = s.replace(',', '.')
+
+    v = parse_centavos(s)
+    return -v if negative else v
+
+
+def to_centavos(values: Any) -> np.ndarray:
+    """int64 centavos of numeric reais (missing or non-numeric values become 0)."""
+    reais = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    return np.where(np.isnan(reais), 0.0, np.rint(reais * CENTS)).astype(np.int64)
+
+
+def to_reais(centavos: np.ndarray) -> np.ndarray:
+    """Float reais of integer centavos, for serialization only."""
+    return np.asarray(centavos) / CENTS
+
+
+def div_round(numerator: np.ndarray, denominator: Any) -> np.ndarray:
+    """Integer division rounded half away from zero (0 where the denominator is 0)."""
+    num = np.asarray(numerator, dtype=np.int64)
+    den = np.asarray(denominator, dtype=np.int64)
+    safe = np.where(den == 0, 1, den)
+    quotient = (2 * np.abs(num) + np.abs(safe)) // (2 * np.abs(safe))
+    return np.where(den == 0, 0, np.sign(num) * np.sign(safe) * quotient)
+
+
+def fraction_parts(factor: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact int64 numerators and denominators of decimal factors (a scalar or an array)."""
+    factors = np.asarray(factor, dtype=float)
+    distinct, inverse = np.unique(factors, return_inverse=True)
+    fractions = [Fraction(str(f)).limit_denominator(10 ** 6) for f in distinct.tolist()]
+    numerators = np.array([f.numerator for f in fractions], dtype=np.int64)
+    denominators = np.array([f.denominator for f in fractions], dtype=np.int64)
+    return numerators[inverse].reshape(factors.shape), denominators[inverse].reshape(factors.shape)
+
+
+def mul_round(centavos: np.ndarray, factor: Any) -> np.ndarray:
+    """
+    Multiply integer centavos by decimal factors, rounding to the centavo.
+    `factor` is a scalar or an array broadcastable against `centavos`.
+    """
+    numerator, denominator = fraction_parts(factor)
+    return div_round(np.asarray(centavos, dtype=np.int64) * numerator, denominator)
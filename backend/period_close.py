@@ -0,0 +1,106 @@
+"""
+Period close: frozen aggregates of closed months.
+
+Closing a month stores its classified amounts by (P&L line, competence day)
+plus the month's undated rows, as of the close. From then on the month's
+columns come from these frozen aggregates: later uploads and mapping edits
+only classify and aggregate the rows of open months, so the work per change
+depends on the open months, not on the length of the history. Overrides of a
+closed month are locked; reopening the month returns it to live computation.
+
+Frozen aggregates are kept as {month: {"closed_at", "days": {day: {line:
+centavos}}, "undated": {line: centavos}, "rows": {line: [offsets]},
+"partition"}}, with only non-zero cells. "rows" records the line each of
+the month's rows had at the close (by offset among the month's rows, in
+row order) and "partition" the dataset file the rows came from, so views
+built from rows (drilldowns, entities) report what the P&L reports while the
+month's rows are unchanged.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from aggregates import sum_by_key
+from pnl_formulas import NUM_LINES
+
+
+def _sparse(column: np.ndarray) -> Dict[str, int]:
+    return {str(line): int(column[line]) for line in np.flatnonzero(column)}
+
+
+def _dense(cells: Dict[str, int]) -> np.ndarray:
+    column = np.zeros(NUM_LINES, dtype=np.int64)
+    for line, value in cells.items():
+        column[int(line)] = value
+    return column
+
+
+def freeze_month(store, lines: np.ndarray, month: str) -> dict:
+    """Frozen aggregates of a month's rows from their classified lines."""
+    month_rows = store.month_rows(month)
+    offsets = np.flatnonzero(lines[month_rows] > 0)
+    rows = month_rows[offsets]
+    dates = store.dates[rows]
+    dated = ~np.isnat(dates)
+
+    days, day_pos = np.unique(dates[dated].astype('datetime64[D]'), return_inverse=True)
+    day_values = sum_by_key(
+        lines[rows][dated] * len(days) + day_pos, store.amounts[rows][dated], NUM_LINES * len(days)
+    ).reshape(NUM_LINES, len(days))
+    undated = sum_by_key(lines[rows][~dated], store.amounts[rows][~dated], NUM_LINES)
+
+    return {
+        "closed_at": datetime.now().isoformat(),
+        "days": {str(day): _sparse(day_values[:, idx]) for idx, day in enumerate(days)},
+        "undated": _sparse(undated),
+        "rows": {str(line): offsets[lines[rows] == line].tolist() for line in np.unique(lines[rows])},
+    }
+
+
+def frozen_days(frozen: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """(days as datetime64[ns], lines x days matrix) of a closed month."""
+    days = np.array(sorted(frozen["days"]), dtype='datetime64[D]').astype('datetime64[ns]')
+    values = np.zeros((NUM_LINES, len(days)), dtype=np.int64)
+    for idx, day in enumerate(sorted(frozen["days"])):
+        values[:, idx] = _dense(frozen["days"][day])
+    return days, values
+
+
+def frozen_months(closed: Dict[str, dict]) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """MonthlyCube `frozen` argument: month -> (days, lines x days values, month column)."""
+    result = {}
+    for month, frozen in closed.items():
+        days, values = frozen_days(frozen)
+        result[month] = (days, values, values.sum(axis=1) + _dense(frozen["undated"]))
+    return result
+
+
+def frozen_day_columns(closed: Dict[str, dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """DailyCube `extra` argument: every frozen day of the closed months."""
+    pairs = [frozen_days(frozen) for frozen in closed.values()]
+    if not pairs:
+        return np.zeros(0, dtype='datetime64[ns]'), np.zeros((NUM_LINES, 0), dtype=np.int64)
+    return np.concatenate([d for d, _ in pairs]), np.concatenate([v for _, v in pairs], axis=1)
+
+
+def reported_lines(store, lines: np.ndarray, closed: Dict[str, dict], partitions: Dict[str, str]) -> Tuple[np.ndarray, List[str]]:
+    """
+    Line of every row as the P&L reports it: `lines` (the live classification)
+    for open months and the close-time lines for the rows of closed months.
+    A closed month whose partition file changed since the close (or closed
+    without row detail) has no rows to report: they get 0 and the month is
+    returned in the list of months without rows.
+    """
+    result = lines.copy()
+    without_rows = []
+    for month, frozen in closed.items():
+        rows = store.month_rows(month)
+        result[rows] = 0
+        if "rows" in frozen and frozen.get("partition") is not None and frozen["partition"] == partitions.get(month):
+            for line, offsets in frozen["rows"].items():
+                result[rows[offsets]] = int(line)
+        else:
+            without_rows.append(month)
+    return result, sorted(without_rows)
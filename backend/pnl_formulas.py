@@ -0,0 +1,231 @@
+"""
+Declarative P&L structure.
+
+Derived lines are expressed as formulas over other lines and evaluated in
+topological order as vectorized NumPy operations over a lines x months
+matrix (row index = line number). On integer matrices (the engine's int64
+centavos) evaluation is exact integer arithmetic: fractional factors are
+applied as exact fractions rounded to the centavo, and ratios are stored in
+hundredths of a percent so every line converts back to display units by
+dividing by 100. The display layout maps P&L rows to the lines they show.
+Adding a derived line or a row is a change to the tables below, not to
+calculate_pnl.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from money import CENTS, div_round, mul_round
+
+# Tunable parameters referenced by formulas
+DEFAULT_PARAMS = {
+    "payment_processing_rate": 0.1765,
+}
+
+# Derived lines: line = scale * param * op(inputs)
+#   op "sum":   sum of the input lines
+#   op "abs":   sum of the absolute values of the input lines
+#   op "ratio": inputs[0] / inputs[1] (0 where the denominator is 0)
+# Revenues are displayed positive and costs negative.
+LINE_FORMULAS = {
+    # Revenue (enforced positive)
+    112: {"op": "abs", "inputs": [25]},                     # Google Play Revenue
+    113: {"op": "abs", "inputs": [33]},                     # App Store Revenue
+    121: {"op": "abs", "inputs": [38, 49]},                 # Investment income (+ misc revenue)
+    101: {"op": "sum", "inputs": [112, 113]},               # Revenue without investment income
+    100: {"op": "sum", "inputs": [101, 121]},               # Total Revenue
+
+    # Direct costs
+    102: {"op": "sum", "inputs": [101], "scale": -1, "param": "payment_processing_rate"},
+    103: {"op": "abs", "inputs": [43, 44, 45, 46, 47, 48], "scale": -1},  # COGS (Web Services)
+    122: {"op": "sum", "inputs": [102, 103]},               # Total direct costs
+    104: {"op": "sum", "inputs": [100, 122]},               # Gross Profit
+
+    # Operating expenses
+    107: {"op": "abs", "inputs": [56], "scale": -1},        # Marketing
+    108: {"op": "abs", "inputs": [62], "scale": -1},        # Wages
+    109: {"op": "abs", "inputs": [68, 65], "scale": -1},    # Tech Support (specific + generic)
+    110: {"op": "abs", "inputs": [90], "scale": -1},        # Other Expenses
+    105: {"op": "sum", "inputs": [107, 108, 109]},          # SG&A
+    123: {"op": "sum", "inputs": [105, 110]},               # Total operating expenses
+
+    # Results
+    106: {"op": "sum", "inputs": [104, 123]},               # EBITDA
+    111: {"op": "sum", "inputs": [106]},                    # Net Result (= EBITDA for now)
+
+    # Margins (%)
+    124: {"op": "ratio", "inputs": [106, 100], "scale": 100},  # EBITDA margin
+    125: {"op": "ratio", "inputs": [104, 100], "scale": 100},  # Gross margin
+}
+
+# Lines whose formula is a ratio (evaluated after overrides are applied)
+RATIO_LINES = {line for line, f in LINE_FORMULAS.items() if f["op"] == "ratio"}
+
+# Number of rows in the line x months matrix (line numbers index rows directly)
+NUM_LINES = max(120, max(LINE_FORMULAS)) + 1
+
+# P&L rows in display order: row number, description, source line
+PNL_LAYOUT = [
+    {"row": 1, "description": "RECEITA OPERACIONAL BRUTA", "line": 100, "is_header": True},
+    {"row": 2, "description": "Receita de Vendas (Google + Apple)", "line": 101},
+    {"row": 21, "description": "Google Play Revenue", "line": 112},
+    {"row": 22, "description": "App Store Revenue", "line": 113},
+    {"row": 3, "description": "Rendimentos de Aplicações", "line": 38},
+
+    {"row": 4, "description": "(-) CUSTOS DIRETOS", "line": 122, "is_header": True},
+    {"row": 5, "description": "Payment Processing ({payment_processing_rate:.2%})", "line": 102},
+    {"row": 6, "description": "COGS (Web Services)", "line": 103},
+
+    {"row": 7, "description": "(=) LUCRO BRUTO", "line": 104, "is_total": True},
+
+    {"row": 8, "description": "(-) DESPESAS OPERACIONAIS", "line": 123, "is_header": True},
+    {"row": 9, "description": "Marketing", "line": 107},
+    {"row": 10, "description": "Salários (Wages)", "line": 108},
+    {"row": 11, "description": "Tech Support & Services", "line": 109},
+    {"row": 12, "description": "Outras Despesas", "line": 110},
+
+    {"row": 13, "description": "(=) EBITDA", "line": 106, "is_total": True},
+    {"row": 16, "description": "(=) RESULTADO LÍQUIDO", "line": 111, "is_total": True},
+
+    {"row": 14, "description": "Margem EBITDA %", "line": 124},
+    {"row": 15, "description": "Margem Bruta %", "line": 125},
+]
+
+
+# Display row -> source line (overrides from the P&L table are keyed by row)
+ROW_LINES = {item["row"]: item["line"] for item in PNL_LAYOUT}
+
+
+def override_line(key) -> int:
+    """
+    Matrix line for an override key: a P&L display row (as sent by the P&L
+    table) or, for keys that are not rows, an internal line number such as
+    100/106/111. Returns None for keys that are neither.
+    """
+    try:
+        number = int(key)
+    except (TypeError, ValueError):
+        return None
+    if number in ROW_LINES:
+        return ROW_LINES[number]
+    return number if 0 < number < NUM_LINES else None
+
+
+def topological_order(formulas: Dict[int, dict] = LINE_FORMULAS) -> List[int]:
+    """Order derived lines so that every line comes after its inputs."""
+    order = []
+    state = {}  # line -> "visiting" | "done"
+
+    def visit(line):
+        if state.get(line) == "done":
+            return
+        if state.get(line) == "visiting":
+            raise ValueError(f"Cycle in P&L formulas at line {line}")
+        state[line] = "visiting"
+        for dep in formulas[line]["inputs"]:
+            if dep in formulas:
+                visit(dep)
+        state[line] = "done"
+        order.append(line)
+
+    for line in sorted(formulas):
+        visit(line)
+    return order
+
+
+_ORDER = topological_order()
+
+
+def dependents(line: int) -> List[int]:
+    """Derived lines that depend (transitively) on `line`, in evaluation order."""
+    affected = {line}
+    result = []
+    for derived in _ORDER:
+        if any(dep in affected for dep in LINE_FORMULAS[derived]["inputs"]):
+            affected.add(derived)
+            result.append(derived)
+    return result
+
+
+def source_lines(line: int) -> List[int]:
+    """Base (non-derived) lines that `line` is computed from; a base line is its own source."""
+    if line not in LINE_FORMULAS:
+        return [line]
+    sources = set()
+    for dep in LINE_FORMULAS[line]["inputs"]:
+        sources.update(source_lines(dep))
+    return sorted(sources)
+
+
+def line_value(line: int, base_totals: Dict[int, int]) -> int:
+    """Exact value (centavos) of `line` computed from the totals of its base lines."""
+    values = np.zeros((NUM_LINES, 1), dtype=np.int64)
+    for base, total in base_totals.items():
+        values[base, 0] = total
+    return int(evaluate_formulas(values)[line, 0])
+
+
+def evaluate_formulas(
+    values: np.ndarray,
+    params: Dict[str, float] = None,
+    lines: Iterable[int] = None,
+    skip: Iterable[int] = (),
+    pinned: Tuple[np.ndarray, np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Evaluate derived lines in place over values[..., line, month].
+
+    Each formula is one NumPy operation over all months (and any leading
+    axes), so cost does not depend on the number of months. `lines`
+    restricts evaluation to a subset; `skip` excludes lines. `pinned` is a
+    (mask, values) pair shaped like `values`: masked cells keep the pinned
+    value (overrides) and their dependents are computed from it. A param
+    may be an array broadcastable against values[..., line, :], e.g. one
+    rate per scenario shaped (scenarios, 1).
+    """
+    exact = np.issubdtype(values.dtype, np.integer)
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    selected = set(lines) if lines is not None else None
+    skip = set(skip)
+
+    for line in _ORDER:
+        if line in skip or (selected is not None and line not in selected):
+            continue
+        formula = LINE_FORMULAS[line]
+        inputs = formula["inputs"]
+        op = formula["op"]
+
+        if op == "sum":
+            result = values[..., inputs, :].sum(axis=-2)
+        elif op == "abs":
+            result = np.abs(values[..., inputs, :]).sum(axis=-2)
+        elif op == "ratio":
+            num = values[..., inputs[0], :]
+            den = values[..., inputs[1], :]
+            if exact:
+                result = div_round(num * (formula.get("scale", 1) * CENTS), den)
+                _store(values, line, result, pinned)
+                continue
+            result = np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+        else:
+            raise ValueError(f"Unknown formula op '{op}' for line {line}")
+
+        scale = formula.get("scale", 1)
+        if "param" in formula:
+            scale = scale * params[formula["param"]]
+        _store(values, line, mul_round(result, scale) if exact else result * scale, pinned)
+
+    return values
+
+
+def _store(values: np.ndarray, line: int, result: np.ndarray, pinned: Tuple[np.ndarray, np.ndarray] = None):
+    if pinned is not None:
+        mask, pinned_values = pinned
+        result = np.where(mask[..., line, :], pinned_values[..., line, :], result)
+    values[..., line, :] = result
+
+
+def describe_row(item: dict, params: Dict[str, float] = None) -> str:
+    """Row description with formula parameters filled in."""
+    return item["description"].format(**{**DEFAULT_PARAMS, **(params or {})})
@@ -0,0 +1,97 @@
+"""
+Vectorized what-if scenarios over the P&L.
+
+A batch of scenarios (formula parameters, growth multipliers per base line,
+one-off adjustments) is applied to the base lines x months matrix, giving a
+scenarios x lines x months tensor of int64 centavos. Growth factors are
+applied as exact fractions rounded to the centavo, like every factor of the
+P&L engine, so a scenario without assumptions equals the P&L exactly.
+Per-scenario growth factors and parameters are stacked into arrays, so the
+growth, the adjustments and the formula graph are each one NumPy pass over
+the whole tensor regardless of the number of scenarios.
+"""
+
+from typing import List
+
+import numpy as np
+
+from models import Scenario, ScenarioResponse
+from money import CENTS, mul_round, to_centavos
+from pnl_formulas import DEFAULT_PARAMS, LINE_FORMULAS, PNL_LAYOUT, describe_row, evaluate_formulas
+
+# Lines that come from mapped transactions (derived lines are recomputed)
+BASE_LINES = range(1, 121)
+
+
+def _base_line(line: str) -> int:
+    """Validate a scenario line key: a mapped (non-derived) P&L line."""
+    try:
+        line_num = int(line)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid P&L line '{line}'")
+    if line_num not in BASE_LINES or line_num in LINE_FORMULAS:
+        raise ValueError(f"Line {line_num} is not a base P&L line (derived lines follow their inputs)")
+    return line_num
+
+
+def run_scenarios(base: np.ndarray, months: List[str], scenarios: List[Scenario]) -> ScenarioResponse:
+    """
+    Evaluate scenarios over a base lines x months matrix of centavos
+    (as returned by MonthlyCube.slice). Manual P&L overrides are not applied.
+    """
+    month_index = {m: idx for idx, m in enumerate(months)}
+    base = np.asarray(base, dtype=np.int64)
+
+    # Per-scenario inputs: parameters, S x L x 1 growth factors, sparse adjustments
+    scenario_params = []
+    growth = np.ones((len(scenarios), base.shape[0], 1))
+    adj_cells, adj_amounts = [], []
+    for idx, scenario in enumerate(scenarios):
+        unknown = set(scenario.params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown scenario parameter '{sorted(unknown)[0]}'")
+        scenario_params.append({**DEFAULT_PARAMS, **scenario.params})
+        for line, factor in scenario.growth.items():
+            growth[idx, _base_line(line), 0] = factor
+        for line, months_data in scenario.adjustments.items():
+            line_num = _base_line(line)
+            for month, amount in months_data.items():
+                if month in month_index:
+                    adj_cells.append((idx, line_num, month_index[month]))
+                    adj_amounts.append(amount)
+
+    # S x L x M centavos: growth over the base lines that have any, then one-off adjustments
+    values = np.repeat(base[np.newaxis, :, :], len(scenarios), axis=0)
+    grown = np.flatnonzero((growth != 1).any(axis=(0, 2)))
+    if len(grown):
+        values[:, grown, :] = mul_round(base[np.newaxis, grown, :], growth[:, grown, :])
+    if adj_cells:
+        np.add.at(values, tuple(np.array(adj_cells).T), to_centavos(adj_amounts))
+
+    # One formula pass over all scenarios, with each parameter as an S x 1 array
+    params = {
+        name: np.array([p[name] for p in scenario_params], dtype=float).reshape(-1, 1)
+        for name in DEFAULT_PARAMS
+    }
+    evaluate_formulas(values, params)
+
+    # Centavos (and margins in hundredths of a percent) back to display units
+    layout_lines = [item["line"] for item in PNL_LAYOUT]
+    result = values[:, layout_lines, :] / CENTS
+
+    # Row labels show each scenario's parameters (e.g. its payment processing rate)
+    rows = []
+    for item in PNL_LAYOUT:
+        descriptions = [describe_row(item, params) for params in scenario_params]
+        rows.append({
+            "line_number": item["row"],
+            "description": descriptions[0] if len(set(descriptions)) == 1 else describe_row(item),
+            "descriptions": descriptions,
+        })
+
+    return ScenarioResponse(
+        headers=list(months),
+        scenarios=[s.name for s in scenarios],
+        rows=rows,
+        values=result.tolist()
+    )
@@ -0,0 +1,299 @@
+"""
+Crash-safe persistence of the app's on-disk artifacts.
+
+Each artifact (dataset, mappings, overrides, metadata, budget) is its own
+file and is rewritten only when it changes. Writes go to a temporary file in
+the same directory and are renamed over the target, so a crash mid-write
+leaves the previous version intact instead of a truncated file.
+
+The transactions dataset is stored as Parquet (with per-row-group column
+statistics), one partition per competence month, and read projecting only
+the columns the app uses; the remaining export columns stay on disk. Reads
+can be pruned to a set of months. The files are memory-mapped while read,
+but the result is converted to a pandas frame that the reading process owns:
+every server process holds its own copy of the projected columns.
+
+Every upload is an immutable snapshot: a manifest of the partition file of
+each month. Partition files are named by a hash of their content and shared
+between snapshots, so an upload only writes the months whose rows changed
+and storage grows with the deltas.
+
+Several server processes can share one data directory: a state file holds a
+version per part of the state (dataset, mappings, ...), bumped by the writer
+under an inter-process file lock, so every process can tell cheaply when
+another one changed something and reload just that.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process, nothing to coordinate
+    fcntl = None
+
+# Columns the engine, drilldowns, entities and suggestions read
+DATASET_COLUMNS = [
+    'Data de competência', 'Mes_Competencia', 'Valor_Centavos', 'Valor_Num',
+    'Centro de Custo 1', 'Nome do fornecedor/cliente', 'Descrição',
+    'Categoria 1', 'Conta bancária', 'Plano de contas',
+]
+
+ROW_GROUP_SIZE = 64 * 1024
+
+# dataset/Mes_Competencia=YYYY-MM/<content hash>.parquet (rows without a month go
+# to UNDATED) and dataset/snapshots/<version>.json manifests
+PARTITION_COLUMN = 'Mes_Competencia'
+UNDATED = 'undated'
+SNAPSHOTS_DIR = 'snapshots'
+LEGACY_PART_FILE = 'part.parquet'  # unversioned partitions of earlier versions
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w'):
+    """Open a temporary file for writing and atomically replace `path` with it on success."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive lock on `path` held across processes (and threads) for the duration of the block."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_versions(path: Path) -> Dict[str, int]:
+    """Version of each part of the shared state ({} before the first change)."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def bump_versions(path: Path, *parts: str) -> Dict[str, int]:
+    """Increment the versions of `parts` (the caller holds the state lock) and return all versions."""
+    versions = read_versions(path)
+    for part in parts:
+        versions[part] = versions.get(part, 0) + 1
+    with atomic_write(path) as f:
+        json.dump(versions, f)
+    return versions
+
+
+def _normalized(df: pd.DataFrame) -> pd.DataFrame:
+    """Transactions frame as stored: months as 'YYYY-MM', text columns as strings."""
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if isinstance(series.dtype, pd.PeriodDtype):
+            series = series.astype(str).where(series.notna(), None)
+        elif series.dtype == object:
+            # Mixed-type text columns from read_csv
+            series = series.where(series.isna(), series.astype(str))
+        columns[name] = series
+    return pd.DataFrame(columns)
+
+
+def _content_hash(df: pd.DataFrame) -> str:
+    """Hash of a normalized partition's columns, dtypes and values."""
+    digest = hashlib.sha256(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:32]
+
+
+def is_month(value: str) -> bool:
+    """'YYYY-MM' month key"""
+    try:
+        return len(value) == 7 and pd.Period(value, freq='M').strftime('%Y-%m') == value
+    except (ValueError, TypeError):
+        return False
+
+
+def is_date(value: str) -> bool:
+    """'YYYY-MM-DD' date"""
+    try:
+        return len(value) == 10 and pd.Timestamp(value).strftime('%Y-%m-%d') == value
+    except (ValueError, TypeError):
+        return False
+
+
+def partition_keys(df: pd.DataFrame) -> pd.Series:
+    """Partition ('YYYY-MM' or UNDATED) of each row."""
+    months = df[PARTITION_COLUMN]
+    return months.astype(str).where(months.notna(), UNDATED)
+
+
+def in_partition_order(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows in the order a read returns them: by month, UNDATED last, stable within a month."""
+    order = np.argsort(partition_keys(df).to_numpy(dtype=str), kind='stable')
+    return df.iloc[order].reset_index(drop=True)
+
+
+def snapshots(root: Path) -> List[int]:
+    """Versions of the stored snapshots, oldest first."""
+    directory = Path(root) / SNAPSHOTS_DIR
+    if not directory.is_dir():
+        return []
+    return sorted(int(p.stem) for p in directory.glob("*.json") if p.stem.isdigit())
+
+
+def load_manifest(root: Path, version: int = None) -> Optional[dict]:
+    """
+    Manifest of a snapshot (the latest when version is None):
+    {"version", "created", "rows", "partitions": {month: {"file", "rows"}}}.
+    None if there is no such snapshot.
+    """
+    versions = snapshots(root)
+    if version is None:
+        if not versions:
+            return None
+        version = versions[-1]
+    elif version not in versions:
+        return None
+    with open(Path(root) / SNAPSHOTS_DIR / f"{version}.json") as f:
+        return json.load(f)
+
+
+def _write_manifest(root: Path, version: int, partitions: Dict[str, dict]) -> dict:
+    manifest = {
+        "version": version,
+        "created": datetime.now().isoformat(),
+        "rows": sum(p["rows"] for p in partitions.values()),
+        "partitions": dict(sorted(partitions.items(), key=lambda item: (item[0] == UNDATED, item[0]))),
+    }
+    path = Path(root) / SNAPSHOTS_DIR / f"{version}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(path) as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def adopt_unversioned(root: Path, version: int) -> Optional[dict]:
+    """Record the unversioned partitions of earlier versions as a snapshot (no data is rewritten)."""
+    root = Path(root)
+    prefix = f"{PARTITION_COLUMN}="
+    partitions = {
+        p.name[len(prefix):]: {
+            "file": f"{p.name}/{LEGACY_PART_FILE}",
+            "rows": pq.read_metadata(p / LEGACY_PART_FILE).num_rows,
+        }
+        for p in (root.iterdir() if root.is_dir() else [])
+        if p.name.startswith(prefix) and (p / LEGACY_PART_FILE).exists()
+    }
+    if not partitions or snapshots(root):
+        return None
+    return _write_manifest(root, version, partitions)
+
+
+def dataset_months(root: Path, version: int = None) -> List[str]:
+    """Partitions of a snapshot (the latest by default), in month order (UNDATED last)."""
+    manifest = load_manifest(root, version)
+    return list(manifest["partitions"]) if manifest else []
+
+
+def partition_files(root: Path, months: List[str] = None, version: int = None) -> List[Path]:
+    """Parquet files of a snapshot's partitions, optionally pruned to `months`."""
+    manifest = load_manifest(root, version)
+    if manifest is None:
+        return []
+    return [
+        Path(root) / entry["file"] for month, entry in manifest["partitions"].items()
+        if months is None or month in months
+    ]
+
+
+def write_dataset(df: pd.DataFrame, root: Path, version: int, months: List[str] = None) -> List[str]:
+    """
+    Store df as snapshot `version`, one Parquet partition per month.
+
+    Partition files are content-addressed: a month whose rows are unchanged
+    reuses the existing file. With `months`, only those months are taken
+    from df (e.g. an upload that appends or replaces a month) and the others
+    are carried over from the latest snapshot. Returns the months whose
+    partition file was newly written.
+    """
+    root = Path(root)
+    previous = load_manifest(root) if months is not None else None
+    partitions = dict(previous["partitions"]) if previous else {}
+
+    groups = df.groupby(partition_keys(df).to_numpy(), sort=True).indices
+    written = []
+    for month, rows in groups.items():
+        if months is not None and month not in months:
+            continue
+        part = _normalized(df.iloc[rows])
+        file = f"{PARTITION_COLUMN}={month}/{_content_hash(part)}.parquet"
+        path = root / file
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            with atomic_write(path, 'wb') as f:
+                pq.write_table(table, f, row_group_size=ROW_GROUP_SIZE, compression='zstd', write_statistics=True)
+            written.append(month)
+        partitions[month] = {"file": file, "rows": len(rows)}
+
+    _write_manifest(root, version, partitions)
+    return written
+
+
+def read_dataset(path: Path, columns: List[str] = DATASET_COLUMNS, months: List[str] = None, version: int = None) -> pd.DataFrame:
+    """
+    Read the dataset into a pandas frame, loading only `columns` (those present;
+    None loads all of them). `path` is a dataset directory, read at snapshot
+    `version` (the latest by default) with `months` pruning the partitions,
+    or a single Parquet file. The frame is a private copy (the memory map
+    only avoids an extra read buffer).
+    """
+    path = Path(path)
+    files = partition_files(path, months, version) if path.is_dir() else [path]
+
+    tables = []
+    for file in files:
+        names = pq.read_schema(file).names
+        projection = [c for c in columns if c in names] if columns is not None else None
+        tables.append(pq.read_table(file, columns=projection, memory_map=True))
+    if not tables:
+        return pd.DataFrame(columns=columns or [])
+
+    df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    if PARTITION_COLUMN in df.columns:
+        df[PARTITION_COLUMN] = _to_periods(df[PARTITION_COLUMN])
+    return df
+
+
+def _to_periods(months: pd.Series) -> pd.Series:
+    """Monthly periods of 'YYYY-MM' strings, parsed once per distinct month."""
+    codes, uniques = pd.factorize(months)
+    periods = pd.PeriodIndex(list(uniques), freq='M').take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(periods, index=months.index, name=months.name)
@@ -0,0 +1,165 @@
+"""
+Batch P&L line suggestions for unmapped transactions.
+
+A lightweight text classifier (hashing vectorizer + linear model) is trained
+on the transactions the mappings already classify and predicts `linha_pl`
+for every distinct unmapped (cost center, supplier) pair in one batched
+inference call. The trained model is pickled next to the dataset together
+with the dataset version and a fingerprint of its training labels, and is
+only retrained when those labels change.
+"""
+
+import hashlib
+import pickle
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from logic import classify_transactions, normalize_text_helper
+from models import MappingItem, MappingSuggestion
+from storage import atomic_write
+
+# Character n-grams are robust to supplier name drift and abbreviations
+_vectorizer = HashingVectorizer(
+    analyzer='char_wb', ngram_range=(2, 4), n_features=2 ** 18, alternate_sign=False
+)
+
+# In-memory copy of the on-disk model: {path: (fingerprint, model)}
+_model_cache = {}
+
+
+def _feature_text(df: pd.DataFrame) -> pd.Series:
+    """Text used as classifier input: cost center + supplier + category."""
+    parts = [df['Centro de Custo 1'], df['Nome do fornecedor/cliente']]
+    if 'Categoria 1' in df.columns:
+        parts.append(df['Categoria 1'])
+    text = parts[0].fillna('').astype(str)
+    for part in parts[1:]:
+        text = text + " | " + part.fillna('').astype(str)
+    lookup = {t: normalize_text_helper(t) for t in pd.unique(text)}
+    return text.map(lookup)
+
+
+def _fingerprint(pairs: pd.DataFrame) -> str:
+    """Stable hash of the (text, label) training pairs."""
+    hashed = pd.util.hash_pandas_object(pairs, index=False)
+    return hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest()
+
+
+def load_or_train_model(texts: np.ndarray, labels: np.ndarray, model_path: Path, dataset_version: int = 0):
+    """
+    Return a classifier for the given training pairs, reusing the cached one
+    when the labels haven't changed. Returns None if there is nothing to learn
+    (fewer than two distinct lines).
+    """
+    training = pd.DataFrame({'text': texts, 'label': labels})
+    fingerprint = _fingerprint(training)
+
+    cached = _model_cache.get(str(model_path))
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    if model_path.exists():
+        try:
+            with open(model_path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored.get('fingerprint') == fingerprint:
+                _model_cache[str(model_path)] = (fingerprint, stored['model'])
+                return stored['model']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, TypeError) as e:
+            # Unreadable or from an incompatible version: a cache miss, retrain
+            print(f"⚠️ Ignoring unreadable suggestion model, retraining: {e}")
+
+    if training['label'].nunique() < 2:
+        return None
+
+    # Train on distinct (text, label) pairs weighted by how often they occur
+    pairs = training.value_counts().reset_index(name='count')
+    model = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=50, tol=None, random_state=0)
+    model.fit(_vectorizer.transform(pairs['text']), pairs['label'], sample_weight=pairs['count'].to_numpy())
+
+    # Other workers may be reading the file: replace it whole, never truncate it
+    try:
+        with atomic_write(model_path, 'wb') as f:
+            pickle.dump({'fingerprint': fingerprint, 'dataset_version': dataset_version, 'model': model}, f)
+    except OSError as e:
+        print(f"⚠️ Could not persist suggestion model: {e}")
+
+    _model_cache[str(model_path)] = (fingerprint, model)
+    return model
+
+
+def suggest_mappings(
+    df: pd.DataFrame,
+    mappings: List[MappingItem],
+    model_path: Path,
+    dataset_version: int = 0,
+    min_confidence: float = 0.0,
+) -> List[MappingSuggestion]:
+    """
+    Suggest a mapping for each distinct unmapped (cost center, supplier) pair,
+    ordered by the absolute amount they leave out of the P&L.
+    """
+    if df is None or df.empty:
+        return []
+
+    lines = classify_transactions(df, mappings)
+    texts = _feature_text(df)
+    mapped = lines > 0
+    if mapped.all():
+        return []
+
+    model = load_or_train_model(
+        texts.to_numpy()[mapped], lines[mapped].astype(str), model_path, dataset_version
+    )
+    if model is None:
+        return []
+
+    unmapped = pd.DataFrame({
+        'centro_custo': df['Centro de Custo 1'].fillna('').astype(str).to_numpy()[~mapped],
+        'fornecedor_cliente': df['Nome do fornecedor/cliente'].fillna('').astype(str).to_numpy()[~mapped],
+        'text': texts.to_numpy()[~mapped],
+        'valor': pd.to_numeric(df['Valor_Num'], errors='coerce').fillna(0.0).to_numpy()[~mapped],
+    })
+    groups = unmapped.groupby(['centro_custo', 'fornecedor_cliente'], sort=False).agg(
+        text=('text', 'first'), transactions=('valor', 'size'), total=('valor', 'sum')
+    ).reset_index()
+
+    # One batched inference call for every unmapped group
+    probabilities = model.predict_proba(_vectorizer.transform(groups['text']))
+    best = probabilities.argmax(axis=1)
+    confidences = probabilities[np.arange(len(groups)), best]
+    predicted = model.classes_[best]
+
+    # Most common tipo per P&L line, taken from the existing mappings
+    tipos = {}
+    for (line, tipo), _ in Counter((m.linha_pl, m.tipo) for m in mappings).most_common():
+        tipos.setdefault(line, tipo)
+
+    suggestions = []
+    for group, line, confidence in zip(groups.itertuples(index=False), predicted, confidences):
+        if confidence < min_confidence:
+            continue
+        suggestions.append(MappingSuggestion(
+            mapping=MappingItem(
+                grupo_financeiro=group.centro_custo,
+                centro_custo=group.centro_custo,
+                fornecedor_cliente=group.fornecedor_cliente,
+                linha_pl=str(line),
+                tipo=tipos.get(str(line), "Despesa"),
+                ativo="Sim",
+                observacoes=f"Sugestão automática ({confidence:.0%})"
+            ),
+            confidence=float(confidence),
+            transactions=int(group.transactions),
+            total=round(float(group.total), 2)
+        ))
+
+    suggestions.sort(key=lambda s: abs(s.total), reverse=True)
+    return suggestions
+
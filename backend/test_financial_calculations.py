@@ -18,6 +18,7 @@ import numpy as np
 from datetime import datetime
 import sys
 import os
+import json
 
 # Add backend to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -371,3 +372,1055 @@ def test_payroll_category_reroutes_to_wages_cost_center(tmp_path):
 
     assert wages_row.values[month] == -1000.0, "Mapped payroll value should flow into P&L line 62 and dashboard"
 
+
+
+class TestFuzzySupplierMatching:
+    """Test the optional fuzzy supplier tier of the classifier"""
+
+    def _pnl(self, fuzzy_match):
+        df = create_test_dataframe([
+            {'supplier': 'Google Brasil Pagtos', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'Receita Google'},
+        ])
+        mappings = [
+            create_mapping("GOOGLE BRASIL PAGAMENTOS LTDA", "25", "Receita Google", "Receita"),
+            create_mapping("Diversos", "38", "Receita Google", "Receita"),
+        ]
+        return calculate_pnl(df, mappings, fuzzy_match=fuzzy_match)
+
+    def test_drifted_supplier_falls_back_without_fuzzy(self):
+        """Without the fuzzy tier the drifted name only hits the generic mapping"""
+        pnl = self._pnl(fuzzy_match=False)
+        assert _find_row_by_description(pnl, "Google Play Revenue").values['2024-01'] == 0.0
+        assert _find_row_by_description(pnl, "Rendimentos de Aplicações").values['2024-01'] == 1000.0
+
+    def test_drifted_supplier_matches_with_fuzzy(self):
+        """With the fuzzy tier the drifted name matches the specific supplier mapping"""
+        pnl = self._pnl(fuzzy_match=True)
+        assert _find_row_by_description(pnl, "Google Play Revenue").values['2024-01'] == 1000.0
+
+    def test_index_is_scoped_to_cost_center_and_memoized(self):
+        """Fuzzy matches never cross cost centers and are computed once per (cost center, supplier)"""
+        from fuzzy_matching import SupplierIndex
+
+        index = SupplierIndex([("receita google", "google brasil pagamentos ltda", "google")])
+
+        assert index.match("google brasil pagtos", "receita google") == "google"
+        assert index.match("google brasil pagtos", "marketing") is None
+        assert index.match("mga marketing", "receita google") is None
+        assert set(index._memo) == {
+            ("receita google", "google brasil pagtos"),
+            ("marketing", "google brasil pagtos"),
+            ("receita google", "mga marketing"),
+        }
+
+    def test_similar_suppliers_of_other_cost_centers_do_not_crowd_out_the_match(self):
+        """Candidates are blocked within the cost center before the top-k cut"""
+        from fuzzy_matching import MAX_CANDIDATES, SupplierIndex
+
+        decoys = [(f"marketing {i}", "google brasil pagtos", f"decoy {i}") for i in range(MAX_CANDIDATES + 3)]
+        index = SupplierIndex(decoys + [("receita google", "google brasil pagamentos ltda", "google")])
+
+        assert index.match("google brasil pagtos", "receita google") == "google"
+
+
+def test_mapping_suggestions_for_unmapped_rows(tmp_path):
+    """Unmapped suppliers get a suggested line; the trained model is cached on disk."""
+    from suggestions import suggest_mappings
+
+    df = create_test_dataframe(
+        [{'supplier': 'AWS', 'value': -10.0, 'cost_center': 'Web Services Expenses'}] * 3 +
+        [{'supplier': 'MGA MARKETING LTDA', 'value': -20.0, 'cost_center': 'Marketing & Growth Expenses'}] * 3 +
+        [{'supplier': 'Meta Ads', 'value': -30.0, 'cost_center': 'Marketing & Growth Expenses'}]
+    )
+    mappings = [
+        create_mapping("AWS", "43", "Web Services Expenses", "Custo"),
+        create_mapping("MGA MARKETING LTDA", "56", "Marketing & Growth Expenses"),
+    ]
+    model_path = tmp_path / "model.pkl"
+
+    suggestions = suggest_mappings(df, mappings, model_path, dataset_version=1)
+
+    assert len(suggestions) == 1
+    assert suggestions[0].mapping.fornecedor_cliente == "Meta Ads"
+    assert suggestions[0].mapping.linha_pl == "56"
+    assert suggestions[0].transactions == 1
+    assert model_path.exists()
+
+    # A truncated file (e.g. read mid-write by another worker) is a cache miss: retrain and rewrite it
+    import pickle
+    import suggestions as suggestions_module
+    model_path.write_bytes(model_path.read_bytes()[:20])
+    suggestions_module._model_cache.clear()
+    assert suggest_mappings(df, mappings, model_path, dataset_version=1)[0].mapping.linha_pl == "56"
+    with open(model_path, 'rb') as f:
+        assert pickle.load(f)['dataset_version'] == 1
+
+
+class TestFormulaGraph:
+    """Test the declarative P&L formula graph"""
+
+    def test_payment_processing_rate_is_a_parameter(self):
+        """Changing the rate flows into payment processing, gross profit and the row label"""
+        df = create_test_dataframe([
+            {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        ])
+        mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+        pnl = calculate_pnl(df, mappings, params={"payment_processing_rate": 0.15})
+
+        pp_row = next(r for r in pnl.rows if r.line_number == 5)
+        assert pp_row.description == "Payment Processing (15.00%)"
+        assert pp_row.values['2024-01'] == pytest.approx(-150.0)
+        assert _find_row_by_description(pnl, "(=) LUCRO BRUTO").values['2024-01'] == pytest.approx(850.0)
+
+    def test_formulas_evaluate_all_months_at_once(self):
+        """Derived lines are computed column-wise over a lines x months matrix"""
+        from pnl_formulas import NUM_LINES, evaluate_formulas
+
+        values = np.zeros((NUM_LINES, 3))
+        values[25] = [100.0, 200.0, 300.0]
+        values[56] = [-10.0, -20.0, -30.0]
+
+        evaluate_formulas(values)
+
+        np.testing.assert_allclose(values[100], [100.0, 200.0, 300.0])
+        np.testing.assert_allclose(values[106], [100 - 17.65 - 10, 200 - 35.3 - 20, 300 - 52.95 - 30])
+        np.testing.assert_allclose(values[124], values[106] / values[100] * 100)
+
+    def test_cycles_are_rejected(self):
+        from pnl_formulas import topological_order
+
+        with pytest.raises(ValueError):
+            topological_order({1: {"op": "sum", "inputs": [2]}, 2: {"op": "sum", "inputs": [1]}})
+
+
+class TestMatrixAccumulation:
+    """Test accumulation into the dense lines x months matrix"""
+
+    def test_months_sorted_and_accumulated_per_column(self):
+        df = create_test_dataframe([
+            {'supplier': 'GOOGLE CLOUD', 'value': 300.0, 'month': '2024-03', 'cost_center': 'GOOGLE PLAY'},
+            {'supplier': 'GOOGLE CLOUD', 'value': 100.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+            {'supplier': 'GOOGLE CLOUD', 'value': 50.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+            {'supplier': 'GOOGLE CLOUD', 'value': 999.0, 'month': None, 'cost_center': 'GOOGLE PLAY'},
+        ])
+        mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+        pnl = calculate_pnl(df, mappings)
+
+        assert pnl.headers == ['2024-01', '2024-03']
+        assert _find_row_by_description(pnl, "Google Play Revenue").values == {'2024-01': 150.0, '2024-03': 300.0}
+
+    def test_date_filter_excluding_everything(self):
+        df = create_test_dataframe([
+            {'supplier': 'GOOGLE CLOUD', 'value': 100.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        ])
+        df['Data de competência'] = pd.to_datetime(['2024-01-10'])
+
+        pnl = calculate_pnl(df, [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")], start_date='2025-01-01')
+
+        assert pnl.headers == []
+        assert all(row.values == {} for row in pnl.rows)
+
+
+def test_pnl_cache_lru_eviction_and_stats():
+    """The result cache evicts least-recently-used keys and counts hits/misses"""
+    from pnl_cache import LRUCache, fingerprint
+
+    cache = LRUCache(maxsize=2)
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        return key.upper()
+
+    assert cache.get_or_compute("a", lambda: compute("a")) == "A"
+    assert cache.get_or_compute("b", lambda: compute("b")) == "B"
+    assert cache.get_or_compute("a", lambda: compute("a")) == "A"  # hit, "a" becomes most recent
+    cache.get_or_compute("c", lambda: compute("c"))                # evicts "b"
+    cache.get_or_compute("b", lambda: compute("b"))
+
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 4
+    assert cache.stats()["size"] == 2
+    assert fingerprint({"111": {"2024-01": 1.0}}) == fingerprint({"111": {"2024-01": 1.0}})
+
+
+def test_monthly_cube_matches_row_level_date_filter():
+    """Slicing the monthly cube gives the same P&L as filtering raw rows"""
+    from logic import build_monthly_cube
+
+    dates = pd.to_datetime(['2024-01-05', '2024-01-25', '2024-02-10', '2024-03-01', '2024-03-31'])
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'cost_center': 'GOOGLE PLAY'} for v in [10.0, 20.0, 40.0, 80.0, 160.0]
+    ])
+    df['Data de competência'] = dates
+    df['Mes_Competencia'] = dates.to_period('M')
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    cube = build_monthly_cube(df, mappings)
+
+    for start, end in [(None, None), ('2024-01-01', '2024-03-31'), ('2024-01-10', '2024-03-15'),
+                       ('2024-02-01', None), (None, '2024-01-20'), ('2024-02-11', '2024-02-28')]:
+        # Oracle: filter the raw rows by date in pandas, then run the P&L without a date range
+        mask = pd.Series(True, index=df.index)
+        if start:
+            mask &= df['Data de competência'] >= pd.Timestamp(start)
+        if end:
+            mask &= df['Data de competência'] <= pd.Timestamp(end)
+        sliced = calculate_pnl(None, mappings, start_date=start, end_date=end, cube=cube)
+        if mask.any():
+            assert sliced.model_dump() == calculate_pnl(df[mask], mappings).model_dump(), (start, end)
+        else:
+            assert sliced.headers == [] and all(not r.values for r in sliced.rows), (start, end)
+
+        revenue = next((r.values for r in sliced.rows if r.line_number == 21), {})
+        by_month = df[mask].groupby(df['Mes_Competencia'].astype(str))['Valor_Num'].sum()
+        assert revenue == by_month.to_dict(), (start, end)
+
+
+def test_calculate_pnl_does_not_modify_input():
+    """The engine reads the uploaded frame without copying or mutating it"""
+    from logic import TransactionStore
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'month': m, 'cost_center': 'GOOGLE PLAY'}
+        for v, m in [(100.0, '2024-01'), (50.0, '2024-06'), (25.0, '2025-01')]
+    ])
+    df['Data de competência'] = pd.to_datetime(['2024-01-15', '2024-06-30', '2025-01-02'])
+    before = df.copy()
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    from_df = calculate_pnl(df, mappings, start_date='2024-01-01', end_date='2024-12-31')
+    from_store = calculate_pnl(TransactionStore(df), mappings, start_date='2024-01-01', end_date='2024-12-31')
+
+    pd.testing.assert_frame_equal(df, before)
+    assert from_store.model_dump() == from_df.model_dump()
+    assert from_df.headers == ['2024-01', '2024-06']
+
+
+def test_granularity_rollups_from_daily_cube():
+    """Week/month/quarter/year views are rollups of the day view"""
+    dates = pd.to_datetime(['2024-12-30', '2025-01-02', '2025-01-06', '2025-03-31', '2025-04-01'])
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'cost_center': 'GOOGLE PLAY'} for v in [1.0, 2.0, 4.0, 8.0, 16.0]
+    ])
+    df['Data de competência'] = dates
+    df['Mes_Competencia'] = dates.to_period('M')
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    def revenue(granularity, **kwargs):
+        pnl = calculate_pnl(df, mappings, granularity=granularity, **kwargs)
+        return next(r.values for r in pnl.rows if r.line_number == 21)
+
+    assert revenue("day") == {'2024-12-30': 1.0, '2025-01-02': 2.0, '2025-01-06': 4.0, '2025-03-31': 8.0, '2025-04-01': 16.0}
+    assert revenue("week") == {'2024-12-30': 3.0, '2025-01-06': 4.0, '2025-03-31': 24.0}
+    assert revenue("quarter") == {'2024Q4': 1.0, '2025Q1': 14.0, '2025Q2': 16.0}
+    assert revenue("year", start_date='2025-01-03') == {'2025': 28.0}
+    assert revenue("month") == {'2024-12': 1.0, '2025-01': 6.0, '2025-03': 8.0, '2025-04': 16.0}
+    assert revenue("week", start_date='2026-01-01') == {}
+
+    with pytest.raises(ValueError):
+        calculate_pnl(df, mappings, granularity="fortnight")
+
+
+def test_integer_centavo_accumulation_is_exact():
+    """Amounts are summed as int64 centavos, so many small values add up exactly"""
+    from money import div_round, mul_round, parse_centavos, to_centavos
+
+    df = create_test_dataframe([{'supplier': 'GOOGLE CLOUD', 'value': 0.1, 'cost_center': 'GOOGLE PLAY'}] * 10000)
+    pnl = calculate_pnl(df, [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")])
+
+    assert _find_row_by_description(pnl, "Google Play Revenue").values['2024-01'] == 1000.0
+    assert sum([0.1] * 10000) != 1000.0  # float accumulation would drift
+    assert next(r for r in pnl.rows if r.line_number == 5).values['2024-01'] == -176.5
+    assert next(r for r in pnl.rows if r.line_number == 15).values['2024-01'] == 82.35
+
+    assert parse_centavos("1234.565") == 123457
+    assert to_centavos([1.005, None, -2.5]).tolist() == [100, 0, -250]
+    assert div_round(np.array([5, -5, 7]), np.array([2, 2, 0])).tolist() == [3, -3, 0]
+    assert mul_round(np.array([1001]), -0.1765).tolist() == [-177]
+    assert mul_round(np.array([[1001], [1001]]), np.array([[-0.1765], [0.5]])).tolist() == [[-177], [501]]
+
+
+def test_scenarios_broadcast_over_base_matrix():
+    """Each scenario matches a calculate_pnl run with the same assumptions"""
+    from logic import build_monthly_cube
+    from models import Scenario
+    from scenarios import run_scenarios
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 2000.0, 'month': '2024-02', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'JOHN DOE', 'value': -500.0, 'month': '2024-01', 'cost_center': 'WAGES'},
+        {'supplier': 'JOHN DOE', 'value': -500.0, 'month': '2024-02', 'cost_center': 'WAGES'},
+    ])
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("JOHN DOE", "62", "WAGES", "Despesa"),
+    ]
+    months, base = build_monthly_cube(df, mappings).slice()
+
+    result = run_scenarios(base, months, [
+        Scenario(name="base"),
+        Scenario(name="board", params={"payment_processing_rate": 0.15}, growth={"62": 1.1},
+                 adjustments={"56": {"2024-02": -300.0}}),
+    ])
+
+    assert result.scenarios == ["base", "board"]
+    ebitda = next(i for i, r in enumerate(result.rows) if r["line_number"] == 13)
+    expected_base = calculate_pnl(df, mappings)
+    assert result.values[0][ebitda] == [expected_base.rows[ebitda].values[m] for m in months]
+    # 1000 - 150 - 550 = 300; 2000 - 300 - 550 - 300 = 850
+    assert result.values[1][ebitda] == [300.0, 850.0]
+
+    # Labels follow each scenario's parameters
+    processing = next(r for r in result.rows if r["line_number"] == 5)
+    assert processing["descriptions"] == ["Payment Processing (17.65%)", "Payment Processing (15.00%)"]
+
+    with pytest.raises(ValueError):
+        run_scenarios(base, months, [Scenario(name="bad", growth={"106": 2.0})])
+
+
+def test_base_scenario_equals_pnl_to_the_centavo():
+    """Scenarios run on the int64 centavo path, so rounding matches calculate_pnl"""
+    from logic import build_monthly_cube
+    from models import Scenario
+    from scenarios import run_scenarios
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'month': m, 'cost_center': 'GOOGLE PLAY'}
+        for v, m in [(333.33, '2024-01'), (0.07, '2024-01'), (1234.57, '2024-02'), (19.99, '2024-03')]
+    ])
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    months, base = build_monthly_cube(df, mappings).slice()
+
+    result = run_scenarios(base, months, [Scenario(name="base"), Scenario(name="base again", growth={"25": 1.0})])
+    expected = calculate_pnl(df, mappings)
+    for idx, row in enumerate(expected.rows):
+        assert result.values[0][idx] == [row.values[m] for m in months], row.description
+    assert result.values[1] == result.values[0]
+
+
+def test_scenario_sweep_equals_each_scenario_run_alone():
+    """The batched tensor pass gives every scenario the result of running it by itself"""
+    from logic import build_monthly_cube
+    from models import Scenario
+    from scenarios import run_scenarios
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'month': m, 'cost_center': 'GOOGLE PLAY'}
+        for v, m in [(333.33, '2024-01'), (1234.57, '2024-02'), (19.99, '2024-03')]
+    ] + [{'supplier': 'JOHN DOE', 'value': -101.01, 'month': '2024-02', 'cost_center': 'WAGES'}])
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("JOHN DOE", "62", "WAGES", "Despesa"),
+    ]
+    months, base = build_monthly_cube(df, mappings).slice()
+
+    sweep = [
+        Scenario(name=f"rate {i}", params={"payment_processing_rate": 0.15 + i * 0.0007},
+                 growth={"25": 1 + i / 100}, adjustments={"62": {"2024-02": -0.05 * i}})
+        for i in range(20)
+    ] + [Scenario(name="plain")]
+    batched = run_scenarios(base, months, sweep)
+    for idx, scenario in enumerate(sweep):
+        alone = run_scenarios(base, months, [scenario])
+        assert batched.values[idx] == alone.values[0], scenario.name
+        assert [r["descriptions"][idx] for r in batched.rows] == [r["description"] for r in alone.rows]
+
+
+def test_budget_import_and_variance():
+    """Plan rows load into the line x month matrix and are compared with actuals"""
+    from budget import calculate_variance, load_budget
+    from logic import build_monthly_cube, evaluate_pnl_matrix
+
+    plan = (
+        '*Tudo deve estar em Regime de Competência,UNIT,12/2023,01/2024\n'
+        'Revenue,BRL,"R$9.999,00","R$9.999,00"\n'
+        '     Google,BRL,"R$800,00","R$1.000,00"\n'
+        '          Brazil,BRL,"R$1,00","R$1,00"\n'
+        '     Marketing,BRL,"R$100,00","R$200,00"\n'
+        'Wages,BRL,#REF!,-\n'
+    ).encode('utf-8')
+    budget = load_budget(plan)
+    assert budget.months == ['2023-12', '2024-01']
+
+    df = create_test_dataframe([{'supplier': 'GOOGLE CLOUD', 'value': 1200.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'}])
+    months, actual = build_monthly_cube(df, [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]).slice()
+    evaluate_pnl_matrix(actual, months)
+
+    result = calculate_variance(months, actual, budget.months, budget.values)
+    revenue = next(r for r in result.rows if r.line_number == 21)
+    marketing = next(r for r in result.rows if r.line_number == 9)
+
+    assert result.headers == ['2023-12', '2024-01']
+    assert revenue.budget == {'2023-12': 800.0, '2024-01': 1000.0}
+    assert revenue.variance == {'2023-12': -800.0, '2024-01': 200.0}
+    assert revenue.variance_pct == {'2023-12': -100.0, '2024-01': 20.0}
+    assert marketing.budget['2024-01'] == -200.0
+    assert next(r for r in result.rows if r.line_number == 10).variance_pct == {'2023-12': None, '2024-01': None}
+    assert budget.slice('2024-01-15')[0] == ['2024-01']
+
+
+def test_period_comparisons_from_monthly_matrix():
+    """MoM/YoY/YTD/TTM come from calendar shifts and running totals of one matrix"""
+    dates = pd.to_datetime(['2023-12-10', '2024-01-10', '2024-02-10', '2024-12-10'])
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'cost_center': 'GOOGLE PLAY'} for v in [100.0, 200.0, 300.0, 400.0]
+    ])
+    df['Data de competência'] = dates
+    df['Mes_Competencia'] = dates.to_period('M')
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    pnl = calculate_pnl(df, mappings, start_date='2024-01-01', comparisons=["mom", "yoy", "ytd", "ttm"])
+    revenue = _find_row_by_description(pnl, "Google Play Revenue").comparisons
+
+    assert pnl.headers == ['2024-01', '2024-02', '2024-12']
+    assert revenue["mom"] == {'2024-01': 100.0, '2024-02': 100.0, '2024-12': 400.0}  # Nov/24 had no revenue
+    assert revenue["yoy"] == {'2024-01': None, '2024-02': None, '2024-12': 300.0}  # history before the range counts
+    assert revenue["ytd"] == {'2024-01': 200.0, '2024-02': 500.0, '2024-12': 900.0}
+    assert revenue["ttm"] == {'2024-01': None, '2024-02': None, '2024-12': 900.0}
+    assert calculate_pnl(df, mappings).rows[0].comparisons is None
+
+    with pytest.raises(ValueError):
+        calculate_pnl(df, mappings, comparisons=["wow"])
+
+
+def test_entity_consolidation_and_intercompany_elimination():
+    """Entity matrices sum to the company P&L; mapped transfers between accounts can be eliminated"""
+    from entities import build_all_entity_cubes, consolidate
+    from logic import evaluate_pnl_matrix, pnl_response
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'JOHN DOE', 'value': -300.0, 'cost_center': 'WAGES'},
+        {'supplier': 'JOHN DOE', 'value': -50.0, 'cost_center': 'WAGES'},
+        {'supplier': 'UMATCH LTDA', 'value': -200.0, 'cost_center': 'OUTRAS DESPESAS'},
+        {'supplier': 'UMATCH LTDA', 'value': 200.0, 'cost_center': 'CONTA PROPRIA'},
+    ])
+    df['Conta bancária'] = ['Banco A', 'Banco B', 'Banco A', 'Banco A', 'Banco B']
+    df['Categoria 1'] = ['Receitas de Vendas', 'Pró-labore', 'Pró-labore',
+                         'Transferência de Saída', 'Transferência de Entrada']
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("JOHN DOE", "62", "WAGES", "Despesa"),
+        create_mapping("Diversos", "90", "OUTRAS DESPESAS", "Despesa"),
+    ]
+
+    cubes = build_all_entity_cubes(df, mappings, max_workers=1)
+    months, per_entity, consolidated = consolidate(cubes)
+
+    assert sorted(per_entity) == ['Banco A', 'Banco B']
+    assert per_entity['Banco A'][62].tolist() == [-5000]
+    assert consolidated[62].tolist() == [-35000]  # centavos
+    assert consolidated[90].tolist() == [-20000]
+    evaluate_pnl_matrix(consolidated, months)
+    assert pnl_response(months, consolidated).model_dump() == calculate_pnl(df, mappings).model_dump()
+
+    # Only the mapped outgoing transfer reaches the P&L, so only it is eliminated;
+    # the unmapped incoming side and the wages (not transfers) are left alone
+    _, _, eliminated = consolidate(cubes, eliminate_intercompany=True)
+    assert eliminated[90].tolist() == [0]
+    assert eliminated[62].tolist() == [-35000]
+    assert eliminated[25].tolist() == consolidated[25].tolist()
+
+
+def test_entity_cubes_from_process_pool_match_serial(monkeypatch):
+    """The worker-process path builds the same cubes as the in-process one"""
+    import entities
+    from entities import build_all_entity_cubes, consolidate
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'JOHN DOE', 'value': -300.0, 'month': '2024-02', 'cost_center': 'WAGES'},
+        {'supplier': 'UMATCH LTDA', 'value': -200.0, 'month': '2024-02', 'cost_center': 'OUTRAS DESPESAS'},
+    ])
+    df['Conta bancária'] = ['Banco A', 'Banco B', 'Banco C']
+    df['Categoria 1'] = ['Receitas de Vendas', 'Pró-labore', 'Transferência de Saída']
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("JOHN DOE", "62", "WAGES", "Despesa"),
+        create_mapping("Diversos", "90", "OUTRAS DESPESAS", "Despesa"),
+    ]
+
+    serial = build_all_entity_cubes(df, mappings, max_workers=1)
+    monkeypatch.setattr(entities, "ENTITY_PARALLEL_MIN_ROWS", 0)
+    monkeypatch.setattr(entities, "_pool", None)
+    try:
+        pooled = build_all_entity_cubes(df, mappings, max_workers=2)
+        assert entities._pool is not None
+    finally:
+        if entities._pool is not None:
+            entities._pool.shutdown()
+
+    for eliminate in (False, True):
+        months, per_entity, consolidated = consolidate(serial, eliminate_intercompany=eliminate)
+        pooled_months, pooled_entity, pooled_consolidated = consolidate(pooled, eliminate_intercompany=eliminate)
+        assert pooled_months == months
+        assert sorted(pooled_entity) == sorted(per_entity)
+        for name in per_entity:
+            np.testing.assert_array_equal(pooled_entity[name], per_entity[name])
+        np.testing.assert_array_equal(pooled_consolidated, consolidated)
+
+
+def test_overrides_flow_through_formula_graph_and_patch():
+    """An overridden cell is a graph input; patching one month equals a full recompute"""
+    from logic import build_monthly_cube, evaluate_pnl_matrix, patch_pnl_matrix
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-02', 'cost_center': 'GOOGLE PLAY'},
+    ])
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    # Row 1 (total revenue) as sent by the P&L table
+    overrides = {"1": {"2024-01": 2000.0}}
+    pnl = calculate_pnl(df, mappings, overrides)
+    assert _find_row_by_description(pnl, "RECEITA OPERACIONAL BRUTA").values == {'2024-01': 2000.0, '2024-02': 1000.0}
+    ebitda = _find_row_by_description(pnl, "(=) EBITDA").values
+    assert ebitda['2024-01'] == 2000.0 - 176.5  # payment processing still follows sales
+    assert next(r for r in pnl.rows if r.line_number == 14).values['2024-01'] == 91.18
+
+    months, values = build_monthly_cube(df, mappings).slice()
+    evaluate_pnl_matrix(values, months, overrides)
+    overrides["13"] = {"2024-02": 50.0}
+    patch_pnl_matrix(values, months, overrides, "13", "2024-02")
+
+    months, expected = build_monthly_cube(df, mappings).slice()
+    evaluate_pnl_matrix(expected, months, overrides)
+    np.testing.assert_array_equal(values, expected)
+    assert expected[111].tolist() == [182350, 5000]
+
+
+def test_batch_override_patch_equals_full_recompute():
+    """Patching a batch of cells one by one gives the same matrix as a rebuild"""
+    from logic import build_monthly_cube, evaluate_pnl_matrix, patch_pnl_matrix
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': f'2024-{m:02d}', 'cost_center': 'GOOGLE PLAY'}
+        for m in range(1, 4)
+    ])
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    months, values = build_monthly_cube(df, mappings).slice()
+    evaluate_pnl_matrix(values, months, {})
+    overrides = {"9": {"2024-01": -100.0, "2024-03": -300.0}, "2": {"2024-02": 5000.0}}
+    for line_key, cells in overrides.items():
+        for month in cells:
+            patch_pnl_matrix(values, months, overrides, line_key, month)
+
+    months, expected = build_monthly_cube(df, mappings).slice()
+    evaluate_pnl_matrix(expected, months, overrides)
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_atomic_write_keeps_previous_file_on_failure(tmp_path):
+    """A failed write leaves the previous artifact intact and no temp files behind"""
+    from storage import atomic_write
+
+    path = tmp_path / "overrides.json"
+    with atomic_write(path) as f:
+        json.dump({"9": {"2024-01": -100.0}}, f)
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write('{"9": {"2024-')
+            raise RuntimeError("crash mid-write")
+
+    assert json.loads(path.read_text()) == {"9": {"2024-01": -100.0}}
+    assert [p.name for p in tmp_path.iterdir()] == ["overrides.json"]
+
+
+def test_parquet_dataset_roundtrip_projects_columns(tmp_path):
+    """The Parquet store restores engine dtypes and loads only the app's columns"""
+    from storage import read_dataset, write_dataset
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'AWS', 'value': -250.5, 'month': '2024-02', 'cost_center': 'WEB SERVICES'},
+    ])
+    df['Valor_Centavos'] = (df['Valor_Num'] * 100).round().astype(np.int64)
+    df['Saldo conta (R$)'] = ['1,00', '2,00']
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+
+    write_dataset(df, tmp_path / "dataset", version=1)
+    loaded = read_dataset(tmp_path / "dataset")
+
+    assert 'Saldo conta (R$)' not in loaded.columns
+    assert isinstance(loaded['Mes_Competencia'].dtype, pd.PeriodDtype)
+    assert loaded['Valor_Centavos'].tolist() == [100000, -25050]
+    assert calculate_pnl(loaded, mappings).model_dump() == calculate_pnl(df, mappings).model_dump()
+
+
+def test_month_partitions_prune_reads_and_append_one_month(tmp_path):
+    """Reads load only the requested months; an append writes only its partition"""
+    from logic import TransactionStore
+    from storage import dataset_months, load_manifest, read_dataset, write_dataset
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 100.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'AWS', 'value': -20.0, 'month': '2024-02', 'cost_center': 'WEB SERVICES'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 300.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+    ])
+    root = tmp_path / "dataset"
+    assert write_dataset(df, root, version=1) == ['2024-01', '2024-02']
+    january = root / load_manifest(root)["partitions"]["2024-01"]["file"]
+    written_at = january.stat().st_mtime_ns
+
+    assert read_dataset(root, months=['2024-01'])['Valor_Num'].tolist() == [100.0, 300.0]
+
+    february = create_test_dataframe([{'supplier': 'AWS', 'value': -50.0, 'month': '2024-02', 'cost_center': 'WEB SERVICES'}])
+    assert write_dataset(february, root, version=2, months=['2024-02']) == ['2024-02']
+    assert january.stat().st_mtime_ns == written_at
+    assert dataset_months(root) == ['2024-01', '2024-02']
+
+    store = TransactionStore(read_dataset(root))
+    assert store.df['Valor_Num'].iloc[store.month_rows('2024-02')].tolist() == [-50.0]
+    assert store.month_rows('2023-12').tolist() == []
+
+
+def test_drilldown_sqlite_index_matches_in_memory_query(tmp_path):
+    """Indexed drilldowns return the rows behind a P&L line, like the in-memory query"""
+    from logic import TransactionStore, classify_transactions
+    from pnl_formulas import source_lines
+    from transaction_index import TransactionIndex, query_store
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'APPLE', 'value': 500.0, 'month': '2024-01', 'cost_center': 'APP STORE'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 700.0, 'month': '2024-02', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'AWS', 'value': -80.0, 'month': '2024-02', 'cost_center': 'WEB SERVICES'},
+    ])
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("APPLE", "33", "APP STORE", "Receita"),
+    ]
+    store = TransactionStore(df)
+    lines = classify_transactions(store, mappings)
+    index = TransactionIndex(tmp_path / "transactions.sqlite")
+    index.sync(store, lines, dataset_version=1, mappings_fp="a")
+
+    assert source_lines(101) == [25, 33]
+    for filters in [dict(), dict(month='2024-01'), dict(search='apple'), dict(sort='-valor', limit=1, offset=1)]:
+        page, count, total = index.query(source_lines(101), **filters)
+        expected = query_store(store, lines, source_lines(101), **filters)
+        pd.testing.assert_frame_equal(page, expected[0], check_dtype=False)
+        assert (count, total) == expected[1:]
+
+    assert index.query([25], month='2024-02')[1:] == (1, {25: 70000})
+
+    # New mappings only rewrite the changed lines
+    mappings[1] = create_mapping("APPLE", "25", "APP STORE", "Receita")
+    index.sync(store, classify_transactions(store, mappings), dataset_version=1, mappings_fp="b")
+    assert index.state() == (1, "b")
+    assert index.query([25], month='2024-01')[1:] == (2, {25: 150000})
+
+
+def test_duckdb_pivot_over_month_partitions(tmp_path):
+    """Pivots group dimensions x month over the Parquet partitions, with filters and a month range"""
+    from analytics import run_pivot
+    from models import PivotRequest
+    from storage import write_dataset
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'AWS', 'value': -250.5, 'month': '2024-01', 'cost_center': 'WEB SERVICES'},
+        {'supplier': 'AWS', 'value': -100.0, 'month': '2024-02', 'cost_center': 'WEB SERVICES'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 400.0, 'month': '2024-03', 'cost_center': 'GOOGLE PLAY'},
+    ])
+    df['Valor_Centavos'] = (df['Valor_Num'] * 100).round().astype(np.int64)
+    df['Situação'] = ['Quitado', 'Quitado', 'Em aberto', 'Quitado']
+    write_dataset(df, tmp_path / "dataset", version=1)
+
+    pivot = run_pivot(tmp_path / "dataset", PivotRequest(
+        dimensions=['centro_custo'], measures=['total', 'count'],
+        filters={'situacao': ['Quitado']}, end_month='2024-02',
+    ))
+    assert pivot.headers == ['2024-01']
+    assert [(r.dimensions['centro_custo'], r.totals['total'], r.totals['count']) for r in pivot.rows] == [
+        ('GOOGLE PLAY', 1000.0, 1.0), ('WEB SERVICES', -250.5, 1.0)
+    ]
+
+    overall = run_pivot(tmp_path / "dataset", PivotRequest(measures=['entradas', 'saidas']))
+    assert overall.rows[0].values['saidas'] == {'2024-01': -250.5, '2024-02': -100.0, '2024-03': 0.0}
+    assert overall.rows[0].totals == {'entradas': 1400.0, 'saidas': -350.5}
+
+    with pytest.raises(ValueError):
+        run_pivot(tmp_path / "dataset", PivotRequest(dimensions=['conta']))
+    # Month bounds are compared as strings, so anything but 'YYYY-MM' is rejected
+    for bad in ['2024-1', '2024-13', '2024-02-15', "2024' OR 1=1"]:
+        with pytest.raises(ValueError, match='YYYY-MM'):
+            run_pivot(tmp_path / "dataset", PivotRequest(measures=['total'], start_month=bad))
+        with pytest.raises(ValueError, match='YYYY-MM'):
+            run_pivot(tmp_path / "dataset", PivotRequest(measures=['total'], end_month=bad))
+
+
+def test_snapshots_share_unchanged_partitions_and_diff(tmp_path):
+    """A reupload writes only changed months; the diff shows what moved"""
+    from logic import build_monthly_cube, diff_pnl_matrices
+    from storage import load_manifest, read_dataset, write_dataset
+
+    rows = [
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'GOOGLE CLOUD', 'value': 2000.0, 'month': '2024-02', 'cost_center': 'GOOGLE PLAY'},
+    ]
+    root = tmp_path / "dataset"
+    assert write_dataset(create_test_dataframe(rows), root, version=1) == ['2024-01', '2024-02']
+    rows[1]['value'] = 2500.0
+    assert write_dataset(create_test_dataframe(rows), root, version=2) == ['2024-02']
+
+    first, second = load_manifest(root, 1)["partitions"], load_manifest(root, 2)["partitions"]
+    assert first['2024-01'] == second['2024-01']
+    assert first['2024-02'] != second['2024-02']
+    assert len(list(root.glob("Mes_Competencia=*/*.parquet"))) == 3
+
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    months, diff = diff_pnl_matrices(
+        build_monthly_cube(read_dataset(root, version=1), mappings),
+        build_monthly_cube(read_dataset(root, version=2), mappings),
+    )
+    assert months == ['2024-01', '2024-02']
+    assert diff[100].tolist() == [0, 50000]
+    assert diff[102].tolist() == [0, -8825]  # payment processing follows revenue
+
+
+def test_closed_month_keeps_frozen_aggregates():
+    """A closed month ignores later mapping edits; open months follow them"""
+    from logic import TransactionStore, build_daily_cube, build_monthly_cube, classify_transactions
+    from period_close import freeze_month
+
+    dates = pd.to_datetime(['2024-01-05', '2024-01-25', '2024-02-10'])
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'cost_center': 'GOOGLE PLAY'} for v in [10.0, 20.0, 40.0]
+    ])
+    df['Data de competência'] = dates
+    df['Mes_Competencia'] = dates.to_period('M')
+    store = TransactionStore(df)
+    before = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    closed = json.loads(json.dumps({'2024-01': freeze_month(store, classify_transactions(store, before), '2024-01')}))
+
+    after = [create_mapping("GOOGLE", "33", "GOOGLE PLAY", "Receita")]
+    cube = build_monthly_cube(store, after, closed=closed)
+    assert cube.months == ['2024-01', '2024-02']
+    assert cube.values[25].tolist() == [3000, 0]
+    assert cube.values[33].tolist() == [0, 4000]
+
+    # A date filter inside the closed month uses its frozen days
+    months, values = cube.slice('2024-01-10', '2024-02-28')
+    assert months == ['2024-01', '2024-02']
+    assert values[25].tolist() == [2000, 0]
+
+    labels, daily = build_daily_cube(store, after, closed=closed).rollup("month")
+    assert labels == ['2024-01', '2024-02']
+    assert np.array_equal(daily, cube.values)
+
+
+def test_closed_month_rows_keep_close_time_lines_in_entities_and_drilldown():
+    """Entity consolidation and drilldowns report a closed month as the P&L does"""
+    from entities import build_all_entity_cubes, consolidate
+    from logic import TransactionStore, build_monthly_cube, classify_transactions, evaluate_pnl_matrix
+    from period_close import freeze_month, reported_lines
+    from pnl_formulas import line_value
+    from transaction_index import query_store
+
+    dates = pd.to_datetime(['2024-01-05', '2024-01-25', '2024-02-10'])
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': v, 'cost_center': 'GOOGLE PLAY'} for v in [10.0, 20.0, 40.0]
+    ])
+    df['Data de competência'] = dates
+    df['Mes_Competencia'] = dates.to_period('M')
+    df['Conta bancária'] = ['Banco A', 'Banco B', 'Banco A']
+    store = TransactionStore(df)
+    before = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    frozen = freeze_month(store, classify_transactions(store, before), '2024-01')
+    closed = json.loads(json.dumps({'2024-01': {**frozen, "partition": "2024-01/a.parquet"}}))
+
+    # Remapped after the close: the P&L keeps January on line 25
+    after = [create_mapping("GOOGLE", "90", "GOOGLE PLAY", "Despesa")]
+    months, expected = build_monthly_cube(store, after, closed=closed).slice()
+    evaluate_pnl_matrix(expected, months)
+
+    for partitions, listed in [({'2024-01': "2024-01/a.parquet"}, 2), ({'2024-01': "2024-01/b.parquet"}, 0)]:
+        lines, without_rows = reported_lines(store, classify_transactions(store, after), closed, partitions)
+        assert without_rows == ([] if listed else ['2024-01'])
+
+        cubes = build_all_entity_cubes(df, after, max_workers=1, lines=lines)
+        _, per_entity, consolidated = consolidate(cubes, frozen={m: closed[m] for m in without_rows})
+        evaluate_pnl_matrix(consolidated, months)
+        np.testing.assert_array_equal(consolidated, expected)
+        if listed:
+            assert per_entity['Banco B'][25].tolist() == [2000, 0]
+
+        page, count, totals = query_store(store, lines, [25], month='2024-01')
+        assert count == listed
+        if listed:
+            assert line_value(112, totals) == expected[112, 0]
+        assert query_store(store, lines, [90], month='2024-01')[1] == 0
+
+
+def test_concurrent_requests_share_one_dataset_load(tmp_path, monkeypatch):
+    """Callers wait on the in-flight load; a missing dataset is not looked up again"""
+    import threading
+    import time
+
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        time.sleep(0.05)
+        return None
+
+    monkeypatch.setattr(main, "load_dataset", slow_load)
+    monkeypatch.setattr(main, "current_df", None)
+    monkeypatch.setattr(main, "dataset_missing", False)
+
+    threads = [threading.Thread(target=main.ensure_dataset) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert main.ensure_dataset() is None
+    assert len(calls) == 1
+
+
+def test_worker_reloads_state_changed_by_another_worker(tmp_path, monkeypatch):
+    """A version bump in the shared state file makes other workers reload that part"""
+    monkeypatch.chdir(tmp_path)
+    import main
+    from storage import bump_versions
+
+    (tmp_path / "data").mkdir()
+    for name in ("seen_versions", "current_mappings", "current_overrides", "current_closed",
+                 "stored_dashboards", "dataset_version", "dataset_missing"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "current_df", pd.DataFrame({'Valor_Num': [1.0]}))
+
+    # Another worker saves mappings and bumps their version
+    mapping = create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")
+    (tmp_path / "data" / "mappings.json").write_text(json.dumps([mapping.model_dump()]))
+    bump_versions(main.STATE_PATH, "mappings")
+    main.sync_state()
+    assert main.current_mappings == [mapping]
+    assert main.current_df is not None
+
+    bump_versions(main.STATE_PATH, "dataset")
+    main.sync_state()
+    assert main.current_df is None
+    assert main.seen_versions == {"mappings": 1, "dataset": 1}
+
+
+def test_drilldown_total_equals_pnl_cell_for_every_row():
+    """Evaluating a row's formula over its drilled-down transactions gives the P&L cell"""
+    from logic import TransactionStore, classify_transactions
+    from pnl_formulas import PNL_LAYOUT, RATIO_LINES, line_value, override_line, source_lines
+    from transaction_index import query_store
+
+    df = create_test_dataframe([
+        {'supplier': 'GOOGLE CLOUD', 'value': 1000.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'},
+        {'supplier': 'APPLE', 'value': 333.33, 'month': '2024-01', 'cost_center': 'APP STORE'},
+        {'supplier': 'BANCO', 'value': 12.5, 'month': '2024-01', 'cost_center': 'INVESTIMENTOS'},
+        {'supplier': 'AWS', 'value': -80.0, 'month': '2024-01', 'cost_center': 'WEB SERVICES'},
+        {'supplier': 'META ADS', 'value': -250.0, 'month': '2024-01', 'cost_center': 'MARKETING'},
+        {'supplier': 'FOLHA', 'value': -400.0, 'month': '2024-01', 'cost_center': 'WAGES'},
+        {'supplier': 'CONTADOR', 'value': -45.0, 'month': '2024-01', 'cost_center': 'OUTROS'},
+    ])
+    mappings = [
+        create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita"),
+        create_mapping("APPLE", "33", "APP STORE", "Receita"),
+        create_mapping("BANCO", "38", "INVESTIMENTOS", "Receita"),
+        create_mapping("AWS", "43", "WEB SERVICES"),
+        create_mapping("META", "56", "MARKETING"),
+        create_mapping("FOLHA", "62", "WAGES"),
+        create_mapping("CONTADOR", "90", "OUTROS"),
+    ]
+    pnl = calculate_pnl(df, mappings)
+    cells = {row.line_number: row.values['2024-01'] for row in pnl.rows}
+    store = TransactionStore(df)
+    lines = classify_transactions(store, mappings)
+
+    for item in PNL_LAYOUT:
+        line = override_line(item["row"])
+        if line in RATIO_LINES:
+            continue
+        _, _, totals = query_store(store, lines, source_lines(line), month='2024-01')
+        assert line_value(line, totals) / 100 == pytest.approx(cells[item["row"]], abs=1e-9), item["description"]
+
+
+def test_reclosing_a_month_does_not_reuse_the_previous_freeze(tmp_path, monkeypatch):
+    """Close, edit mappings, reopen and close again: the cube shows the second freeze"""
+    monkeypatch.chdir(tmp_path)
+    import main
+    from pnl_cache import LRUCache
+    from period_close import freeze_month
+
+    df = create_test_dataframe([{'supplier': 'GOOGLE CLOUD', 'value': 10.0, 'month': '2024-01', 'cost_center': 'GOOGLE PLAY'}])
+    monkeypatch.setattr(main, "current_df", df)
+    monkeypatch.setattr(main, "dataset_version", 1)
+    monkeypatch.setattr(main, "current_mappings", [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")])
+    monkeypatch.setattr(main, "current_closed", {})
+    monkeypatch.setattr(main, "store_cache", LRUCache(maxsize=1))
+    monkeypatch.setattr(main, "cube_cache", LRUCache(maxsize=8))
+
+    def close():
+        main.current_closed = {'2024-01': freeze_month(main.get_store(), main.get_lines(), '2024-01')}
+
+    close()
+    main.current_mappings = [create_mapping("GOOGLE", "33", "GOOGLE PLAY", "Receita")]
+    assert main.get_cube().values[25].tolist() == [1000]
+    main.current_closed = {}
+    close()
+    assert main.get_cube().values[25].tolist() == [0]
+    assert main.get_cube().values[33].tolist() == [1000]
+
+
+def test_failed_dataset_read_is_not_cached_as_missing(tmp_path, monkeypatch):
+    """Only an empty dataset directory sets the negative cache; read errors are retried"""
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    monkeypatch.setattr(main, "current_df", None)
+    monkeypatch.setattr(main, "dataset_missing", False)
+    monkeypatch.setattr(main, "load_dataset", lambda: None)  # a read that failed
+
+    monkeypatch.setattr(main, "dataset_months", lambda root: ['2024-01'])
+    assert main.ensure_dataset() is None
+    assert main.dataset_missing is False
+
+    monkeypatch.setattr(main, "dataset_months", lambda root: [])
+    assert main.ensure_dataset() is None
+    assert main.dataset_missing is True
+
+
+def test_every_budgeted_layout_row_gets_a_budget():
+    """Each plan item lands on the line its P&L row displays"""
+    from budget import PLAN_LINES, load_budget
+    from pnl_formulas import PNL_LAYOUT
+
+    plan = '*Tudo deve estar em Regime de Competência,UNIT,01/2024\n' + ''.join(
+        f'{label.title()},BRL,"R$100,00"\n' for label in PLAN_LINES
+    )
+    budget = load_budget(plan.encode('utf-8'))
+
+    # Plan lines are all displayed, and with every item budgeted no row is left at 0
+    assert {item["line"] for item in PNL_LAYOUT} >= {line for line, _ in PLAN_LINES.values()}
+    for item in PNL_LAYOUT:
+        assert budget.values[item["line"], 0] != 0, item["description"]
+
+
+def test_cold_start_serves_stored_dashboard_until_its_key_changes(tmp_path, monkeypatch):
+    """A matching stored dashboard is served without loading; any state change forces the load"""
+    from logic import TransactionStore, classify_transactions
+    from period_close import freeze_month
+
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    (tmp_path / "data").mkdir(exist_ok=True)
+    df = create_test_dataframe([{'supplier': 'GOOGLE CLOUD', 'value': 100.0, 'cost_center': 'GOOGLE PLAY'}])
+    df['Data de competência'] = pd.to_datetime(['2024-01-15'])
+    store = TransactionStore(df)
+    loads = []
+
+    def load():
+        loads.append(1)
+        main.current_df = df
+        return df
+
+    monkeypatch.setattr(main, "load_dataset", load)
+    for name in ("current_mappings", "current_overrides", "current_closed", "stored_dashboards", "dataset_missing"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "dataset_version", 9048)
+    monkeypatch.setattr(main, "current_df", None)
+
+    # Warm up: the first request loads and stores the dashboard
+    data = main.get_dashboard("month", {})
+    assert len(loads) == 1
+    saved = (main.current_mappings, main.current_overrides, main.current_closed, main.dataset_version)
+
+    # A fresh worker with the same state serves it without touching the dataset
+    main.current_df = None
+    assert main.get_dashboard("month", {}) == data
+    assert len(loads) == 1
+
+    changes = [
+        ("current_mappings", main.current_mappings + [create_mapping("APPLE", "26", "APPLE STORE", "Receita")]),
+        ("current_overrides", {"25": {"2024-01": 1.0}}),
+        ("current_closed", {"2024-01": freeze_month(store, classify_transactions(store, main.current_mappings), "2024-01")}),
+        ("dataset_version", 9049),
+    ]
+    for name, value in changes:
+        main.current_mappings, main.current_overrides, main.current_closed, main.dataset_version = saved
+        monkeypatch.setattr(main, "stored_dashboards", {"month": {"key": main.dashboard_key("month"), "data": data.model_dump()}})
+        main.current_df = None
+        setattr(main, name, value)
+        before = len(loads)
+        main.get_dashboard("month", {})
+        assert len(loads) == before + 1, name
+
+
+def test_single_cell_override_is_validated_and_replaces_the_dict(tmp_path, monkeypatch):
+    """/pnl/override goes through the batch path: 400 on a bad cell, copy-then-replace on a good one"""
+    from fastapi import HTTPException
+
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    (tmp_path / "data").mkdir(exist_ok=True)
+    for name in ("current_closed", "seen_versions"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "current_overrides", {"9": {"2024-01": 1.0}})
+
+    for bad in [{"line_number": 9999, "month": "2024-01", "value": 1}, {"line_number": 9, "month": "jan", "value": 1},
+                {"line_number": 9, "month": "2024-01", "value": "abc"}]:
+        with pytest.raises(HTTPException) as error:
+            main.update_pnl_override(bad)
+        assert error.value.status_code == 400
+
+    before = main.current_overrides
+    main.update_pnl_override({"line_number": 9, "month": "2024-02", "value": 5})
+    assert before == {"9": {"2024-01": 1.0}}
+    assert main.current_overrides == {"9": {"2024-01": 1.0, "2024-02": 5.0}}
+
+
+def test_malformed_date_range_is_a_bad_request(tmp_path, monkeypatch):
+    """Date bounds are checked as YYYY-MM-DD before any data is read"""
+    from fastapi import HTTPException
+    from models import Scenario, ScenarioRequest
+    from storage import is_date
+
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    assert is_date('2024-02-29') and not is_date('2023-02-29') and not is_date('2024-1-05') and not is_date('')
+    for start, end in [('2024-13-01', None), (None, 'yesterday'), ('2024-01-01', '2024-01-01T00:00')]:
+        with pytest.raises(HTTPException) as error:
+            main.get_pnl_variance(start_date=start, end_date=end, current_user={})
+        assert error.value.status_code == 400
+        with pytest.raises(HTTPException) as error:
+            main.run_pnl_scenarios(ScenarioRequest(scenarios=[Scenario(name="base")], start_date=start, end_date=end), current_user={})
+        assert error.value.status_code == 400
+
+
+def test_mappings_fingerprint_is_computed_once_per_change(tmp_path, monkeypatch):
+    """The mappings hash is memoized on the list, and a new list gets a new hash"""
+    from pnl_cache import fingerprint
+
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    mappings = [create_mapping("GOOGLE", "25", "GOOGLE PLAY", "Receita")]
+    monkeypatch.setattr(main, "current_mappings", mappings)
+    hashed = []
+    monkeypatch.setattr(main, "fingerprint", lambda value: hashed.append(value) or fingerprint(value))
+
+    first = main.mappings_fingerprint()
+    assert main.mappings_fingerprint() == first
+    assert len(hashed) == 1
+
+    monkeypatch.setattr(main, "current_mappings", mappings + [create_mapping("APPLE", "33", "APP STORE", "Receita")])
+    assert main.mappings_fingerprint() != first
+    assert len(hashed) == 2
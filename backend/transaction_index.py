@@ -0,0 +1,226 @@
+"""
+Transaction drilldown and search.
+
+A drilldown lists the transactions classified into the base lines of a P&L
+line (optionally one month), filtered by cost center, supplier or free text,
+sorted and paginated. Amounts of the matching rows are also totalled per
+base line, so the caller can evaluate the P&L line's formula over them.
+
+By default the query runs over the in-memory TransactionStore using its
+per-month row index. With TRANSACTION_INDEX=sqlite the transactions are
+also written at ingest to a local SQLite file together with their
+classified line, indexed on (month, line), line, cost center and supplier,
+and drilldowns run as indexed queries. The file is rebuilt for a new dataset
+version and only the changed lines are rewritten when the mappings change.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from storage import file_lock
+
+SQLITE_TRANSACTION_INDEX = os.getenv("TRANSACTION_INDEX", "memory").lower() == "sqlite"
+
+# Sort keys accepted by the API ("-" prefix for descending) -> column
+SORT_COLUMNS = {
+    "date": "date",
+    "valor": "valor_centavos",
+    "fornecedor": "fornecedor",
+    "centro_custo": "centro_custo",
+}
+
+# Columns of a drilldown page
+PAGE_COLUMNS = ["date", "month", "centro_custo", "fornecedor", "descricao", "valor_centavos", "categoria"]
+
+
+def _text(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    return df[column].fillna('').astype(str)
+
+
+def transaction_frame(store, rows: np.ndarray) -> pd.DataFrame:
+    """Drilldown columns of the store's rows at the given positions."""
+    df = store.df.iloc[rows]
+    dates = pd.to_datetime(df['Data de competência'], errors='coerce') if 'Data de competência' in df.columns else pd.Series(pd.NaT, index=df.index)
+    month_pos = store.month_pos[rows]
+    months = np.array(store.months + [''], dtype=object)
+    return pd.DataFrame({
+        "row": rows,
+        "date": dates.dt.strftime('%Y-%m-%d').fillna('').to_numpy(),
+        "month": months[month_pos],
+        "centro_custo": _text(df, 'Centro de Custo 1').to_numpy(),
+        "fornecedor": _text(df, 'Nome do fornecedor/cliente').to_numpy(),
+        "descricao": _text(df, 'Descrição').to_numpy(),
+        "valor_centavos": store.amounts[rows],
+        "categoria": _text(df, 'Plano de contas').to_numpy(),
+    })
+
+
+def query_store(
+    store,
+    lines: np.ndarray,
+    sources: List[int],
+    month: str = None,
+    cost_center: str = None,
+    supplier: str = None,
+    search: str = None,
+    sort: str = None,
+    limit: int = None,
+    offset: int = 0,
+) -> Tuple[pd.DataFrame, int, Dict[int, int]]:
+    """In-memory drilldown: (page, matching rows, {base line: total centavos of its matching rows})."""
+    rows = store.month_rows(month) if month else np.arange(len(store))
+    rows = rows[np.isin(lines[rows], sources)]
+    frame = transaction_frame(store, rows)
+    frame["linha_pl"] = lines[rows]
+
+    keep = np.ones(len(frame), dtype=bool)
+    if cost_center:
+        keep &= (frame["centro_custo"].str.lower() == cost_center.lower()).to_numpy()
+    if supplier:
+        keep &= (frame["fornecedor"].str.lower() == supplier.lower()).to_numpy()
+    if search:
+        text = (frame["fornecedor"] + " " + frame["descricao"]).str.lower()
+        keep &= text.str.contains(search.lower(), regex=False).to_numpy()
+    frame = frame[keep]
+
+    if sort:
+        frame = frame.sort_values(SORT_COLUMNS[sort.lstrip('-')], ascending=not sort.startswith('-'), kind='stable')
+    totals = {int(line): int(total) for line, total in frame.groupby("linha_pl")["valor_centavos"].sum().items()}
+    end = None if limit is None else offset + limit
+    return frame.iloc[offset:end][PAGE_COLUMNS].reset_index(drop=True), len(frame), totals
+
+
+class TransactionIndex:
+    """SQLite file of the transactions and their classified lines."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def _connect(self, path: Path = None) -> sqlite3.Connection:
+        return sqlite3.connect(path or self.path)
+
+    def state(self) -> Optional[Tuple[int, str]]:
+        """(dataset version, mappings fingerprint) the file reflects, None if missing."""
+        if not self.path.exists():
+            return None
+        try:
+            with self._connect() as conn:
+                meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            return int(meta["dataset_version"]), meta["mappings_fp"]
+        except (sqlite3.Error, KeyError, ValueError):
+            return None
+
+    def sync(self, store, lines: np.ndarray, dataset_version: int, mappings_fp: str):
+        """
+        Rebuild for a new dataset version, or rewrite the lines that changed.
+        Workers sharing the file take turns, and later ones find it up to date.
+        """
+        with self._lock, file_lock(self.path.with_name(f".{self.path.name}.lock")):
+            state = self.state()
+            if state is None or state[0] != dataset_version:
+                self._build(store, lines, dataset_version, mappings_fp)
+            elif state[1] != mappings_fp:
+                self._update_lines(lines, mappings_fp)
+
+    def _build(self, store, lines: np.ndarray, dataset_version: int, mappings_fp: str):
+        # Built next to the target and renamed over it, so readers never see a partial file
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        frame = transaction_frame(store, np.arange(len(store)))
+        frame["linha_pl"] = lines
+        frame["centro_custo_key"] = frame["centro_custo"].str.lower()
+        frame["fornecedor_key"] = frame["fornecedor"].str.lower()
+        frame["search_text"] = (frame["fornecedor"] + " " + frame["descricao"]).str.lower()
+
+        with self._connect(tmp_path) as conn:
+            conn.executescript("""
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE transactions (
+                    row INTEGER PRIMARY KEY, linha_pl INTEGER, date TEXT, month TEXT,
+                    centro_custo TEXT, fornecedor TEXT, descricao TEXT, valor_centavos INTEGER,
+                    categoria TEXT, centro_custo_key TEXT, fornecedor_key TEXT, search_text TEXT
+                );
+            """)
+            columns = ["row", "linha_pl", "date", "month", "centro_custo", "fornecedor", "descricao",
+                       "valor_centavos", "categoria", "centro_custo_key", "fornecedor_key", "search_text"]
+            conn.executemany(
+                f"INSERT INTO transactions ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                frame[columns].astype(object).itertuples(index=False, name=None),
+            )
+            conn.executescript("""
+                CREATE INDEX idx_month_line ON transactions (month, linha_pl);
+                CREATE INDEX idx_line ON transactions (linha_pl);
+                CREATE INDEX idx_cost_center ON transactions (centro_custo_key);
+                CREATE INDEX idx_supplier ON transactions (fornecedor_key);
+            """)
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("dataset_version", str(dataset_version)), ("mappings_fp", mappings_fp),
+            ])
+        conn.close()
+        os.replace(tmp_path, self.path)
+
+    def _update_lines(self, lines: np.ndarray, mappings_fp: str):
+        with self._connect() as conn:
+            stored = np.array([line for (line,) in conn.execute("SELECT linha_pl FROM transactions ORDER BY row")], dtype=np.int64)
+            changed = np.flatnonzero(stored != lines)
+            conn.executemany(
+                "UPDATE transactions SET linha_pl = ? WHERE row = ?",
+                zip(lines[changed].tolist(), changed.tolist()),
+            )
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'mappings_fp'", (mappings_fp,))
+        conn.close()
+
+    def query(
+        self,
+        sources: List[int],
+        month: str = None,
+        cost_center: str = None,
+        supplier: str = None,
+        search: str = None,
+        sort: str = None,
+        limit: int = None,
+        offset: int = 0,
+    ) -> Tuple[pd.DataFrame, int, Dict[int, int]]:
+        """Indexed drilldown: (page, matching rows, {base line: total centavos of its matching rows})."""
+        where = [f"linha_pl IN ({', '.join('?' * len(sources))})"]
+        params = list(sources)
+        if month:
+            where.append("month = ?")
+            params.append(month)
+        if cost_center:
+            where.append("centro_custo_key = ?")
+            params.append(cost_center.lower())
+        if supplier:
+            where.append("fornecedor_key = ?")
+            params.append(supplier.lower())
+        if search:
+            where.append("instr(search_text, ?) > 0")
+            params.append(search.lower())
+        condition = " AND ".join(where)
+
+        order = "row"
+        if sort:
+            order = f"{SORT_COLUMNS[sort.lstrip('-')]} {'DESC' if sort.startswith('-') else 'ASC'}, row"
+
+        with self._connect() as conn:
+            by_line = conn.execute(
+                f"SELECT linha_pl, COUNT(*), SUM(valor_centavos) FROM transactions WHERE {condition} GROUP BY linha_pl", params
+            ).fetchall()
+            page = pd.read_sql_query(
+                f"SELECT {', '.join(PAGE_COLUMNS)} FROM transactions WHERE {condition} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?",
+                conn, params=params + [-1 if limit is None else limit, offset],
+            )
+        conn.close()
+        return page, sum(count for _, count, _ in by_line), {int(line): int(total) for line, _, total in by_line}
@@ -1,6 +1,6 @@
 import { useEffect, useState } from 'react';
 import api from '../api';
-import { Save, Plus, Trash2, Search, RefreshCw } from 'lucide-react';
+import { Save, Plus, Trash2, Search, RefreshCw, Sparkles } from 'lucide-react';
 import { GlassCard } from './ui/GlassCard';
 import { motion, AnimatePresence } from 'framer-motion';
 
@@ -38,7 +38,10 @@ const translations = {
         success: 'Mapeamentos salvos com sucesso!',
         error: 'Erro ao salvar mapeamentos.',
         resetMappings: 'Resetar Padrão',
-        confirmReset: 'Tem certeza que deseja resetar os mapeamentos para o padrão?'
+        confirmReset: 'Tem certeza que deseja resetar os mapeamentos para o padrão?',
+        suggest: 'Sugerir Mapeamentos',
+        noSuggestions: 'Nenhuma transação sem mapeamento para sugerir.',
+        suggestError: 'Erro ao gerar sugestões.'
     },
     en: {
         title: 'Mapping Manager',
@@ -59,7 +62,10 @@ const translations = {
         success: 'Mappings saved successfully!',
         error: 'Error saving mappings.',
         resetMappings: 'Reset Defaults',
-        confirmReset: 'Are you sure you want to reset mappings to default?'
+        confirmReset: 'Are you sure you want to reset mappings to default?',
+        suggest: 'Suggest Mappings',
+        noSuggestions: 'No unmapped transactions to suggest.',
+        suggestError: 'Error generating suggestions.'
     }
 };
 
@@ -111,6 +117,22 @@ export default function MappingManager({ language }: MappingManagerProps) {
         setHasUnsavedChanges(true);
     };
 
+    const handleSuggest = async () => {
+        try {
+            const response = await api.get('/mappings/suggestions');
+            const suggested: MappingItem[] = response.data.map((s: { mapping: MappingItem }) => s.mapping);
+            if (suggested.length === 0) {
+                alert(t.noSuggestions);
+                return;
+            }
+            setMappings([...suggested, ...mappings]);
+            setHasUnsavedChanges(true);
+        } catch (error) {
+            console.error('Error fetching suggestions:', error);
+            alert(t.suggestError);
+        }
+    };
+
     const handleDelete = (index: number) => {
         const newMappings = [...mappings];
         newMappings.splice(index, 1);
@@ -167,6 +189,13 @@ export default function MappingManager({ language }: MappingManagerProps) {
                         <RefreshCw size={18} />
                         {t.resetMappings || 'Reset'}
                     </button>
+                    <button
+                        onClick={handleSuggest}
+                        className="btn-secondary flex items-center gap-2"
+                    >
+                        <Sparkles size={18} />
+                        {t.suggest}
+                    </button>
                     <button
                         onClick={handleAdd}
                         className="btn-secondary flex items-center gap-2"